@@ -1,15 +1,19 @@
 import os
 import shutil
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, abort, session, send_file
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, abort, session, send_file, Response
 from werkzeug.utils import secure_filename
 from datetime import datetime
-import whoosh.qparser
 import time
 
-from config import PDF_DIR, DATA_DIR, INDEX_DIR
-from modules.pdf_extractor import PDFExtractor
-from modules.storage import DataStorage
-from modules.search import SearchEngine
+from config import (PDF_DIR, DATA_DIR, INDEX_DIR, WARMUP, QUERY_LOG, WARMUP_QUERIES, EXTRACT_WORKERS,
+                    UPLOAD_CHUNK_SIZE, DOCUMENTS_PAGE_SIZE, DASHBOARD_DOCUMENTS, INDEXER_ADDRESS, INDEXER_AUTHKEY,
+                    INDEXER_CONNECT_TIMEOUT, STREAM_CHUNK_SIZE, EXPORT_MAX_RESULTS)
+from modules.extraction_cache import save_stream
+from modules.uploads import UploadError, receive_body, receive_multipart
+from modules.services import Services
+from modules.indexer import Indexer, IndexerClient
+from modules.warmup import QueryLog, IndexWarmer
 from modules.export import ExportManager
 
 app = Flask(__name__)
@@ -17,10 +21,49 @@ app.secret_key = os.urandom(24)
 app.config['UPLOAD_FOLDER'] = PDF_DIR
 app.config['MAX_CONTENT_LENGTH'] = 10000 * 1024 * 1024  # Increase to 10000MB max upload
 
-# Initialize modules
-pdf_extractor = PDFExtractor(PDF_DIR)
-data_storage = DataStorage(DATA_DIR)
-search_engine = SearchEngine(INDEX_DIR)
+# Initialize modules (shared with the command line tool in cli.py); with an
+# indexer process this worker only reads the index
+services = Services(read_only=bool(INDEXER_ADDRESS))
+extraction_pool = services.extraction_pool
+quarantine = services.quarantine
+extraction_cache = services.extraction_cache
+data_storage = services.data_storage
+layout_store = services.layout_store
+document_catalog = services.document_catalog
+search_engine = services.search_engine
+similarity_index = services.similarity_index
+# Ingests files from streaming uploads while the rest of the request is still arriving
+ingest_executor = ThreadPoolExecutor(max_workers=EXTRACT_WORKERS, thread_name_prefix='ingest')
+
+# Every index write goes through the indexer. It runs in this process, or, when
+# the app runs with several workers, in the indexer process (indexer.py)
+if INDEXER_ADDRESS:
+    indexer = IndexerClient(INDEXER_ADDRESS, INDEXER_AUTHKEY.encode() or None, connect_timeout=INDEXER_CONNECT_TIMEOUT)
+else:
+    indexer = Indexer(services)
+
+# Warm the index up before the load balancer sends traffic (see /healthz/ready)
+query_log = QueryLog(QUERY_LOG)
+index_warmer = IndexWarmer(search_engine, query_log.top(WARMUP_QUERIES))
+index_warmer.ready = not WARMUP
+
+_started = False
+
+def create_app():
+    """Start the background threads and return the Flask app.
+
+    Importing this module only sets things up; servers call this once in each
+    worker process (e.g. gunicorn 'app:create_app()'), so the threads start
+    after the worker has been forked.
+    """
+    global _started
+    if not _started:
+        _started = True
+        if isinstance(indexer, Indexer):
+            indexer.start()
+        if WARMUP:
+            index_warmer.start()
+    return app
 
 # Add this template filter to convert timestamps to readable dates
 @app.template_filter('timestamp_to_date')
@@ -40,24 +83,12 @@ def pluralize(count, singular, plural=None):
 
 @app.route('/')
 def index():
-    # List PDFs in the directory with file sizes
-    pdf_files = []
-    for f in os.listdir(PDF_DIR):
-        if f.lower().endswith('.pdf'):
-            file_path = os.path.join(PDF_DIR, f)
-            try:
-                file_size = os.path.getsize(file_path)
-                pdf_files.append({
-                    'name': f,
-                    'size': file_size,
-                    'date_modified': os.path.getmtime(file_path)
-                })
-            except (FileNotFoundError, PermissionError):
-                # Skip files with permission issues
-                continue
+    # Totals and the most recent PDFs come from the catalog, not a directory scan
+    pdf_files, _ = document_catalog.list(limit=DASHBOARD_DOCUMENTS, sort='date', descending=True)
     
     return render_template('index.html', 
                           pdfs=pdf_files,
+                          totals=document_catalog.totals(),
                           active_page='dashboard')
 
 @app.route('/upload', methods=['POST'])
@@ -87,14 +118,12 @@ def upload_file():
                 skipped_count += 1
                 continue
                 
-            file.save(file_path)
+            # Hash while saving, so a PDF uploaded before under another name is not extracted again
+            digest = save_stream(file.stream, file_path)
             uploaded_count += 1
             
             # Automatically process the uploaded file for search
-            data = pdf_extractor.extract_text_from_pdf(file_path)
-            if data:
-                data_storage.save_to_json([data], f"{filename}.json")
-                search_engine.index_documents([data])
+            if indexer.ingest(file_path, digest):
                 indexed_count += 1
         else:
             skipped_count += 1
@@ -107,6 +136,55 @@ def upload_file():
     
     return redirect(url_for('index'))
 
+@app.route('/api/upload', methods=['POST'])
+def api_upload():
+    """Stream uploaded PDFs to disk and start indexing each as soon as it has arrived.
+
+    Accepts multipart/form-data with any number of files, or a raw PDF body
+    named by ?filename=. Files are never held in memory or spooled by the form
+    parser; each is hashed and checked for a PDF header while it is written.
+    Responds with the outcome for every file.
+    """
+    results = []
+    ingesting = []
+
+    def accept(name):
+        filename = secure_filename(name or '')
+        if not filename.lower().endswith('.pdf'):
+            raise UploadError('not a .pdf file')
+        if os.path.exists(os.path.join(PDF_DIR, filename)):
+            raise UploadError('a file with this name already exists')
+        return filename
+
+    def on_file(filename, path, digest, size):
+        result = {'filename': filename, 'status': 'uploaded', 'size': size, 'digest': digest}
+        results.append(result)
+        ingesting.append((result, ingest_executor.submit(indexer.ingest, path, digest)))
+
+    def on_skip(filename, reason):
+        results.append({'filename': filename, 'status': 'skipped', 'reason': reason})
+
+    error = None
+    try:
+        if request.mimetype == 'multipart/form-data':
+            boundary = request.mimetype_params.get('boundary', '')
+            receive_multipart(request.stream, boundary.encode('latin-1'), PDF_DIR, accept, on_file, on_skip,
+                              UPLOAD_CHUNK_SIZE)
+        else:
+            receive_body(request.stream, request.args.get('filename', ''), PDF_DIR, accept, on_file, on_skip,
+                         UPLOAD_CHUNK_SIZE)
+    except (UploadError, ValueError) as e:
+        error = str(e)
+
+    for result, future in ingesting:
+        result['status'] = 'indexed' if future.result() else 'failed'
+
+    response = {'files': results}
+    if error:
+        response['error'] = error
+        return jsonify(response), 400
+    return jsonify(response)
+
 @app.route('/process', methods=['POST'])
 def process_pdfs():
     """Re-extract text from all PDFs and rebuild the search index (for recovery or updates)"""
@@ -117,41 +195,11 @@ def process_pdfs():
         flash('No PDF files found to process', 'warning')
         return redirect(url_for('index'))
     
-    # Clear existing index to rebuild it
-    if os.path.exists(INDEX_DIR):
-        import shutil
-        shutil.rmtree(INDEX_DIR)
-        os.makedirs(INDEX_DIR, exist_ok=True)
-    
-    # Import Whoosh index properly to avoid name clash with the 'index' route
-    import whoosh.index as whoosh_index
-    
-    # Recreate the index
-    search_engine.index = whoosh_index.create_in(INDEX_DIR, search_engine.schema)
-    
-    # Process each PDF
-    processed_count = 0
-    error_count = 0
-    
-    for filename in pdf_files:
-        try:
-            # Extract text
-            pdf_path = os.path.join(PDF_DIR, filename)
-            data = pdf_extractor.extract_text_from_pdf(pdf_path)
-            
-            if data:
-                # Save extracted data
-                data_storage.save_to_json([data], f"{filename}.json")
-                
-                # Add to search index
-                search_engine.index_documents([data])
-                processed_count += 1
-            else:
-                error_count += 1
-                
-        except Exception as e:
-            error_count += 1
-            print(f"Error processing {filename}: {e}")
+    # Clear the index and ingest every PDF again, searchable once this returns
+    counts = indexer.rebuild()
+    processed_count = counts['processed']
+    error_count = counts['failed']
+    quarantined_count = counts['quarantined']
     
     if processed_count > 0:
         flash(f'Successfully processed {processed_count} PDF files', 'success')
@@ -159,31 +207,48 @@ def process_pdfs():
     if error_count > 0:
         flash(f'Failed to process {error_count} PDF files', 'error')
     
+    if quarantined_count > 0:
+        flash(f'Skipped {quarantined_count} quarantined PDF files', 'warning')
+    
     return redirect(url_for('index'))
 
 @app.route('/documents')
 def documents():
     """Show all documents with management options"""
-    # Get documents with sizes
-    pdf_files = []
-    for f in os.listdir(PDF_DIR):
-        if f.lower().endswith('.pdf'):
-            file_path = os.path.join(PDF_DIR, f)
-            try:
-                file_size = os.path.getsize(file_path)
-                pdf_files.append({
-                    'name': f,
-                    'size': file_size,
-                    'date_modified': os.path.getmtime(file_path)
-                })
-            except (FileNotFoundError, PermissionError):
-                # Skip files with permission issues
-                continue
+    # One page of documents, sorted and filtered by the catalog
+    pdf_files, total, page, pages = _list_documents()
     
     return render_template('documents.html', 
                           pdfs=pdf_files, 
+                          total=total,
+                          page=page,
+                          pages=pages,
+                          sort=request.args.get('sort', 'name-asc'),
+                          q=request.args.get('q', '').strip(),
                           active_page='documents')
 
+def _list_documents():
+    """Query the catalog with the request's page, sort (e.g. "date-desc"), q and status arguments"""
+    page = max(1, request.args.get('page', 1, type=int))
+    page_size = min(max(1, request.args.get('per_page', DOCUMENTS_PAGE_SIZE, type=int)), 1000)
+    sort_by, _, order = request.args.get('sort', 'name-asc').partition('-')
+    pdf_files, total = document_catalog.list(offset=(page - 1) * page_size, limit=page_size, sort=sort_by,
+                                             descending=order == 'desc', query=request.args.get('q', '').strip(),
+                                             status=request.args.get('status') or None)
+    return pdf_files, total, page, max(1, -(-total // page_size))
+
+@app.route('/api/documents')
+def api_documents():
+    """List documents from the catalog, paginated like the documents page"""
+    pdf_files, total, page, pages = _list_documents()
+    return jsonify({'documents': pdf_files, 'total': total, 'page': page, 'pages': pages,
+                    'status': document_catalog.status_counts(), 'reconciler': indexer.reconciler_status()})
+
+@app.route('/api/watch/status')
+def api_watch_status():
+    """Directory watcher and incremental ingest queue progress"""
+    return jsonify(indexer.watch_status())
+
 @app.route('/search_page')
 def search_page():
     """Show the dedicated search page with advanced options"""
@@ -203,6 +268,7 @@ def search():
     page = request.args.get('page', 1, type=int)
     group = request.args.get('group', 'true')
     group_by_file = group.lower() == 'true'
+    collapse = request.args.get('collapse', 'false').lower() == 'true'
     
     if not query:
         return render_template('search_page.html', active_page='search_page')
@@ -212,7 +278,8 @@ def search():
         query, 
         page=page, 
         page_size=10,
-        group_by_file=group_by_file
+        group_by_file=group_by_file,
+        collapse_duplicates=collapse
     )
     
     # Add search index directory for debugging
@@ -220,10 +287,14 @@ def search():
     
     # Store the search query in session for later use
     session['last_search_query'] = query
+    query_log.record(query)
     
     # Log some debug info
     print(f"Search for '{query}' returned {results['total']} results")
     
+    if results.get('partial'):
+        flash('The search took too long to finish; showing partial results', 'warning')
+    
     return render_template('results.html',
                           query=query,
                           results=results,
@@ -237,9 +308,33 @@ def api_search():
     if not query:
         return jsonify([])
     
-    results = search_engine.search(query)
+    # Optionally search within a single document
+    filename = request.args.get('file') or None
+    collapse = request.args.get('collapse', 'false').lower() == 'true'
+    results = search_engine.search(query, filename=filename, collapse_duplicates=collapse)
     return jsonify(results)
 
+@app.route('/api/search/count')
+def api_search_count():
+    """Number of matching pages and documents, without building result snippets"""
+    query = request.args.get('query', '')
+    return jsonify(search_engine.count(query))
+
+@app.route('/api/search/facets')
+def api_search_facets():
+    """Per-document hit counts and a page-range histogram for a query"""
+    query = request.args.get('query', '')
+    bucket = max(1, request.args.get('bucket', 10, type=int))
+    return jsonify(search_engine.facets(query, page_bucket=bucket))
+
+@app.route('/api/search/explain')
+def api_search_explain():
+    """Show how a query is parsed, for debugging"""
+    query = request.args.get('query', '')
+    if not query:
+        return jsonify({})
+    return jsonify(search_engine.explain(query))
+
 @app.route('/view/<path:filename>')
 def view_pdf(filename):
     """View a PDF file in the browser with highlighting for search terms"""
@@ -263,22 +358,7 @@ def view_pdf(filename):
     if query:
         try:
             # Use the search engine to find which pages match the query
-            parser = whoosh.qparser.QueryParser("content", schema=search_engine.index.schema)
-            q = parser.parse(query)
-            
-            with search_engine.index.searcher() as searcher:
-                # Get all matches for this specific file
-                file_query = f'filename:"{filename}" AND {query}'
-                file_parser = whoosh.qparser.MultifieldParser(["content", "filename"], schema=search_engine.index.schema)
-                results = searcher.search(file_parser.parse(file_query), limit=100)
-                
-                # Extract the page numbers from matching results
-                for hit in results:
-                    if hit['filename'] == filename and 'page_num' in hit:
-                        matching_pages.append(hit['page_num'])
-                
-                # Sort the pages
-                matching_pages = sorted(set(matching_pages))
+            matching_pages = search_engine.matching_pages(filename, query)
         except Exception as e:
             app.logger.error(f"Error finding matching pages: {str(e)}")
     
@@ -289,6 +369,45 @@ def view_pdf(filename):
                           matching_pages=matching_pages,
                           active_page='documents')
 
+@app.route('/api/quarantine')
+def api_quarantine():
+    """PDFs that failed extraction, with the reason"""
+    return jsonify(quarantine.entries())
+
+@app.route('/healthz/ready')
+def healthz_ready():
+    """Readiness probe: 200 once the index is warm, 503 until then or while it needs a reindex"""
+    status = index_warmer.status()
+    status['reindex_required'] = search_engine.needs_reindex()
+    return jsonify(status), 200 if status['ready'] and not status['reindex_required'] else 503
+
+@app.route('/api/index/status')
+def api_index_status():
+    """Segment layout of the index, pending writes and merge scheduling"""
+    return jsonify(dict(indexer.status(), shards=search_engine.segment_info()))
+
+@app.route('/api/similar/<path:filename>/<int:page>')
+def api_similar(filename, page):
+    """Return the pages most similar to a page, across all documents"""
+    top = min(max(1, request.args.get('top', 10, type=int)), 100)
+    similar = similarity_index.similar(filename, page, top=top)
+    if similar is None:
+        return jsonify({'error': f'Page {page} of {filename} is not indexed'}), 404
+    return jsonify({'filename': filename, 'page': page, 'similar': similar})
+
+@app.route('/api/highlights/<path:filename>/<int:page>')
+def api_highlights(filename, page):
+    """Return the rectangles of a page's words that match a query, in PDF points"""
+    query = request.args.get('query', '')
+    if not query.strip():
+        return jsonify({'error': 'Missing query'}), 400
+    terms = search_engine.highlight_terms(query)
+    highlights = layout_store.highlights(filename, page, terms, search_engine.schema['content'].analyzer)
+    if highlights is None:
+        return jsonify({'error': f'No word positions for page {page} of {filename}'}), 404
+    highlights.update({'filename': filename, 'page': page, 'query': query})
+    return jsonify(highlights)
+
 @app.route('/pdf/<path:filename>')
 def serve_pdf(filename):
     """Serve the PDF file directly for the viewer"""
@@ -330,8 +449,9 @@ def rename_pdf():
         # Rename the file
         os.rename(original_path, new_path)
         
-        # Update the index if needed
-        # This depends on how your indexing system works
+        # Carry the extracted text and index entries over to the new name
+        if original_filename != new_filename:
+            indexer.rename(original_filename, new_filename)
         
         flash(f'Successfully renamed {original_filename} to {new_filename}', 'success')
     except Exception as e:
@@ -359,8 +479,8 @@ def delete_pdf():
         # Delete the file
         os.remove(file_path)
         
-        # Remove from search index
-        search_engine.remove_document(filename)
+        # Remove from search index and every other store
+        indexer.remove([filename])
         
         flash(f'Successfully deleted {filename}', 'success')
     except Exception as e:
@@ -379,6 +499,7 @@ def delete_multiple_pdfs():
     
     success_count = 0
     error_count = 0
+    deleted = []
     
     for filename in filenames:
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
@@ -391,14 +512,15 @@ def delete_multiple_pdfs():
         try:
             # Delete the file
             os.remove(file_path)
-            
-            # Remove from search index
-            search_engine.remove_document(filename)
-            
+            deleted.append(filename)
             success_count += 1
         except Exception:
             error_count += 1
     
+    # Remove every deleted file from the search index in a single commit
+    if deleted:
+        indexer.remove(deleted)
+    
     if success_count > 0:
         flash(f'Successfully deleted {success_count} file(s)', 'success')
     
@@ -418,7 +540,7 @@ def export_results():
         return redirect(url_for('index'))
     
     # Get search results without pagination to export all results
-    search_results = search_engine.search(query, page=1, page_size=1000)  # Get up to 1000 results
+    search_results = search_engine.search(query, page=1, page_size=EXPORT_MAX_RESULTS)
     
     # Check if we have results to export
     if not search_results or len(search_results.get('results', [])) == 0:
@@ -435,6 +557,23 @@ def export_results():
         flash(f'Error exporting results: {str(e)}', 'error')
         return redirect(url_for('search', query=query))
 
+@app.route('/api/export')
+def api_export():
+    """Stream the results of a query as CSV or JSON, written out as they are sent"""
+    query = request.args.get('query', '')
+    export_format = request.args.get('format', 'csv')
+    if not query.strip():
+        return jsonify({'error': 'Missing query'}), 400
+    if export_format not in ExportManager.STREAMING_FORMATS:
+        return jsonify({'error': f'Unsupported export format: {export_format}'}), 400
+    group_by_file = request.args.get('group', 'true').lower() == 'true'
+
+    search_results = search_engine.search(query, page=1, page_size=EXPORT_MAX_RESULTS, group_by_file=group_by_file)
+    return Response(ExportManager.stream(search_results['results'], export_format, STREAM_CHUNK_SIZE),
+                    mimetype=ExportManager.STREAMING_FORMATS[export_format],
+                    headers={'Content-Disposition':
+                             f"attachment; filename={ExportManager.export_filename(query, export_format)}"})
+
 @app.route('/cleanup_temp', methods=['POST'])
 def cleanup_temp():
     """Clean up temporary extraction and filtered PDF files"""
@@ -503,22 +642,7 @@ def view_matches(filename):
     matching_pages = []
     try:
         # Use the search engine to find which pages match the query
-        parser = whoosh.qparser.QueryParser("content", schema=search_engine.index.schema)
-        q = parser.parse(query)
-        
-        with search_engine.index.searcher() as searcher:
-            # Get all matches for this specific file
-            file_query = f'filename:"{filename}" AND {query}'
-            file_parser = whoosh.qparser.MultifieldParser(["content", "filename"], schema=search_engine.index.schema)
-            results = searcher.search(file_parser.parse(file_query), limit=100)
-            
-            # Extract the page numbers from matching results
-            for hit in results:
-                if hit['filename'] == filename and 'page_num' in hit:
-                    matching_pages.append(hit['page_num'])
-            
-            # Sort the pages
-            matching_pages = sorted(set(matching_pages))
+        matching_pages = search_engine.matching_pages(filename, query)
     except Exception as e:
         app.logger.error(f"Error finding matching pages: {str(e)}")
     
@@ -603,4 +727,4 @@ if __name__ == '__main__':
     os.makedirs(PDF_DIR, exist_ok=True)
     os.makedirs(DATA_DIR, exist_ok=True)
     
-    app.run(debug=True,port=5000) 
\ No newline at end of file
+    create_app().run(debug=True,port=5000) 
\ No newline at end of file
@@ -0,0 +1,91 @@
+"""ASGI entry point for high-concurrency search traffic.
+
+    uvicorn asgi:application --workers 4
+
+/api/search and the CSV/JSON exports (/api/export) are served on the event
+loop: searches run in a bounded thread pool, so the loop keeps accepting
+and answering requests while they run, and results are encoded and sent in
+chunks as the client reads them. Every other path goes to the Flask app in
+app.py, run in its own thread pool, so the HTML pages, uploads and document
+management work as before. For more than one worker, start the indexer
+process first, as with gunicorn (see indexer.py).
+"""
+from app import app as flask_app, create_app, search_engine
+from config import (ASGI_SEARCH_WORKERS, ASGI_MAX_QUEUED_SEARCHES, ASGI_WSGI_WORKERS, STREAM_CHUNK_SIZE,
+                    EXPORT_MAX_RESULTS)
+from modules.asgi import BoundedPool, PoolBusy, WsgiBridge, query_params, send_chunks, send_json
+from modules.export import ExportManager
+
+search_pool = BoundedPool(ASGI_SEARCH_WORKERS, ASGI_MAX_QUEUED_SEARCHES, "search")
+flask_bridge = WsgiBridge(flask_app, ASGI_WSGI_WORKERS)
+
+
+async def api_search(scope, receive, send):
+    params = query_params(scope)
+    query = params.get('query', '')
+    if not query:
+        return await send_json(send, receive, [])
+
+    # Optionally search within a single document
+    filename = params.get('file') or None
+    collapse = params.get('collapse', 'false').lower() == 'true'
+    results = await search_pool.run(search_engine.search, query, filename=filename, collapse_duplicates=collapse)
+    await send_json(send, receive, results, chunk_size=STREAM_CHUNK_SIZE)
+
+
+async def api_export(scope, receive, send):
+    """Stream the results of a query as CSV or JSON, written out as they are sent"""
+    params = query_params(scope)
+    query = params.get('query', '')
+    export_format = params.get('format', 'csv')
+    if not query.strip():
+        return await send_json(send, receive, {'error': 'Missing query'}, status=400)
+    if export_format not in ExportManager.STREAMING_FORMATS:
+        return await send_json(send, receive, {'error': f'Unsupported export format: {export_format}'}, status=400)
+    group_by_file = params.get('group', 'true').lower() == 'true'
+
+    search_results = await search_pool.run(search_engine.search, query, page=1, page_size=EXPORT_MAX_RESULTS,
+                                           group_by_file=group_by_file)
+    headers = [(b"content-type", ExportManager.STREAMING_FORMATS[export_format].encode("latin-1")),
+               (b"content-disposition",
+                f"attachment; filename={ExportManager.export_filename(query, export_format)}".encode("utf-8"))]
+    await send_chunks(send, receive, 200, headers,
+                      ExportManager.stream(search_results['results'], export_format, STREAM_CHUNK_SIZE))
+
+
+# Served here for GET requests; everything else goes to the Flask app
+ROUTES = {
+    '/api/search': api_search,
+    '/api/export': api_export,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            create_app()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            search_pool.shutdown()
+            flask_bridge.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    # For servers that do not send lifespan events; only the first call starts anything
+    create_app()
+    route = ROUTES.get(scope['path']) if scope['method'] == 'GET' else None
+    if route is None:
+        return await flask_bridge(scope, receive, send)
+    try:
+        await route(scope, receive, send)
+    except PoolBusy:
+        await send_json(send, receive, {'error': 'Too many searches in progress, try again shortly'}, status=503,
+                        headers=[(b"retry-after", b"1")])
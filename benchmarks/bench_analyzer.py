@@ -0,0 +1,63 @@
+"""Compare whoosh's StemmingAnalyzer with the cached analyzer used for indexing.
+
+Run from the repository root:
+
+    python benchmarks/bench_analyzer.py [--pages N] [--words N] [--vocabulary N]
+
+The synthetic corpus draws words from a small vocabulary, like the repetitive
+legal text the index is built from.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from whoosh.analysis import StemmingAnalyzer
+from modules.analysis import CachedStemmingAnalyzer, stem_cache_info
+
+
+def make_pages(pages, words, vocabulary, seed=42):
+    """Build pages of text drawn from a fixed vocabulary of word forms"""
+    rng = random.Random(seed)
+    suffixes = ["", "s", "ed", "ing", "ation", "ly", "ment", "ness"]
+    stems = ["".join(rng.choice("abcdefghiklmnoprstu") for _ in range(rng.randint(3, 9)))
+             for _ in range(max(1, vocabulary // len(suffixes)))]
+    vocab = [stem + suffix for stem in stems for suffix in suffixes]
+    return [" ".join(rng.choice(vocab) for _ in range(words)) for _ in range(pages)]
+
+
+def time_analyzer(analyzer, pages):
+    """Analyze every page the way the index writer does and return (seconds, tokens)"""
+    tokens = 0
+    start = time.perf_counter()
+    for text in pages:
+        for _ in analyzer(text, positions=True, chars=True, mode="index"):
+            tokens += 1
+    return time.perf_counter() - start, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=400)
+    parser.add_argument("--vocabulary", type=int, default=4000)
+    args = parser.parse_args()
+
+    pages = make_pages(args.pages, args.words, args.vocabulary)
+
+    results = {}
+    for name, analyzer in [("StemmingAnalyzer", StemmingAnalyzer()),
+                           ("CachedStemmingAnalyzer", CachedStemmingAnalyzer())]:
+        seconds, tokens = time_analyzer(analyzer, pages)
+        results[name] = seconds
+        print(f"{name:<24} {seconds:8.3f}s  {tokens / seconds:12,.0f} tokens/s")
+
+    print(f"speedup: {results['StemmingAnalyzer'] / results['CachedStemmingAnalyzer']:.2f}x")
+    print(f"stem cache: {stem_cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Measure the time and memory it takes to start the web app.
+
+Run from the repository root:
+
+    python benchmarks/bench_startup.py [--runs N] [--module app] [--check]
+
+Each run starts a fresh interpreter, the way a new web worker does, imports
+the module and calls its create_app() if it has one. It reports wall time,
+peak RSS and which heavy dependencies were loaded. Those dependencies are
+only needed by exports, "more like this" and PDF extraction, so --check exits
+with an error if any of them is imported at startup.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imported on first use only; loading one at startup is a regression
+LAZY_MODULES = ["reportlab", "fpdf", "pandas", "scipy", "fitz", "PyPDF2"]
+
+PROBE = """
+import json, os, resource, sys, time
+start = time.perf_counter()
+module = __import__(sys.argv[1])
+if hasattr(module, "create_app"):
+    module.create_app()
+seconds = time.perf_counter() - start
+sys.stderr.write(json.dumps({"seconds": seconds, "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                             "loaded": [name for name in sys.argv[2:] if name in sys.modules]}) + "\\n")
+sys.stderr.flush()
+# Exit without waiting on the background threads the app started
+os._exit(0)
+"""
+
+
+def measure(module):
+    """Start the module in a new interpreter and return its timing, peak RSS and lazy modules loaded"""
+    result = subprocess.run([sys.executable, "-c", PROBE, module] + LAZY_MODULES, cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    # The app logs to stdout while it starts, so the measurement comes back on stderr
+    return json.loads(result.stderr.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--check", action="store_true", help="fail if a lazily loaded dependency was imported")
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    seconds = [run["seconds"] for run in runs]
+    rss = [run["rss_kb"] / 1024 for run in runs]
+    loaded = sorted({name for run in runs for name in run["loaded"]})
+
+    print(f"{args.module}: {statistics.median(seconds):.3f}s median startup "
+          f"(min {min(seconds):.3f}s, max {max(seconds):.3f}s over {args.runs} runs)")
+    print(f"peak RSS: {statistics.median(rss):.1f} MB median")
+    print(f"lazy dependencies loaded at startup: {', '.join(loaded) or 'none'}")
+
+    if args.check and loaded:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
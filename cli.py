@@ -0,0 +1,278 @@
+"""Command line tool for bulk ingest, search and index maintenance, without the web app.
+
+    python cli.py ingest <dir> [--workers N]
+    python cli.py search <query> [--json] [--page N] [--page-size N] [--file NAME]
+    python cli.py reindex [--incremental] [--workers N]
+    python cli.py stats [--json]
+    python cli.py optimize
+
+It works on the same folders and index as app.py (see config.py) and never
+imports Flask, ReportLab or pandas. Index writes take whoosh's write lock, so
+run write commands while the web app is idle or stopped.
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from config import PDF_DIR, EXTRACT_WORKERS
+from modules.services import Services
+from modules.extraction_cache import file_digest, save_stream
+from modules.watcher import scan_directory
+
+
+class Progress:
+    """Progress bar with throughput, drawn on stderr"""
+
+    def __init__(self, total, label, width=30):
+        self.total = total
+        self.label = label
+        self.width = width
+        self.done = 0
+        self.pages = 0
+        self.started = time.time()
+        self._drawn = 0
+        self._interactive = sys.stderr.isatty()
+
+    def update(self, pages=0):
+        self.done += 1
+        self.pages += pages
+        now = time.time()
+        # Redraw at most ten times a second, or every five seconds when logging to a file
+        if self.done == self.total or now - self._drawn >= (0.1 if self._interactive else 5):
+            self._drawn = now
+            self.draw()
+
+    def rates(self):
+        elapsed = max(time.time() - self.started, 1e-6)
+        return self.done / elapsed, self.pages / elapsed
+
+    def draw(self):
+        filled = int(self.width * self.done / self.total) if self.total else self.width
+        files_rate, pages_rate = self.rates()
+        line = (f"{self.label} [{'#' * filled}{'-' * (self.width - filled)}] {self.done}/{self.total} files, "
+                f"{self.pages} pages, {files_rate:.1f} files/s, {pages_rate:.1f} pages/s")
+        if self._interactive:
+            sys.stderr.write("\r" + line)
+            if self.done == self.total:
+                sys.stderr.write("\n")
+        else:
+            sys.stderr.write(line + "\n")
+        sys.stderr.flush()
+
+    def summary(self, action, skipped=0, failed=0):
+        files_rate, pages_rate = self.rates()
+        print(f"{action} {self.done - skipped - failed} files ({self.pages} pages) in "
+              f"{time.time() - self.started:.1f}s: {files_rate:.1f} files/s, {pages_rate:.1f} pages/s"
+              f"{f', {skipped} skipped' if skipped else ''}{f', {failed} failed' if failed else ''}")
+
+
+def _run_ingest(services, jobs, workers, label, action):
+    """Run (name, function) jobs on a thread pool, showing progress; returns the number that failed"""
+    progress = Progress(len(jobs), label)
+    skipped = failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(job): name for name, job in jobs}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                outcome = future.result()
+            except Exception as e:
+                print(f"Error ingesting {name}: {e}", file=sys.stderr)
+                outcome = None
+            if outcome == "skipped":
+                skipped += 1
+            elif outcome is None:
+                failed += 1
+            entry = services.document_catalog.get(name) if outcome not in (None, "skipped") else None
+            progress.update((entry or {}).get("pages") or 0)
+    services.search_engine.flush()
+    progress.summary(action, skipped, failed)
+    return failed
+
+
+def cmd_ingest(args):
+    """Copy the PDFs in a folder into the upload folder and index them"""
+    source = os.path.abspath(args.directory)
+    if not os.path.isdir(source):
+        print(f"Not a directory: {args.directory}", file=sys.stderr)
+        return 2
+    names = sorted(scan_directory(source))
+    services = Services(extract_workers=args.workers)
+    in_place = os.path.samefile(source, PDF_DIR)
+
+    def job(name):
+        def run():
+            target = os.path.join(PDF_DIR, name)
+            if in_place:
+                return "skipped" if services.ingestor.is_current(target) else services.ingestor.reingest(target)
+            if os.path.exists(target):
+                # Same name: only the same content is taken, and only indexed again if it is out of date
+                if file_digest(os.path.join(source, name)) != services.extraction_cache.digest(target):
+                    print(f"Skipping {name}: a different file with this name exists", file=sys.stderr)
+                    return "skipped"
+                if services.ingestor.is_current(target):
+                    return "skipped"
+                return services.ingestor.reingest(target)
+            with open(os.path.join(source, name), "rb") as f:
+                digest = save_stream(f, target)
+            return services.ingestor.ingest(target, digest)
+        return run
+
+    try:
+        failed = _run_ingest(services, [(name, job(name)) for name in names], args.workers, "Ingesting", "Ingested")
+    finally:
+        services.close()
+    return 1 if failed else 0
+
+
+def cmd_search(args):
+    """Search the index and print the results"""
+    services = Services(extract_workers=1)
+    try:
+        results = services.search_engine.search(args.query, page=args.page, page_size=args.page_size,
+                                                group_by_file=False, filename=args.file)
+    finally:
+        services.close()
+
+    if args.json:
+        for result in results["results"]:
+            result.pop("content", None)
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+        return 0
+
+    print(f"{results['total']} results in {results['file_count']} files (page {results['page']} of {results['pages']})")
+    for i, result in enumerate(results["results"], (results["page"] - 1) * args.page_size + 1):
+        snippet = " ".join(re.sub(r"<[^>]+>", "", result.get("highlight") or "").split())
+        print(f"{i}. {result['filename']} page {result['page'] + 1} (score {result['score']:.2f})")
+        if snippet:
+            print(f"   {snippet}")
+    if results.get("partial"):
+        print("The search took too long to finish; results are partial", file=sys.stderr)
+    return 0
+
+
+def cmd_reindex(args):
+    """Rebuild the index from the upload folder, or only bring changed files up to date"""
+    services = Services(extract_workers=args.workers)
+    ingestor = services.ingestor
+    on_disk = scan_directory(PDF_DIR)
+    try:
+        if args.incremental:
+            known = services.document_catalog.snapshot(statuses=("indexed", "failed", "quarantined"))
+            removed = [name for name in services.document_catalog.snapshot() if name not in on_disk]
+            if removed:
+                ingestor.remove(removed)
+            changed = sorted(name for name, stat in on_disk.items() if known.get(name) != stat)
+            print(f"{len(changed)} new or changed files, {len(removed)} removed")
+            jobs = [(name, lambda name=name: ingestor.reingest(os.path.join(PDF_DIR, name))) for name in changed]
+        else:
+            services.reset_index()
+
+            def full(name):
+                pdf_path = os.path.join(PDF_DIR, name)
+                if services.quarantine.contains(pdf_path):
+                    services.document_catalog.record(pdf_path, "quarantined")
+                    return "skipped"
+                return ingestor.ingest(pdf_path)
+
+            jobs = [(name, lambda name=name: full(name)) for name in sorted(on_disk)]
+        failed = _run_ingest(services, jobs, args.workers, "Reindexing", "Reindexed")
+    finally:
+        services.close()
+    return 1 if failed else 0
+
+
+def cmd_stats(args):
+    """Print document, index and cache statistics"""
+    services = Services(extract_workers=1)
+    try:
+        reindex_required = services.search_engine.needs_reindex()
+        stats = {
+            "documents": services.document_catalog.totals(),
+            "status": services.document_catalog.status_counts(),
+            "reindex_required": reindex_required,
+            "index": [] if reindex_required else
+                     [{key: value for key, value in shard.items() if key != "segments"} |
+                      {"segments": len(shard["segments"])} for shard in services.search_engine.segment_info()],
+            "extraction_cache": services.extraction_cache.stats(),
+            "quarantined": len(services.quarantine.entries())
+        }
+    finally:
+        services.close()
+
+    if args.json:
+        print(json.dumps(stats, indent=2))
+        return 0
+    print(f"Documents:   {stats['documents']['count']} ({stats['documents']['size'] / 1024 / 1024:.2f} MB)")
+    print("Status:      " + (", ".join(f"{count} {status}" for status, count in sorted(stats["status"].items()))
+                             or "none"))
+    if stats["reindex_required"]:
+        print("Index:       older schema, reindex required (python cli.py reindex)")
+    for shard in stats["index"]:
+        print(f"Index {shard['shard']}: {shard['docs']} pages in {shard['segments']} segments, "
+              f"{shard['deleted']} deleted ({shard['deleted_ratio']:.0%})")
+    print(f"Extraction cache: {stats['extraction_cache']['entries']} entries for "
+          f"{stats['extraction_cache']['files']} files")
+    print(f"Quarantined: {stats['quarantined']}")
+    return 0
+
+
+def cmd_optimize(args):
+    """Merge every index shard into a single segment"""
+    services = Services(extract_workers=1)
+    try:
+        before = sum(len(shard["segments"]) for shard in services.search_engine.segment_info())
+        started = time.time()
+        services.search_engine.optimize().wait()
+        after = sum(len(shard["segments"]) for shard in services.search_engine.segment_info())
+    finally:
+        services.close()
+    print(f"Optimized the index from {before} to {after} segments in {time.time() - started:.1f}s")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk ingest, search and index maintenance for the PDF search engine")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="copy the PDFs in a folder into the upload folder and index them")
+    ingest.add_argument("directory")
+    ingest.add_argument("--workers", type=int, default=EXTRACT_WORKERS, help="PDFs extracted at once")
+    ingest.set_defaults(handler=cmd_ingest)
+
+    search = commands.add_parser("search", help="search the index")
+    search.add_argument("query")
+    search.add_argument("--json", action="store_true", help="print the results as JSON")
+    search.add_argument("--page", type=int, default=1)
+    search.add_argument("--page-size", type=int, default=10)
+    search.add_argument("--file", help="only search this document")
+    search.set_defaults(handler=cmd_search)
+
+    reindex = commands.add_parser("reindex", help="rebuild the index from the upload folder")
+    reindex.add_argument("--incremental", action="store_true",
+                         help="only index new and changed files and drop deleted ones")
+    reindex.add_argument("--workers", type=int, default=EXTRACT_WORKERS, help="PDFs extracted at once")
+    reindex.set_defaults(handler=cmd_reindex)
+
+    stats = commands.add_parser("stats", help="show document, index and cache statistics")
+    stats.add_argument("--json", action="store_true", help="print the statistics as JSON")
+    stats.set_defaults(handler=cmd_stats)
+
+    optimize = commands.add_parser("optimize", help="merge the index into one segment per shard")
+    optimize.set_defaults(handler=cmd_optimize)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except BrokenPipeError:
+        # Output was piped into something like head that stopped reading
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
@@ -13,6 +13,155 @@ DATA_DIR = os.path.join(BASE_DIR, 'data')
 # Search index directory
 INDEX_DIR = os.path.join(BASE_DIR, 'index')
 
+# Number of hash-partitioned index shards (1 keeps a single index in INDEX_DIR)
+INDEX_SHARDS = int(os.environ.get('INDEX_SHARDS', 1))
+
+# Time budget for a single search in seconds; slower queries return partial results
+SEARCH_TIMEOUT = float(os.environ.get('SEARCH_TIMEOUT', 5.0))
+
+# Maximum number of index terms a wildcard, prefix or fuzzy query may expand to
+MAX_TERM_EXPANSIONS = int(os.environ.get('MAX_TERM_EXPANSIONS', 512))
+
+# Relative weight of matches in each searched field
+FIELD_BOOSTS = {
+    'content': float(os.environ.get('CONTENT_BOOST', 1.0)),
+    'filename': float(os.environ.get('FILENAME_BOOST', 2.0))
+}
+
+# Number of parsed queries cached per process
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', 256))
+
+# Number of distinct words whose stems are memoized per process
+STEM_CACHE_SIZE = int(os.environ.get('STEM_CACHE_SIZE', 100000))
+
+# Estimated similarity above which a page is marked as a near-duplicate of another, so searches can collapse it (0 disables)
+DEDUP_THRESHOLD = float(os.environ.get('DEDUP_THRESHOLD', 0.9))
+
+# Seconds queued index writes may wait so they can share a single commit
+INDEX_COMMIT_INTERVAL = float(os.environ.get('INDEX_COMMIT_INTERVAL', 1.0))
+
+# Seconds between background checks of the index segment layout (0 disables merging)
+MERGE_INTERVAL = float(os.environ.get('MERGE_INTERVAL', 60))
+
+# Segment count per shard above which a merge is scheduled
+MERGE_MAX_SEGMENTS = int(os.environ.get('MERGE_MAX_SEGMENTS', 10))
+
+# Share of deleted documents per shard above which a merge is scheduled
+MERGE_DELETED_RATIO = float(os.environ.get('MERGE_DELETED_RATIO', 0.2))
+
+# Number of similar-sized segments merged together in one tier
+MERGE_FACTOR = int(os.environ.get('MERGE_FACTOR', 10))
+
+# Seconds without searches or writes before a scheduled merge may run
+MERGE_IDLE_SECONDS = float(os.environ.get('MERGE_IDLE_SECONDS', 30))
+
+# Merge every shard into a single segment instead of merging by tier
+MERGE_OPTIMIZE = os.environ.get('MERGE_OPTIMIZE', 'false').lower() == 'true'
+
+# Warm the index up in the background at startup before reporting ready
+WARMUP = os.environ.get('WARMUP', 'true').lower() == 'true'
+
+# Log of searched queries; the most frequent recent ones are replayed during warm-up
+QUERY_LOG = os.environ.get('QUERY_LOG', os.path.join(BASE_DIR, 'query_log.txt'))
+
+# Number of logged queries replayed during warm-up
+WARMUP_QUERIES = int(os.environ.get('WARMUP_QUERIES', 20))
+
+# Pages extracted, stored and queued for indexing at a time when ingesting a PDF
+INGEST_BATCH_PAGES = int(os.environ.get('INGEST_BATCH_PAGES', 50))
+
+# Page batches of one PDF queued for indexing before ingest has them committed and carries on
+INGEST_MAX_QUEUED_BATCHES = int(os.environ.get('INGEST_MAX_QUEUED_BATCHES', 4))
+
+# Bytes read from the request at a time by the streaming upload endpoint
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 1024 * 1024))
+
+# Worker processes PDF text extraction runs in, isolated from the web server
+EXTRACT_WORKERS = int(os.environ.get('EXTRACT_WORKERS', 2))
+
+# Seconds of extraction a single PDF may take before it is given up on
+EXTRACT_TIMEOUT = float(os.environ.get('EXTRACT_TIMEOUT', 120))
+
+# Address space limit per extraction worker in MB (0 disables)
+EXTRACT_MEMORY_MB = int(os.environ.get('EXTRACT_MEMORY_MB', 2048))
+
+# Documents an extraction worker handles before it is replaced
+EXTRACT_MAX_DOCUMENTS = int(os.environ.get('EXTRACT_MAX_DOCUMENTS', 50))
+
+# PDFs that failed extraction and why; they are skipped until the file changes
+QUARANTINE_FILE = os.path.join(BASE_DIR, 'quarantine.json')
+
+# Capture word bounding boxes at extraction so the viewer can draw exact highlights
+LAYOUT_WORDS = os.environ.get('LAYOUT_WORDS', 'true').lower() == 'true'
+
+# Extracted pages cached by PDF content hash, shared by duplicates and renames
+EXTRACT_CACHE_DIR = os.path.join(BASE_DIR, 'extract_cache')
+
+# Word bounding boxes per document and page
+LAYOUT_DIR = os.path.join(BASE_DIR, 'layout')
+
+# Catalog of uploaded PDFs with their size, page count and index status
+CATALOG_DB = os.path.join(BASE_DIR, 'catalog.db')
+
+# Follow changes made to the PDF folder outside the application (inotify on Linux, else polling)
+CATALOG_WATCH = os.environ.get('CATALOG_WATCH', 'true').lower() == 'true'
+
+# Seconds between full rescans of the PDF folder when inotify is unavailable
+CATALOG_RECONCILE_INTERVAL = float(os.environ.get('CATALOG_RECONCILE_INTERVAL', 300))
+
+# Watch PDF_DIR and ingest files added, changed or removed there without clicking "process"
+WATCH_INGEST = os.environ.get('WATCH_INGEST', 'false').lower() == 'true'
+
+# Seconds a file's size and mtime must hold still before the watcher ingests it
+WATCH_SETTLE_SECONDS = float(os.environ.get('WATCH_SETTLE_SECONDS', 2))
+
+# Seconds between rescans of PDF_DIR when inotify is unavailable
+WATCH_POLL_INTERVAL = float(os.environ.get('WATCH_POLL_INTERVAL', 10))
+
+# Most files per second the watcher starts ingesting
+WATCH_INGEST_RATE = float(os.environ.get('WATCH_INGEST_RATE', 2))
+
+# Queued index writes above which the watcher waits before ingesting the next file
+WATCH_MAX_PENDING_WRITES = int(os.environ.get('WATCH_MAX_PENDING_WRITES', 8))
+
+# Documents per page on the documents page
+DOCUMENTS_PAGE_SIZE = int(os.environ.get('DOCUMENTS_PAGE_SIZE', 50))
+
+# Most recently modified documents shown on the dashboard
+DASHBOARD_DOCUMENTS = int(os.environ.get('DASHBOARD_DOCUMENTS', 24))
+
+# Local socket of the indexer process (python indexer.py) that owns every index write when the
+# web app runs with several workers: a file path, or host:port. Empty keeps writes in the web process
+INDEXER_ADDRESS = os.environ.get('INDEXER_ADDRESS', '')
+
+# Shared secret web workers prove to the indexer before sending it operations; required for a host:port address,
+# which must also be a loopback one
+INDEXER_AUTHKEY = os.environ.get('INDEXER_AUTHKEY', '')
+
+# Seconds a web worker waits for the indexer to accept connections
+INDEXER_CONNECT_TIMEOUT = float(os.environ.get('INDEXER_CONNECT_TIMEOUT', 30))
+
+# Threads the ASGI frontend (asgi.py) runs searches and exports in
+ASGI_SEARCH_WORKERS = int(os.environ.get('ASGI_SEARCH_WORKERS', 4))
+
+# Searches running or waiting for those threads before the ASGI frontend answers new ones with 503
+ASGI_MAX_QUEUED_SEARCHES = int(os.environ.get('ASGI_MAX_QUEUED_SEARCHES', 256))
+
+# Threads the ASGI frontend runs the Flask app's pages, uploads and document management in
+ASGI_WSGI_WORKERS = int(os.environ.get('ASGI_WSGI_WORKERS', 16))
+
+# Bytes per chunk when streaming search results and exports
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 64 * 1024))
+
+# Most results included in an export
+EXPORT_MAX_RESULTS = int(os.environ.get('EXPORT_MAX_RESULTS', 1000))
+
+# Page vectors for "more like this" lookups
+SIMILARITY_DIR = os.path.join(BASE_DIR, 'similarity')
+
+# Truncated-SVD dimensions pages are compared in (0 compares raw TF-IDF vectors)
+SIMILARITY_SVD_COMPONENTS = int(os.environ.get('SIMILARITY_SVD_COMPONENTS', 0))
+
 # Create directories if they don't exist
-for directory in [PDF_DIR, DATA_DIR, INDEX_DIR]:
+for directory in [PDF_DIR, DATA_DIR, INDEX_DIR, SIMILARITY_DIR, LAYOUT_DIR, EXTRACT_CACHE_DIR]:
     os.makedirs(directory, exist_ok=True) 
\ No newline at end of file
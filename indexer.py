@@ -0,0 +1,48 @@
+"""Indexer process for running the web app with several workers.
+
+    INDEXER_ADDRESS=/tmp/pdf-search-indexer.sock python indexer.py
+    INDEXER_ADDRESS=/tmp/pdf-search-indexer.sock gunicorn --workers 4 'app:create_app()'
+
+This process owns every write to the index and the document stores, merges
+index segments and follows changes to the PDF folder. Web workers started
+with the same INDEXER_ADDRESS (and INDEXER_AUTHKEY, if set) send it uploads,
+renames, deletes and rebuilds, and open the index read-only for searching;
+each worker picks up new commits on its next search.
+"""
+import sys
+import signal
+
+from config import INDEXER_ADDRESS, INDEXER_AUTHKEY
+from modules.services import Services
+from modules.indexer import Indexer, IndexerServer, IndexerError
+
+
+def main():
+    if not INDEXER_ADDRESS:
+        print("Set INDEXER_ADDRESS to the socket path (or host:port) the web workers will use", file=sys.stderr)
+        return 2
+
+    services = Services()
+    indexer = Indexer(services)
+    try:
+        server = IndexerServer(indexer, INDEXER_ADDRESS, INDEXER_AUTHKEY.encode() or None)
+    except IndexerError as e:
+        print(str(e), file=sys.stderr)
+        services.close()
+        return 2
+    # Stop like Ctrl+C, committing queued writes on the way out
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    indexer.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        indexer.stop()
+        services.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+from functools import lru_cache
+from whoosh.analysis import RegexTokenizer, LowercaseFilter, StopFilter, Filter, STOP_WORDS
+from whoosh.lang.porter import stem
+
+# Stemming functions wrapped in a memoizing cache, one per cache size. They live
+# at module level so every analyzer in a process (the index writer and the query
+# parser alike) shares the same cache, and filters stay picklable for worker
+# processes and the index's stored schema.
+_stem_caches = {}
+
+
+def cached_stem(cachesize):
+    """Return the Porter stemmer behind a bounded LRU cache of the given size"""
+    stemfn = _stem_caches.get(cachesize)
+    if stemfn is None:
+        stemfn = lru_cache(maxsize=cachesize)(stem)
+        _stem_caches[cachesize] = stemfn
+    return stemfn
+
+
+class CachedStemFilter(Filter):
+    """Porter stem filter backed by a process-wide memoizing cache.
+
+    Produces exactly the same tokens as whoosh's StemFilter, but the cache is
+    shared between all analyzers and uses functools.lru_cache, so repeated words
+    cost a dictionary lookup instead of a stemmer call.
+    """
+
+    def __init__(self, ignore=None, cachesize=100000):
+        self.ignore = frozenset() if ignore is None else frozenset(ignore)
+        self.cachesize = cachesize
+
+    def __call__(self, tokens):
+        stemfn = cached_stem(self.cachesize)
+        ignore = self.ignore
+
+        for t in tokens:
+            if not t.stopped:
+                text = t.text
+                if text not in ignore:
+                    t.text = stemfn(text)
+            yield t
+
+
+def CachedStemmingAnalyzer(expression=r"\w+(\.?\w+)*", stoplist=STOP_WORDS, minsize=2, maxsize=None,
+                           gaps=False, ignore=None, cachesize=100000):
+    """Drop-in replacement for whoosh's StemmingAnalyzer using CachedStemFilter"""
+    chain = RegexTokenizer(expression=expression, gaps=gaps) | LowercaseFilter()
+    if stoplist is not None:
+        chain = chain | StopFilter(stoplist=stoplist, minsize=minsize, maxsize=maxsize)
+    return chain | CachedStemFilter(ignore=ignore, cachesize=cachesize)
+
+
+def stem_cache_info(cachesize=100000):
+    """Hit and miss counts for the stem cache of the given size"""
+    return cached_stem(cachesize).cache_info()._asdict()
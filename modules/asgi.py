@@ -0,0 +1,200 @@
+import io
+import sys
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from modules.export import json_chunks
+
+
+class PoolBusy(Exception):
+    """Too many calls are already running or waiting in a BoundedPool"""
+
+
+class BoundedPool:
+    """A thread pool for blocking work that refuses new calls once max_queued are in it.
+
+    Searches spend most of their time in Python code, so running them here
+    does not make them faster; it keeps the event loop free to accept and
+    answer other requests, and caps how many searches (and open index
+    readers) there are at once.
+    """
+
+    def __init__(self, workers, max_queued, name):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.max_queued = max_queued
+        # Only changed on the event loop, so no lock is needed
+        self.queued = 0
+
+    async def run(self, fn, *args, **kwargs):
+        if self.queued >= self.max_queued:
+            raise PoolBusy()
+        self.queued += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, lambda: fn(*args, **kwargs))
+        finally:
+            self.queued -= 1
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+def query_params(scope):
+    """The query string as a dict, keeping the first value of repeated parameters"""
+    params = {}
+    for name, value in parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True):
+        params.setdefault(name, value)
+    return params
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def send_chunks(send, receive, status, headers, chunks):
+    """Send a response whose body is an iterable of byte strings, one message per chunk.
+
+    Each send waits while the client is slow to read, and generating the body
+    stops as soon as the client disconnects.
+    """
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        for chunk in chunks:
+            if disconnected.done():
+                return
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    except OSError:
+        # Servers may raise instead of dropping messages for a closed connection
+        pass
+    finally:
+        disconnected.cancel()
+
+
+async def send_json(send, receive, data, status=200, chunk_size=64 * 1024, headers=()):
+    """Send data as a JSON response, encoding it chunk by chunk as it is sent"""
+    await send_chunks(send, receive, status, [(b"content-type", b"application/json")] + list(headers),
+                      json_chunks(data, chunk_size))
+
+
+class _RequestBody(io.RawIOBase):
+    """wsgi.input for a request whose body arrives as ASGI messages"""
+
+    def __init__(self, receive):
+        self._receive = receive
+        self._buffer = b""
+        self._more = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer and self._more:
+            message = self._receive()
+            if message["type"] == "http.disconnect":
+                self._more = False
+                break
+            self._buffer = message.get("body", b"")
+            self._more = message.get("more_body", False)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+class WsgiBridge:
+    """Serves ASGI requests with a WSGI app (the Flask app), in a thread pool.
+
+    The request body is received as the app reads it and the response is
+    sent as the app produces it, so streaming uploads and downloads keep
+    streaming and only the threads running the app are blocked.
+    """
+
+    def __init__(self, wsgi_app, workers):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="wsgi")
+
+    async def __call__(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self._run, scope, receive, send, loop)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    def _run(self, scope, receive, send, loop):
+        def on_loop(coroutine):
+            return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+        status = headers = None
+        started = False
+
+        def write(data):
+            nonlocal started
+            if not started:
+                started = True
+                on_loop(send({"type": "http.response.start", "status": status, "headers": headers}))
+            if data:
+                on_loop(send({"type": "http.response.body", "body": data, "more_body": True}))
+
+        def start_response(status_line, response_headers, exc_info=None):
+            nonlocal status, headers
+            if exc_info and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            status = int(status_line.split(" ", 1)[0])
+            headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in response_headers]
+            return write
+
+        body = io.BufferedReader(_RequestBody(lambda: on_loop(receive())))
+        result = self.wsgi_app(self._environ(scope, body), start_response)
+        try:
+            for data in result:
+                write(data)
+            write(b"")
+            on_loop(send({"type": "http.response.body", "body": b""}))
+        except OSError:
+            pass
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+    @staticmethod
+    def _environ(scope, body):
+        script_name = scope.get("root_path", "")
+        path = scope["path"]
+        if script_name and path.startswith(script_name):
+            path = path[len(script_name):]
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            # WSGI carries paths as latin-1 decoded bytes
+            "SCRIPT_NAME": script_name.encode("utf-8").decode("latin-1"),
+            "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1] or 80),
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "REMOTE_ADDR": client[0],
+            "REMOTE_PORT": str(client[1]),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": body,
+            # The body ends where the ASGI messages end, with or without a Content-Length
+            "wsgi.input_terminated": True,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+        }
+        for name, value in scope.get("headers", []):
+            name = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                name = f"HTTP_{name}"
+            if name in environ:
+                # Repeated headers are joined into one, except that cookies are separated by "; "
+                value = environ[name] + ("; " if name == "HTTP_COOKIE" else ", ") + value
+            environ[name] = value
+        return environ
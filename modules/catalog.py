@@ -0,0 +1,238 @@
+import os
+import time
+import sqlite3
+import threading
+
+from modules.watcher import Inotify, inotify_available, scan_directory, IN_Q_OVERFLOW
+
+# Columns the documents page may sort by, mapped to their SQL expressions
+SORT_COLUMNS = {
+    "name": "name COLLATE NOCASE",
+    "size": "size",
+    "date": "mtime",
+    "pages": "pages",
+    "status": "status"
+}
+
+
+def _row(row):
+    """A catalog row in the shape the templates expect"""
+    return {
+        "name": row[0],
+        "size": row[1],
+        "date_modified": row[2],
+        "pages": row[3],
+        "status": row[4],
+        "digest": row[5]
+    }
+
+
+class DocumentCatalog:
+    """SQLite table of the PDFs in the upload folder and their index status.
+
+    Upload, ingest, rename and delete keep it current, so listing documents is
+    a query instead of a directory scan with a stat per file. reconcile()
+    brings it back in line with the folder after out-of-band changes.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS documents (name TEXT PRIMARY KEY, size INTEGER, "
+                               "mtime REAL, pages INTEGER, status TEXT, digest TEXT, updated REAL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS documents_name ON documents (name COLLATE NOCASE)")
+            for column in ("size", "mtime", "status"):
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS documents_{column} ON documents ({column})")
+
+    def _execute(self, sql, params=()):
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params).fetchall()
+
+    def record(self, pdf_path, status, pages=None, digest=None):
+        """Add or update a file from its current size and mtime"""
+        stat = os.stat(pdf_path)
+        self._execute(
+            "INSERT INTO documents (name, size, mtime, pages, status, digest, updated) VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, "
+            "pages = COALESCE(excluded.pages, pages), status = excluded.status, "
+            "digest = COALESCE(excluded.digest, digest), updated = excluded.updated",
+            (os.path.basename(pdf_path), stat.st_size, stat.st_mtime, pages, status, digest, time.time()))
+
+    def set_status(self, filename, status):
+        self._execute("UPDATE documents SET status = ?, updated = ? WHERE name = ?", (status, time.time(), filename))
+
+    def rename(self, old_filename, new_filename):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM documents WHERE name = ?", (new_filename,))
+            self._conn.execute("UPDATE documents SET name = ?, updated = ? WHERE name = ?",
+                               (new_filename, time.time(), old_filename))
+
+    def remove(self, filenames):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM documents WHERE name = ?", [(name,) for name in filenames])
+
+    def get(self, filename):
+        rows = self._execute("SELECT name, size, mtime, pages, status, digest FROM documents WHERE name = ?",
+                             (filename,))
+        return _row(rows[0]) if rows else None
+
+    def list(self, offset=0, limit=50, sort="name", descending=False, query=None, status=None):
+        """Return (documents, total matching) for one page of the catalog"""
+        where, params = [], []
+        if query:
+            escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            where.append("name LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+        if status:
+            where.append("status = ?")
+            params.append(status)
+        clause = (" WHERE " + " AND ".join(where)) if where else ""
+        order = SORT_COLUMNS.get(sort, SORT_COLUMNS["name"]) + (" DESC" if descending else " ASC")
+
+        with self._lock:
+            total = self._conn.execute("SELECT COUNT(*) FROM documents" + clause, params).fetchone()[0]
+            rows = self._conn.execute(
+                "SELECT name, size, mtime, pages, status, digest FROM documents" + clause +
+                f" ORDER BY {order}, name LIMIT ? OFFSET ?", params + [limit, offset]).fetchall()
+        return [_row(row) for row in rows], total
+
+    def snapshot(self, statuses=None):
+        """Map filenames to their recorded (size, mtime), optionally only those with the given statuses"""
+        rows = self._execute("SELECT name, size, mtime, status FROM documents")
+        return {name: (size, mtime) for name, size, mtime, status in rows if statuses is None or status in statuses}
+
+    def totals(self):
+        """Document count and total size"""
+        count, size = self._execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM documents")[0]
+        return {"count": count, "size": size}
+
+    def status_counts(self):
+        return dict(self._execute("SELECT status, COUNT(*) FROM documents GROUP BY status"))
+
+    def refresh(self, directory, filename, status_of=None):
+        """Bring one file's row in line with the folder; returns whether it changed"""
+        path = os.path.join(directory, filename)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            with self._lock, self._conn:
+                return self._conn.execute("DELETE FROM documents WHERE name = ?", (filename,)).rowcount > 0
+        current = self.get(filename)
+        if current and current["size"] == stat.st_size and current["date_modified"] == stat.st_mtime:
+            return False
+        # New or changed behind the application's back, so not indexed as it is now
+        self.record(path, status_of(filename) if status_of and not current else "pending")
+        return True
+
+    def reconcile(self, directory, status_of=None):
+        """Rescan the folder, adding, updating and dropping rows; returns the number changed.
+
+        status_of(filename) gives the status of files the catalog has not seen
+        before (default "pending").
+        """
+        on_disk = scan_directory(directory)
+        rows = self._execute("SELECT name, size, mtime FROM documents")
+        known = {name: (size, mtime) for name, size, mtime in rows}
+        gone = [name for name in known if name not in on_disk]
+        changed = [name for name, values in on_disk.items() if known.get(name) != values]
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM documents WHERE name = ?", [(name,) for name in gone])
+            self._conn.executemany(
+                "INSERT INTO documents (name, size, mtime, status, updated) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, "
+                "status = 'pending', updated = excluded.updated",
+                [(name, on_disk[name][0], on_disk[name][1],
+                  status_of(name) if status_of and name not in known else "pending", now) for name in changed])
+        if gone or changed:
+            print(f"Document catalog reconciled: {len(changed)} added or changed, {len(gone)} removed")
+        return len(gone) + len(changed)
+
+
+class CatalogReconciler:
+    """Background thread that keeps the catalog in step with out-of-band changes to the folder.
+
+    It rescans the folder once at start. After that it follows inotify events
+    where available, handling a file once it has been quiet for settle seconds
+    so the application's own writes land first, and otherwise rescans every
+    interval seconds.
+    """
+
+    def __init__(self, catalog, directory, interval=300, settle=1.0, status_of=None, use_inotify=True):
+        self.catalog = catalog
+        self.directory = directory
+        self.interval = interval
+        self.settle = settle
+        self.status_of = status_of
+        self.use_inotify = use_inotify and inotify_available()
+        self.last_reconcile = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="catalog-reconciler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def reconcile(self):
+        self.catalog.reconcile(self.directory, self.status_of)
+        self.last_reconcile = time.time()
+
+    def _run(self):
+        try:
+            self.reconcile()
+        except Exception as e:
+            print(f"Catalog reconcile error: {str(e)}")
+
+        if self.use_inotify:
+            try:
+                self._watch()
+                return
+            except OSError as e:
+                print(f"Catalog watch error, polling instead: {str(e)}")
+
+        while not self._stop.wait(self.interval):
+            try:
+                self.reconcile()
+            except Exception as e:
+                print(f"Catalog reconcile error: {str(e)}")
+
+    def _watch(self):
+        inotify = Inotify(self.directory)
+        pending = {}  # filename -> time of its latest event
+        try:
+            while not self._stop.is_set():
+                for mask, name in inotify.read(timeout=self.settle):
+                    if mask & IN_Q_OVERFLOW:
+                        pending.clear()
+                        self.reconcile()
+                    elif name and name.lower().endswith(".pdf"):
+                        pending[name] = time.time()
+
+                quiet = [name for name, seen in pending.items() if time.time() - seen >= self.settle]
+                for name in quiet:
+                    del pending[name]
+                    try:
+                        self.catalog.refresh(self.directory, name, self.status_of)
+                    except Exception as e:
+                        print(f"Catalog refresh error for {name}: {str(e)}")
+        finally:
+            inotify.close()
+
+    def status(self):
+        return {
+            "running": self._thread is not None,
+            "mode": "inotify" if self.use_inotify else "polling",
+            "interval": self.interval,
+            "last_reconcile": self.last_reconcile
+        }
@@ -0,0 +1,85 @@
+import re
+import zlib
+import hashlib
+import numpy as np
+
+# Number of hash permutations in a MinHash signature
+NUM_PERM = 64
+
+# LSH bands the signature is split into; BANDS * ROWS must equal NUM_PERM. With
+# 8 bands of 8 rows, pages above roughly 0.77 Jaccard similarity usually share
+# at least one band and become candidates.
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+
+# Pages are compared as sets of overlapping word n-grams of this length
+SHINGLE_SIZE = 5
+
+# Pages with fewer words than this are never treated as duplicates
+MIN_WORDS = 20
+
+_rng = np.random.default_rng(20240229)
+_A = _rng.integers(1, 2 ** 63, size=NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_B = _rng.integers(0, 2 ** 63, size=NUM_PERM, dtype=np.uint64)
+
+
+def signature(text):
+    """Return the MinHash signature of a page as a list of ints, or None if too short"""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < MIN_WORDS:
+        return None
+
+    shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+    # Multiply-shift hashing; uint64 arithmetic wraps, which is what we want
+    permuted = (_A[:, None] * hashes[None, :] + _B[:, None]) >> np.uint64(32)
+    return permuted.min(axis=1).tolist()
+
+
+def band_keys(sig):
+    """LSH bucket keys for a signature, one per band"""
+    keys = []
+    for band in range(BANDS):
+        rows = np.asarray(sig[band * ROWS:(band + 1) * ROWS], dtype=np.uint64).tobytes()
+        keys.append(f"b{band}_{hashlib.blake2b(rows, digest_size=8).hexdigest()}")
+    return keys
+
+
+def similarity(sig_a, sig_b):
+    """Estimate the Jaccard similarity of two pages from their signatures"""
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / NUM_PERM
+
+
+class DuplicateDetector:
+    """Clusters pages into canonical pages and near-duplicate references.
+
+    Canonical pages are registered with add(); find() returns the doc_id of the
+    most similar canonical page sharing an LSH bucket with a signature, if its
+    estimated similarity reaches the threshold.
+    """
+
+    def __init__(self, threshold=0.9):
+        self.threshold = threshold
+        self.buckets = {}
+        self.signatures = {}
+
+    def add(self, doc_id, sig):
+        """Register a canonical page"""
+        self.signatures[doc_id] = sig
+        for key in band_keys(sig):
+            self.buckets.setdefault(key, []).append(doc_id)
+
+    def find(self, sig):
+        """Return the doc_id of the canonical page this signature duplicates, or None"""
+        best, best_score = None, self.threshold
+        seen = set()
+        for key in band_keys(sig):
+            for doc_id in self.buckets.get(key, ()):
+                if doc_id in seen:
+                    continue
+                seen.add(doc_id)
+                score = similarity(sig, self.signatures[doc_id])
+                if score >= best_score:
+                    best, best_score = doc_id, score
+        return best
@@ -2,44 +2,85 @@ import csv
 import json
 import io
 from datetime import datetime
-from fpdf import FPDF
-from flask import make_response, send_file
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak, Image, Flowable
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from io import BytesIO
+from flask import make_response
 import re
 import os
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
 from collections import Counter
 
+
+def encode_chunks(pieces, chunk_size):
+    """Join an iterable of small strings into UTF-8 chunks of about chunk_size bytes"""
+    buffer, length = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= chunk_size:
+            yield "".join(buffer).encode("utf-8")
+            buffer, length = [], 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+
+def json_chunks(data, chunk_size):
+    """Encode data as JSON (like Flask's jsonify) in chunks of about chunk_size bytes"""
+    encoder = json.JSONEncoder(sort_keys=True, separators=(",", ":"))
+    return encode_chunks(encoder.iterencode(data), chunk_size)
+
+
 class ExportManager:
     """Handles exporting search results in different formats"""
-    
+
+    # Formats that are written out one result at a time, and their content types
+    STREAMING_FORMATS = {'csv': 'text/csv', 'json': 'application/json'}
+
     @staticmethod
-    def export_to_csv(results, query):
-        """Export search results to CSV format"""
+    def export_filename(query, extension):
+        return f"search-results-{query.replace(' ', '_')}-{datetime.now().strftime('%Y%m%d')}.{extension}"
+
+    @staticmethod
+    def _export_fields(result):
+        """A result as exported: 1-based page number, rounded score and no highlight tags"""
+        return {
+            'filename': result['filename'],
+            'page_number': result['page'] + 1,
+            'score': round(result['score'], 2),
+            'excerpt': re.sub(r'<[^>]+>', '', result.get('highlight', ''))
+        }
+
+    @staticmethod
+    def iter_csv(results):
+        """Yield the CSV export line by line"""
         output = io.StringIO()
         writer = csv.writer(output)
-        
-        # Write header
         writer.writerow(['Filename', 'Page Number', 'Score', 'Excerpt'])
-        
-        # Write data
         for result in results:
-            writer.writerow([
-                result['filename'],
-                result['page_num'] + 1,  # Make page number 1-based for user
-                round(result['score'], 2),
-                result['excerpt'].replace('<mark>', '').replace('</mark>', '')
-            ])
-        
-        # Create response
-        response = make_response(output.getvalue())
-        response.headers["Content-Disposition"] = f"attachment; filename=search-results-{query.replace(' ', '_')}-{datetime.now().strftime('%Y%m%d')}.csv"
+            fields = ExportManager._export_fields(result)
+            writer.writerow([fields['filename'], fields['page_number'], fields['score'], fields['excerpt']])
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+        yield output.getvalue()
+
+    @staticmethod
+    def iter_json(results):
+        """Yield the JSON export one result at a time"""
+        yield "["
+        for i, result in enumerate(results):
+            entry = json.dumps(ExportManager._export_fields(result), indent=2).replace("\n", "\n  ")
+            yield f"{',' if i else ''}\n  {entry}"
+        yield "\n]" if results else "]"
+
+    @staticmethod
+    def stream(results, export_format, chunk_size):
+        """Encoded chunks of a CSV or JSON export, generated as they are read"""
+        rows = ExportManager.iter_csv(results) if export_format == 'csv' else ExportManager.iter_json(results)
+        return encode_chunks(rows, chunk_size)
+
+    @staticmethod
+    def export_to_csv(results, query):
+        """Export search results to CSV format"""
+        response = make_response("".join(ExportManager.iter_csv(results)))
+        response.headers["Content-Disposition"] = f"attachment; filename={ExportManager.export_filename(query, 'csv')}"
         response.headers["Content-type"] = "text/csv"
         
         return response
@@ -47,19 +88,8 @@ class ExportManager:
     @staticmethod
     def export_to_json(results, query):
         """Export search results to JSON format"""
-        # Clean up results for export (remove HTML tags, etc.)
-        export_results = []
-        for result in results:
-            export_results.append({
-                'filename': result['filename'],
-                'page_number': result['page_num'] + 1,
-                'score': round(result['score'], 2),
-                'excerpt': result['excerpt'].replace('<mark>', '').replace('</mark>', '')
-            })
-        
-        # Create response
-        response = make_response(json.dumps(export_results, indent=2))
-        response.headers["Content-Disposition"] = f"attachment; filename=search-results-{query.replace(' ', '_')}-{datetime.now().strftime('%Y%m%d')}.json"
+        response = make_response("".join(ExportManager.iter_json(results)))
+        response.headers["Content-Disposition"] = f"attachment; filename={ExportManager.export_filename(query, 'json')}"
         response.headers["Content-type"] = "application/json"
         
         return response
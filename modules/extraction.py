@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import signal
+import threading
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; workers then run without a memory cap
+    resource = None
+
+
+class ExtractionError(Exception):
+    """A document could not be extracted; the message is the reason"""
+
+
+def _worker_main(conn, memory_limit_mb, batch_size, words=False):
+    """Extraction worker: receives PDF paths and sends back batches of pages"""
+    # An ignored SIGTERM survives exec, and would make terminate() do nothing
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    from modules.pdf_extractor import PDFExtractor
+    extractor = PDFExtractor(None)
+
+    # Cap memory once the libraries are loaded, so the limit applies to documents
+    if resource is not None and memory_limit_mb:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    while True:
+        try:
+            pdf_path = conn.recv()
+        except EOFError:
+            return
+        if pdf_path is None:
+            return
+
+        try:
+            batch = []
+            for page in extractor.iter_pages(pdf_path, words=words):
+                batch.append(page)
+                if len(batch) >= batch_size:
+                    conn.send(("pages", batch))
+                    batch = []
+            conn.send(("pages", batch))
+            conn.send(("done", None))
+        except MemoryError:
+            conn.send(("error", f"exceeded the {memory_limit_mb} MB memory limit"))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, context, memory_limit_mb, batch_size, words=False):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main,
+                                       args=(child_conn, memory_limit_mb, batch_size, words),
+                                       name="pdf-extractor", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.documents = 0
+
+    def exit_reason(self):
+        """Describe why the worker stopped answering"""
+        self.process.join(1)
+        code = self.process.exitcode
+        if code is None:
+            return "extraction worker stopped responding"
+        if code < 0:
+            return f"extraction worker was killed by signal {-code}"
+        return f"extraction worker exited with code {code}"
+
+    def stop(self, kill=False):
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class ExtractionPool:
+    """Runs PDF extraction in separate worker processes, away from the web server.
+
+    Each worker has an RLIMIT_AS memory cap and is replaced after
+    max_documents documents. A document that takes longer than timeout
+    seconds of extraction, or that crashes or exhausts its worker, raises
+    ExtractionError and the worker is killed and replaced. With words, pages
+    carry their word bounding boxes as in PDFExtractor.iter_pages.
+    """
+
+    def __init__(self, workers=2, timeout=120, memory_limit_mb=2048, max_documents=50, batch_size=50, words=False):
+        self.timeout = timeout
+        self.words = words
+        self.memory_limit_mb = memory_limit_mb
+        self.max_documents = max_documents
+        self.batch_size = batch_size
+        # Forking the multi-threaded web server would copy its memory and any locks held by other
+        # threads into the worker, so workers come from a small server process, or a fresh interpreter
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            self._context = multiprocessing.get_context("forkserver")
+            self._context.set_forkserver_preload(["modules.pdf_extractor"])
+        else:
+            self._context = multiprocessing.get_context("spawn")
+        self._slots = threading.Semaphore(max(1, workers))
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        self._slots.acquire()
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        try:
+            return _Worker(self._context, self.memory_limit_mb, self.batch_size, self.words)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, worker, healthy):
+        worker.documents += 1
+        if healthy and worker.documents < self.max_documents:
+            with self._lock:
+                self._idle.append(worker)
+        else:
+            worker.stop(kill=not healthy)
+        self._slots.release()
+
+    def iter_pages(self, pdf_path):
+        """Yield (page_num, text, metadata) like PDFExtractor.iter_pages, extracted in a worker.
+
+        Only time spent waiting for the worker counts against the timeout, so
+        a slow consumer does not cause a document to be rejected.
+        """
+        worker = self._acquire()
+        healthy = False
+        try:
+            worker.conn.send(os.path.abspath(pdf_path))
+            remaining = self.timeout
+            while True:
+                started = time.time()
+                if not worker.conn.poll(remaining):
+                    raise ExtractionError(f"extraction timed out after {self.timeout}s")
+                remaining -= time.time() - started
+                try:
+                    kind, payload = worker.conn.recv()
+                except (EOFError, OSError):
+                    raise ExtractionError(worker.exit_reason())
+                if kind == "pages":
+                    yield from payload
+                elif kind == "done":
+                    healthy = True
+                    return
+                else:
+                    healthy = True  # The worker caught the error itself and can carry on
+                    raise ExtractionError(payload)
+        finally:
+            self._release(worker, healthy)
+
+    def close(self):
+        """Stop the idle workers"""
+        with self._lock:
+            workers, self._idle = self._idle, []
+        for worker in workers:
+            worker.stop()
+
+
+class Quarantine:
+    """Records documents that failed extraction, with the reason, in a JSON file.
+
+    An entry remembers the file's size and modification time, so a replaced
+    file is tried again instead of staying quarantined.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def add(self, pdf_path, reason):
+        """Quarantine a file, recording why"""
+        stat = os.stat(pdf_path)
+        with self._lock:
+            entries = self._load()
+            entries[os.path.basename(pdf_path)] = {
+                "reason": reason,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "quarantined_at": time.time()
+            }
+            self._save(entries)
+        print(f"Quarantined {os.path.basename(pdf_path)}: {reason}")
+
+    def remove(self, filename):
+        with self._lock:
+            entries = self._load()
+            if entries.pop(filename, None) is not None:
+                self._save(entries)
+
+    def contains(self, pdf_path):
+        """Whether a file is quarantined and unchanged since"""
+        entry = self._load().get(os.path.basename(pdf_path))
+        if entry is None:
+            return False
+        try:
+            stat = os.stat(pdf_path)
+        except FileNotFoundError:
+            return False
+        return entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime
+
+    def entries(self):
+        return self._load()
@@ -0,0 +1,194 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+
+# Bytes read at a time while hashing
+CHUNK_SIZE = 1024 * 1024
+
+
+def new_hasher():
+    """The content hash extraction results are cached under"""
+    return hashlib.blake2b(digest_size=20)
+
+
+def file_digest(path):
+    """Hash a file's contents"""
+    hasher = new_hasher()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def save_stream(stream, path):
+    """Copy a stream to a file, hashing it on the way; returns the digest"""
+    hasher = new_hasher()
+    with open(path, "wb") as f:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
+            f.write(chunk)
+    return hasher.hexdigest()
+
+
+def _read_meta(directory):
+    """An entry's meta.json, or None if there is no complete entry there"""
+    try:
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, NotADirectoryError, ValueError):
+        return None
+
+
+class CacheWriter:
+    """Writes one extraction result to the cache a page at a time.
+
+    Pages go to pages.jsonl as one JSON object per line, and meta.json records
+    the page count and whether word boxes were captured. The entry only becomes
+    visible once close() moves it into place.
+    """
+
+    def __init__(self, directory, words=False):
+        self.directory = directory
+        self.words = words
+        self.pages = 0
+        self._tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=os.path.dirname(os.path.dirname(directory)))
+        self._file = open(os.path.join(self._tmp_dir, "pages.jsonl"), "w", encoding="utf-8")
+
+    def write_page(self, page_num, text, metadata):
+        self._file.write(json.dumps({"page": page_num, "text": text, "metadata": metadata}, ensure_ascii=False) + "\n")
+        self.pages += 1
+
+    def close(self, total_pages):
+        """Finish the entry and move it into place"""
+        self._file.close()
+        with open(os.path.join(self._tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"pages": self.pages, "total_pages": total_pages, "words": self.words}, f)
+        os.makedirs(os.path.dirname(self.directory), exist_ok=True)
+        try:
+            os.replace(self._tmp_dir, self.directory)
+            return
+        except OSError:
+            pass
+
+        existing = _read_meta(self.directory)
+        if existing is not None and (existing["words"] or not self.words):
+            # Another ingest of the same content finished first; its entry is just as good
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            return
+        # The cached entry lacks the word boxes captured here: a directory can only
+        # replace an empty one, so move the old entry aside first
+        old_dir = tempfile.mkdtemp(prefix=".old-", dir=os.path.dirname(os.path.dirname(self.directory)))
+        try:
+            os.replace(self.directory, old_dir)
+            os.replace(self._tmp_dir, self.directory)
+        except OSError:
+            # Lost a race with another writer replacing the same entry
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    def abort(self):
+        """Discard a partly written entry"""
+        self._file.close()
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+
+class ExtractionCache:
+    """Extracted pages cached by a hash of the PDF's bytes.
+
+    names.json maps each filename to its content hash, along with the size and
+    modification time it was hashed at, so an unchanged file is looked up
+    without reading it again. A duplicate upload or a renamed file then reuses
+    the cached pages instead of going through PyMuPDF. An entry is deleted
+    once no filename maps to it.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self._names_path = os.path.join(cache_dir, "names.json")
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_dir(self, digest):
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def _load_names(self):
+        try:
+            with open(self._names_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_names(self, names):
+        tmp_path = self._names_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(names, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self._names_path)
+
+    def digest(self, pdf_path):
+        """Content hash of a PDF, reusing the recorded one if the file is unchanged"""
+        stat = os.stat(pdf_path)
+        entry = self._load_names().get(os.path.basename(pdf_path))
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return entry["digest"]
+        return file_digest(pdf_path)
+
+    def contains(self, digest, words=False):
+        """Whether pages for this content are cached, with word boxes if asked for"""
+        meta = _read_meta(self._entry_dir(digest))
+        return meta is not None and (meta["words"] or not words)
+
+    def iter_pages(self, digest):
+        """Yield cached (page_num, text, metadata) tuples like PDFExtractor.iter_pages"""
+        with open(os.path.join(self._entry_dir(digest), "pages.jsonl"), "r", encoding="utf-8") as f:
+            for line in f:
+                page = json.loads(line)
+                yield page["page"], page["text"], page["metadata"]
+
+    def writer(self, digest, words=False):
+        """Open a CacheWriter for this content"""
+        return CacheWriter(self._entry_dir(digest), words=words)
+
+    def link(self, filename, digest, pdf_path):
+        """Record that a file has this content"""
+        stat = os.stat(pdf_path)
+        with self._lock:
+            names = self._load_names()
+            previous = names.get(filename, {}).get("digest")
+            names[filename] = {"digest": digest, "size": stat.st_size, "mtime": stat.st_mtime}
+            self._save_names(names)
+            if previous and previous != digest:
+                self._release(previous, names)
+
+    def rename(self, old_filename, new_filename):
+        """Move a file's content hash to its new name"""
+        with self._lock:
+            names = self._load_names()
+            entry = names.pop(old_filename, None)
+            if entry is None:
+                return
+            previous = names.get(new_filename, {}).get("digest")
+            names[new_filename] = entry
+            self._save_names(names)
+            if previous and previous != entry["digest"]:
+                self._release(previous, names)
+
+    def unlink(self, filename):
+        """Forget a file, deleting its cached pages if no other file shares them"""
+        with self._lock:
+            names = self._load_names()
+            entry = names.pop(filename, None)
+            if entry is None:
+                return
+            self._save_names(names)
+            self._release(entry["digest"], names)
+
+    def _release(self, digest, names):
+        if not any(entry["digest"] == digest for entry in names.values()):
+            shutil.rmtree(self._entry_dir(digest), ignore_errors=True)
+
+    def stats(self):
+        names = self._load_names()
+        return {"files": len(names), "entries": len({entry["digest"] for entry in names.values()})}
@@ -0,0 +1,122 @@
+from html import escape
+
+# Longest run of text a single fragment may span between its first and last match
+FRAGMENT_CHARS = 100
+
+# Characters of surrounding text added on each side of a fragment's matches
+FRAGMENT_SURROUND = 50
+
+# Characters of context shown before and after the highlighted fragments
+CONTEXT_CHARS = 150
+
+
+def load_match_spans(searcher, results, fieldname="content"):
+    """Map each hit's doc number to the (start, end, term) spans of its matches.
+
+    The offsets come from the character positions stored in the postings of the
+    matched terms, so the page text is never re-analyzed. Results must have
+    been collected with terms=True.
+    """
+    spans = {hit.docnum: [] for hit in results}
+    if not spans or not results.has_matched_terms():
+        return spans
+
+    for term in results.matched_terms():
+        if term[0] != fieldname:
+            continue
+        docnums = sorted(d for d in results.termdocs[term] if d in spans)
+        if not docnums:
+            continue
+        matcher = searcher.postings(fieldname, term[1])
+        for docnum in docnums:
+            matcher.skip_to(docnum)
+            if not matcher.is_active():
+                break
+            if matcher.id() == docnum:
+                spans[docnum].extend((start, end, term[1]) for _, start, end in matcher.value_as("characters"))
+
+    for docnum in spans:
+        spans[docnum].sort()
+    return spans
+
+
+def best_fragments(spans, text_length, top=3):
+    """Group match spans into at most `top` fragments, returned in text order.
+
+    Each fragment is a (start, end, matches) tuple. Fragments are ranked like
+    whoosh's BasicFragmentScorer (more matches of more distinct terms first)
+    with ties going to the earlier fragment, then widened by FRAGMENT_SURROUND.
+    """
+    candidates = []
+    i = 0
+    while i < len(spans):
+        j = i
+        while j + 1 < len(spans) and spans[j + 1][1] - spans[i][0] <= FRAGMENT_CHARS:
+            j += 1
+        matches = spans[i:j + 1]
+        score = len(matches) * len(set(term for _, _, term in matches)) * 100
+        candidates.append((-score, matches[0][0], matches))
+        i = j + 1
+
+    ranges = sorted((max(0, matches[0][0] - FRAGMENT_SURROUND), min(text_length, matches[-1][1] + FRAGMENT_SURROUND))
+                    for _, _, matches in sorted(candidates)[:top])
+
+    # Widening can make neighbouring fragments overlap; join those into one
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    # Every match inside a fragment is highlighted, not just the ones it was ranked on
+    return [(start, end, [span for span in spans if span[0] >= start and span[1] <= end])
+            for start, end in merged]
+
+
+def _trim_to_words(text, start, end, matches):
+    """Move fragment edges inward to whitespace so words are not cut in half"""
+    first_space = text.find(" ", start, matches[0][0])
+    if start > 0 and first_space >= 0:
+        start = first_space + 1
+    last_space = text.rfind(" ", matches[-1][1], end)
+    if end < len(text) and last_space >= 0:
+        end = last_space
+    return start, end
+
+
+def format_fragments(text, fragments, tagname="em"):
+    """Render fragments as escaped HTML with each match wrapped in a tag"""
+    output = []
+    for start, end, matches in fragments:
+        start, end = _trim_to_words(text, start, end, matches)
+        pieces = []
+        pos = start
+        for match_start, match_end, _ in matches:
+            if match_start < pos:
+                continue  # Overlaps the previous match
+            pieces.append(escape(text[pos:match_start], quote=False))
+            pieces.append(f"<{tagname}>{escape(text[match_start:match_end], quote=False)}</{tagname}>")
+            pos = match_end
+        pieces.append(escape(text[pos:end], quote=False))
+        output.append("".join(pieces))
+    return "...".join(output)
+
+
+def extract_context(text, fragments):
+    """Slice the text before the first fragment and after the last one"""
+    if not fragments:
+        return "", ""
+
+    start = _trim_to_words(text, *fragments[0])[0]
+    end = _trim_to_words(text, *fragments[-1])[1]
+
+    context_before = text[max(0, start - CONTEXT_CHARS):start].strip()
+    if context_before and start > CONTEXT_CHARS:
+        context_before = "..." + context_before
+
+    context_after = text[end:end + CONTEXT_CHARS].strip()
+    if context_after and end + CONTEXT_CHARS < len(text):
+        context_after = context_after + "..."
+
+    return escape(context_before, quote=False), escape(context_after, quote=False)
@@ -0,0 +1,314 @@
+import os
+import time
+import socket
+import ipaddress
+import threading
+from multiprocessing.connection import Listener, Client, AuthenticationError
+
+from config import (PDF_DIR, DATA_DIR, MERGE_INTERVAL, MERGE_MAX_SEGMENTS, MERGE_DELETED_RATIO, MERGE_IDLE_SECONDS,
+                    MERGE_OPTIMIZE, CATALOG_WATCH, CATALOG_RECONCILE_INTERVAL, WATCH_INGEST, WATCH_SETTLE_SECONDS,
+                    WATCH_POLL_INTERVAL, WATCH_INGEST_RATE, WATCH_MAX_PENDING_WRITES)
+from modules.catalog import CatalogReconciler
+from modules.watcher import DirectoryWatcher, IngestQueue
+from modules.maintenance import MergeScheduler
+
+# Indexer methods web workers may call through an IndexerClient
+OPERATIONS = ("ingest", "reingest", "remove", "rename", "rebuild", "flush", "status", "watch_status",
+              "reconciler_status")
+
+
+class IndexerError(Exception):
+    """An indexer operation failed, or the indexer process could not be reached"""
+
+
+def parse_address(address):
+    """Turn "host:port" into a TCP address; anything else is a socket path"""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and os.sep not in address:
+        return (host or "localhost", int(port))
+    return address
+
+
+def _is_loopback(host):
+    """Whether every address a host name resolves to is a loopback address"""
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except socket.gaierror:
+        return False
+    return bool(infos) and all(ipaddress.ip_address(info[4][0].split("%")[0]).is_loopback for info in infos)
+
+
+class Indexer:
+    """Every change to the index and the document stores, plus the maintenance that writes.
+
+    With one web worker the app uses an Indexer directly. With several, a
+    single indexer process (indexer.py) serves it through IndexerServer and the
+    workers call it through an IndexerClient, so there is only ever one writer;
+    the workers open the index read-only. It also runs segment merges and the
+    directory watcher or catalog reconciler.
+    """
+
+    def __init__(self, services):
+        self.services = services
+        self.ingestor = services.ingestor
+        self.search_engine = services.search_engine
+        self.merge_scheduler = MergeScheduler(self.search_engine, interval=MERGE_INTERVAL,
+                                              max_segments=MERGE_MAX_SEGMENTS, max_deleted_ratio=MERGE_DELETED_RATIO,
+                                              idle_seconds=MERGE_IDLE_SECONDS, optimize=MERGE_OPTIMIZE)
+
+        # Files the catalog first meets on disk count as indexed if their extracted text was stored
+        self.catalog_reconciler = CatalogReconciler(
+            services.document_catalog, PDF_DIR, interval=CATALOG_RECONCILE_INTERVAL, use_inotify=CATALOG_WATCH,
+            status_of=lambda name: 'indexed' if os.path.exists(os.path.join(DATA_DIR, f"{name}.json")) else 'pending')
+
+        # Incremental ingest of PDF_DIR: files are ingested at a bounded rate, and only while the index writer keeps up
+        self.ingest_queue = IngestQueue(self._watched_file, rate=WATCH_INGEST_RATE,
+                                        ready=lambda: self.search_engine.writer.pending() < WATCH_MAX_PENDING_WRITES)
+        self.directory_watcher = DirectoryWatcher(
+            PDF_DIR, on_change=lambda name: self.ingest_queue.put('change', name),
+            on_remove=lambda name: self.ingest_queue.put('remove', name),
+            known=lambda: services.document_catalog.snapshot(statuses=('indexed', 'failed', 'quarantined')),
+            settle=WATCH_SETTLE_SECONDS, interval=WATCH_POLL_INTERVAL, use_inotify=CATALOG_WATCH)
+
+    def start(self):
+        """Start merging segments and following changes to PDF_DIR"""
+        self.merge_scheduler.start()
+        if WATCH_INGEST:
+            # The watcher also keeps the catalog current, so the reconciler is not needed
+            self.directory_watcher.start()
+        else:
+            self.catalog_reconciler.start()
+
+    def stop(self):
+        self.directory_watcher.stop()
+        self.catalog_reconciler.stop()
+        self.ingest_queue.stop()
+        self.merge_scheduler.stop()
+
+    def _watched_file(self, kind, filename):
+        """Bring a file the directory watcher reported into the index, or drop it from the index"""
+        pdf_path = os.path.join(PDF_DIR, filename)
+        if self.ingestor.is_ingesting(filename):
+            return
+        if kind == 'remove':
+            # Deletes and renames made through the application have already dropped the entry
+            if self.services.document_catalog.get(filename) is not None and not os.path.exists(pdf_path):
+                self.ingestor.remove([filename])
+                print(f"Removed {filename}, deleted from {PDF_DIR}")
+            return
+        try:
+            if self.ingestor.is_current(pdf_path):
+                return
+        except FileNotFoundError:
+            return
+        self.ingestor.reingest(pdf_path)
+
+    def ingest(self, pdf_path, digest=None):
+        """Ingest a new PDF; returns whether it was extracted and queued for indexing"""
+        return self.ingestor.ingest(pdf_path, digest) is not None
+
+    def reingest(self, pdf_path):
+        """Ingest a new or changed PDF, replacing any older version"""
+        return self.ingestor.reingest(pdf_path) is not None
+
+    def remove(self, filenames):
+        """Drop deleted files from every store and index"""
+        self.ingestor.remove(filenames)
+
+    def rename(self, old_filename, new_filename):
+        """Carry the extracted text and index entries of a renamed file over to its new name"""
+        services = self.services
+        services.data_storage.rename_json(old_filename, new_filename)
+        services.search_engine.rename_document(old_filename, new_filename)
+        services.similarity_index.rename_document(old_filename, new_filename)
+        services.layout_store.rename_document(old_filename, new_filename)
+        services.extraction_cache.rename(old_filename, new_filename)
+        services.document_catalog.rename(old_filename, new_filename)
+
+    def rebuild(self):
+        """Clear the index and ingest every PDF again; returns the processed, failed and quarantined counts"""
+        services = self.services
+        pdf_files = [f for f in os.listdir(PDF_DIR) if f.lower().endswith('.pdf')]
+
+        # Clear the existing index and recreate every shard to rebuild it
+        services.reset_index()
+
+        counts = {'processed': 0, 'failed': 0, 'quarantined': 0}
+        for filename in pdf_files:
+            pdf_path = os.path.join(PDF_DIR, filename)
+            # Files that already failed extraction are skipped until they change
+            if services.quarantine.contains(pdf_path):
+                services.document_catalog.record(pdf_path, 'quarantined')
+                counts['quarantined'] += 1
+                continue
+            try:
+                # Extract text, save it and add it to the search index page by page
+                counts['processed' if self.ingest(pdf_path) else 'failed'] += 1
+            except Exception as e:
+                counts['failed'] += 1
+                print(f"Error processing {filename}: {e}")
+
+        # Make sure everything is searchable before reporting back
+        self.search_engine.flush()
+        return counts
+
+    def flush(self, timeout=None):
+        """Wait until every write queued so far is committed and visible to searches"""
+        return self.search_engine.flush(timeout)
+
+    def status(self):
+        """Pending writes and merge scheduling"""
+        writer = self.search_engine.writer
+        return {
+            'writer': {
+                'pending': writer.pending(),
+                'batches': writer.batches,
+                'operations': writer.operations,
+                'last_commit': writer.last_commit
+            },
+            'merge': {
+                'scheduler': self.merge_scheduler.status(),
+                'last_merge': self.search_engine.last_merge
+            }
+        }
+
+    def watch_status(self):
+        """Directory watcher and incremental ingest queue progress"""
+        return {'enabled': WATCH_INGEST, 'watcher': self.directory_watcher.status(),
+                'queue': self.ingest_queue.status()}
+
+    def reconciler_status(self):
+        return self.catalog_reconciler.status()
+
+
+class IndexerServer:
+    """Serves an Indexer to web workers over a local socket.
+
+    Every connection gets a thread that reads (operation, args, kwargs)
+    messages and answers each with ("ok", result) or ("error", message). The
+    operations go through the Indexer as they would in-process, so index
+    writes still pass through its single writer thread. Messages are
+    unpickled, so anyone who can connect can run code in this process: a
+    socket path is created readable by this user only, and a TCP address must
+    be a loopback one and needs an authkey.
+    """
+
+    def __init__(self, indexer, address, authkey=None):
+        self.indexer = indexer
+        self.address = parse_address(address)
+        self.authkey = authkey
+        if isinstance(self.address, tuple):
+            if not authkey:
+                raise IndexerError("Set INDEXER_AUTHKEY to listen on a TCP address")
+            if not _is_loopback(self.address[0]):
+                raise IndexerError(f"Refusing to listen on {self.address[0]}, which is not a loopback address")
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            # A socket left behind by an indexer that did not shut down cleanly
+            try:
+                Client(self.address, authkey=authkey).close()
+                listening = True
+            except ConnectionRefusedError:
+                listening = False
+            except (AuthenticationError, EOFError):
+                listening = True
+            if listening:
+                raise IndexerError(f"An indexer is already listening on {self.address}")
+            os.remove(self.address)
+        # Create the socket file without group or other permissions, rather than
+        # narrowing them after it is already accepting connections
+        umask = os.umask(0o077)
+        try:
+            self.listener = Listener(self.address, authkey=authkey)
+        finally:
+            os.umask(umask)
+        self._closed = False
+
+    def serve_forever(self):
+        """Accept connections until close() is called"""
+        print(f"Indexer listening on {self.listener.address}")
+        while not self._closed:
+            try:
+                conn = self.listener.accept()
+            except (AuthenticationError, EOFError, ConnectionResetError) as e:
+                print(f"Indexer rejected a connection: {str(e)}")
+                continue
+            except OSError:
+                if self._closed:
+                    return
+                raise
+            threading.Thread(target=self._handle, args=(conn,), name="indexer-connection", daemon=True).start()
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    operation, args, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+                if operation not in OPERATIONS:
+                    reply = ("error", f"Unknown indexer operation: {operation}")
+                else:
+                    try:
+                        reply = ("ok", getattr(self.indexer, operation)(*args, **kwargs))
+                    except Exception as e:
+                        print(f"Indexer error in {operation}: {str(e)}")
+                        reply = ("error", str(e))
+                try:
+                    conn.send(reply)
+                except OSError:
+                    return
+
+    def close(self):
+        self._closed = True
+        self.listener.close()
+
+
+class IndexerClient:
+    """Calls the Indexer in the indexer process; has the same operations as Indexer.
+
+    Each thread keeps its own connection. The first call waits up to
+    connect_timeout seconds for the indexer to accept connections, so web
+    workers may start before it. A call that fails in the indexer raises
+    IndexerError with its message.
+    """
+
+    def __init__(self, address, authkey=None, connect_timeout=30):
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.connect_timeout = connect_timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        deadline = time.time() + self.connect_timeout
+        while True:
+            try:
+                return Client(self.address, authkey=self.authkey)
+            except (FileNotFoundError, ConnectionRefusedError) as e:
+                if time.time() >= deadline:
+                    raise IndexerError(f"The indexer at {self.address} is not reachable: {str(e)}")
+                time.sleep(0.2)
+
+    def call(self, operation, *args, **kwargs):
+        conn = getattr(self._local, "conn", None)
+        # The indexer never writes unprompted, so a readable idle connection has been closed by it
+        if conn is not None and conn.poll():
+            conn.close()
+            conn = None
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        try:
+            conn.send((operation, args, kwargs))
+            status, value = conn.recv()
+        except (EOFError, OSError) as e:
+            # Not retried: the indexer may already have applied the operation
+            conn.close()
+            self._local.conn = None
+            raise IndexerError(f"Lost the connection to the indexer during {operation}: {str(e)}")
+        if status != "ok":
+            raise IndexerError(value)
+        return value
+
+    def __getattr__(self, name):
+        if name not in OPERATIONS:
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self.call(name, *args, **kwargs)
@@ -0,0 +1,144 @@
+import os
+import threading
+
+from modules.extraction import ExtractionError
+
+
+class Ingestor:
+    """Streams PDFs into the text store, layout store, search and similarity indexes and the catalog.
+
+    Pages are handled batch_pages at a time and queued for indexing; once
+    max_queued_batches are waiting, the index writer is told to commit them
+    together, so a long PDF is never held in memory at once.
+    Extraction runs in the extraction pool's worker processes; a PDF that fails
+    there is quarantined with the reason. Extracted pages are cached by content
+    hash, so a PDF whose bytes were seen before skips extraction entirely.
+    """
+
+    def __init__(self, extraction_pool, extraction_cache, data_storage, layout_store, search_engine, similarity_index,
+                 quarantine, document_catalog, batch_pages=50, words=True, max_queued_batches=4):
+        self.extraction_pool = extraction_pool
+        self.extraction_cache = extraction_cache
+        self.data_storage = data_storage
+        self.layout_store = layout_store
+        self.search_engine = search_engine
+        self.similarity_index = similarity_index
+        self.quarantine = quarantine
+        self.document_catalog = document_catalog
+        self.batch_pages = batch_pages
+        self.max_queued_batches = max(1, max_queued_batches)
+        self.words = words
+        self._active = set()  # Files being ingested right now
+        self._lock = threading.Lock()
+
+    def is_ingesting(self, filename):
+        with self._lock:
+            return filename in self._active
+
+    def ingest(self, pdf_path, digest=None):
+        """Ingest a PDF; returns its last queued index write, or None if it failed.
+
+        Pass digest if the content hash is already known.
+        """
+        filename = os.path.basename(pdf_path)
+        with self._lock:
+            self._active.add(filename)
+        try:
+            return self._ingest(pdf_path, filename, digest)
+        finally:
+            with self._lock:
+                self._active.discard(filename)
+
+    def _ingest(self, pdf_path, filename, digest):
+        digest = digest or self.extraction_cache.digest(pdf_path)
+        if self.extraction_cache.contains(digest, words=self.words):
+            print(f"Reusing cached extraction for {filename}")
+            pages, cached = self.extraction_cache.iter_pages(digest), None
+        else:
+            pages = self.extraction_pool.iter_pages(pdf_path)
+            cached = self.extraction_cache.writer(digest, words=self.words)
+        store = self.data_storage.page_writer(filename)
+        layout = self.layout_store.page_writer(filename) if self.words else None
+        indexed = None
+        queued = []  # Batches written since the last commit
+        total_pages = 0
+        batch = {}
+        try:
+            for page_num, text, metadata in pages:
+                total_pages = metadata['total_pages']
+                batch[page_num] = text
+                if cached is not None:
+                    cached.write_page(page_num, text, metadata)
+                if layout is not None:
+                    layout.write_page(page_num, metadata.get('words', []), metadata)
+                if len(batch) >= self.batch_pages:
+                    indexed = self._ingest_batch(filename, batch, store, queued)
+                    batch = {}
+            if batch or indexed is None:
+                indexed = self._ingest_batch(filename, batch, store, queued)
+            store.close(total_pages)
+            if layout is not None:
+                layout.close()
+            if cached is not None:
+                cached.close(total_pages)
+            self.extraction_cache.link(filename, digest, pdf_path)
+            self.quarantine.remove(filename)
+            self.document_catalog.record(pdf_path, 'indexed', pages=total_pages, digest=digest)
+            return indexed
+        except Exception as e:
+            print(f"Error ingesting {pdf_path}: {e}")
+            if isinstance(e, ExtractionError):
+                self.quarantine.add(pdf_path, str(e))
+            store.abort()
+            if layout is not None:
+                layout.abort()
+            if cached is not None:
+                cached.abort()
+            # Drop whatever was indexed before the failure
+            self.search_engine.remove_document(filename)
+            self.similarity_index.remove_document(filename)
+            if os.path.exists(pdf_path):
+                self.document_catalog.record(pdf_path, 'quarantined' if isinstance(e, ExtractionError) else 'failed',
+                                             digest=digest)
+            return None
+
+    def _ingest_batch(self, filename, pages, store, queued):
+        """Store and queue one batch of pages, committing the queued batches once there are enough of them"""
+        store.write_pages(pages)
+        if len(queued) >= self.max_queued_batches:
+            # Close the writer's commit window rather than waiting it out; the batches share one commit
+            self.search_engine.flush()
+            queued.clear()
+        data = {'filename': filename, 'pages': pages}
+        self.similarity_index.add_documents([data])
+        queued.append(self.search_engine.index_documents([data]))
+        return queued[-1]
+
+    def is_current(self, pdf_path):
+        """Whether the catalog already has this version of the file (indexed, failed or quarantined)"""
+        entry = self.document_catalog.get(os.path.basename(pdf_path))
+        if entry is None or entry['status'] == 'pending':
+            return False
+        stat = os.stat(pdf_path)
+        return (entry['size'], entry['date_modified']) == (stat.st_size, stat.st_mtime)
+
+    def reingest(self, pdf_path):
+        """Ingest a new or changed file, replacing the pages of any older version"""
+        filename = os.path.basename(pdf_path)
+        if self.quarantine.contains(pdf_path):
+            self.document_catalog.record(pdf_path, 'quarantined')
+            return None
+        if self.document_catalog.get(filename) is not None:
+            self.search_engine.remove_document(filename)
+            self.similarity_index.remove_document(filename)
+        return self.ingest(pdf_path)
+
+    def remove(self, filenames):
+        """Drop files from every store and index, taking them out of the search index in one commit"""
+        self.search_engine.remove_documents(filenames)
+        for filename in filenames:
+            self.similarity_index.remove_document(filename)
+            self.layout_store.remove_document(filename)
+            self.extraction_cache.unlink(filename)
+            self.quarantine.remove(filename)
+        self.document_catalog.remove(filenames)
@@ -0,0 +1,176 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Documents whose page tables are kept in memory between lookups
+PAGE_TABLE_CACHE = 32
+
+
+class LayoutWriter:
+    """Writes one document's word bounding boxes a page at a time.
+
+    Boxes go to boxes.f32 as raw float32 (x0, y0, x1, y1) rows, the words to
+    words.txt as one space-separated line per page, and pages.json records
+    where each page's rows and line start along with its size. Everything is
+    written to a temporary directory of its own, so writers of the same
+    document never share one, and moved into place by close().
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._tmp_dir = self._mkdtemp(".tmp")
+        self._boxes = open(os.path.join(self._tmp_dir, "boxes.f32"), "wb")
+        self._words = open(os.path.join(self._tmp_dir, "words.txt"), "wb")
+        self.rows = 0
+        self.pages = {}
+
+    def write_page(self, page_num, words, metadata):
+        """Append a page's (x0, y0, x1, y1, word) tuples"""
+        boxes = np.array([word[:4] for word in words], dtype=np.float32).reshape(-1, 4)
+        line = (" ".join(word[4] for word in words) + "\n").encode("utf-8")
+        offset = self._words.tell()
+        self._boxes.write(boxes.tobytes())
+        self._words.write(line)
+        self.pages[str(page_num)] = {
+            "rows": [self.rows, len(words)],
+            "text": [offset, len(line) - 1],
+            "width": metadata.get("width"),
+            "height": metadata.get("height"),
+            "rotation": metadata.get("rotation", 0)
+        }
+        self.rows += len(words)
+
+    def close(self):
+        """Finish the document and move it into place, replacing any older copy"""
+        self._boxes.close()
+        self._words.close()
+        with open(os.path.join(self._tmp_dir, "pages.json"), "w", encoding="utf-8") as f:
+            json.dump({"rows": self.rows, "pages": self.pages}, f)
+        try:
+            os.replace(self._tmp_dir, self.directory)
+        except OSError:
+            # A directory can only replace an empty one: move the older copy aside first
+            old = self._mkdtemp(".old")
+            os.replace(self.directory, old)
+            os.replace(self._tmp_dir, self.directory)
+            shutil.rmtree(old, ignore_errors=True)
+        return self.directory
+
+    def _mkdtemp(self, suffix):
+        """Create a uniquely named hidden directory next to the document's"""
+        return tempfile.mkdtemp(suffix=suffix, prefix="." + os.path.basename(self.directory) + ".",
+                                dir=os.path.dirname(self.directory))
+
+    def abort(self):
+        """Discard a partly written document"""
+        self._boxes.close()
+        self._words.close()
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+
+class LayoutStore:
+    """Word bounding boxes per document and page, for drawing search highlights.
+
+    Each document gets a directory written by LayoutWriter. Lookups memory-map
+    the box array and read only the requested page's line of words.
+    """
+
+    def __init__(self, layout_dir):
+        self.layout_dir = layout_dir
+        self._lock = threading.Lock()
+        self._tables = OrderedDict()  # filename -> (mtime, page table)
+        os.makedirs(layout_dir, exist_ok=True)
+
+    def _path(self, filename):
+        return os.path.join(self.layout_dir, os.path.basename(filename))
+
+    def page_writer(self, filename):
+        """Open a LayoutWriter for a document"""
+        self._forget(filename)
+        return LayoutWriter(self._path(filename))
+
+    def _forget(self, filename):
+        with self._lock:
+            self._tables.pop(filename, None)
+
+    def _page_table(self, filename):
+        """Load a document's pages.json, reusing the cached copy while it is unchanged"""
+        path = os.path.join(self._path(filename), "pages.json")
+        try:
+            mtime = os.path.getmtime(path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            cached = self._tables.get(filename)
+            if cached is not None and cached[0] == mtime:
+                self._tables.move_to_end(filename)
+                return cached[1]
+        with open(path, "r", encoding="utf-8") as f:
+            table = json.load(f)
+        with self._lock:
+            self._tables[filename] = (mtime, table)
+            while len(self._tables) > PAGE_TABLE_CACHE:
+                self._tables.popitem(last=False)
+        return table
+
+    def page(self, filename, page_num):
+        """Return (words, boxes, page info) for a page, or None if it has no layout"""
+        table = self._page_table(filename)
+        if table is None:
+            return None
+        info = table["pages"].get(str(page_num))
+        if info is None:
+            return None
+
+        directory = self._path(filename)
+        start, count = info["rows"]
+        if count:
+            boxes = np.memmap(os.path.join(directory, "boxes.f32"), dtype=np.float32, mode="r",
+                              shape=(table["rows"], 4))[start:start + count]
+        else:
+            boxes = np.zeros((0, 4), dtype=np.float32)
+        offset, length = info["text"]
+        with open(os.path.join(directory, "words.txt"), "rb") as f:
+            f.seek(offset)
+            line = f.read(length).decode("utf-8")
+        return (line.split(" ") if line else []), boxes, info
+
+    def highlights(self, filename, page_num, terms, analyzer):
+        """Return the boxes of a page's words that analyze to any of the given terms"""
+        page = self.page(filename, page_num)
+        if page is None:
+            return None
+        words, boxes, info = page
+        matches = []
+        for word, box in zip(words, boxes):
+            if any(token.text in terms for token in analyzer(word)):
+                matches.append({"word": word, "rect": [round(float(v), 2) for v in box]})
+        return {
+            "width": info["width"],
+            "height": info["height"],
+            "rotation": info["rotation"],
+            "matches": matches
+        }
+
+    def rename_document(self, old_filename, new_filename):
+        """Move a document's boxes to a new name"""
+        self._forget(old_filename)
+        self._forget(new_filename)
+        if os.path.exists(self._path(old_filename)):
+            shutil.rmtree(self._path(new_filename), ignore_errors=True)
+            os.replace(self._path(old_filename), self._path(new_filename))
+
+    def remove_document(self, filename):
+        self._forget(filename)
+        shutil.rmtree(self._path(filename), ignore_errors=True)
+
+    def reset(self):
+        """Drop every document's boxes"""
+        with self._lock:
+            self._tables.clear()
+        for name in os.listdir(self.layout_dir):
+            shutil.rmtree(os.path.join(self.layout_dir, name), ignore_errors=True)
@@ -0,0 +1,130 @@
+import math
+import threading
+import time
+
+
+class TieredMergePolicy:
+    """whoosh merge type that merges segments of similar size together.
+
+    Segments are grouped into tiers by the order of magnitude (in base
+    merge_factor) of their live document count, and any tier holding
+    merge_factor or more segments is merged into one. Segments whose share of
+    deleted documents exceeds max_deleted_ratio are rewritten to drop them.
+    If that still leaves more than max_segments, the smallest are merged too.
+    """
+
+    def __init__(self, merge_factor=10, max_segments=10, max_deleted_ratio=0.2):
+        self.merge_factor = max(2, merge_factor)
+        self.max_segments = max(1, max_segments)
+        self.max_deleted_ratio = max_deleted_ratio
+
+    def select(self, segments):
+        """Return the segments this policy would merge"""
+        tiers = {}
+        selected = []
+        for seg in segments:
+            total = seg.doc_count_all()
+            if total and seg.deleted_count() / total > self.max_deleted_ratio:
+                selected.append(seg)
+            else:
+                live = max(1, total - seg.deleted_count())
+                tiers.setdefault(int(math.log(live, self.merge_factor)), []).append(seg)
+
+        for tier in tiers.values():
+            if len(tier) >= self.merge_factor:
+                selected.extend(tier)
+
+        remaining = sorted((seg for seg in segments if seg not in selected), key=lambda s: s.doc_count_all())
+        excess = len(remaining) + (1 if selected else 0) - self.max_segments
+        if excess > 0:
+            selected.extend(remaining[:excess + (0 if selected else 1)])
+        return selected
+
+    def __call__(self, writer, segments):
+        from whoosh.reading import SegmentReader
+
+        selected = self.select(segments)
+        for seg in selected:
+            reader = SegmentReader(writer.storage, writer.schema, seg)
+            writer.add_reader(reader)
+            reader.close()
+        return [seg for seg in segments if seg not in selected]
+
+
+class MergeScheduler:
+    """Background thread that merges index segments while the index is quiet.
+
+    Every interval seconds it checks each shard's segment count and deleted
+    document ratio, and when either passes its threshold and there have been
+    no searches or writes for idle_seconds, it queues a tiered merge (or a
+    full optimize) on the search engine's writer thread.
+    """
+
+    def __init__(self, search_engine, interval=60, max_segments=10, max_deleted_ratio=0.2, idle_seconds=30,
+                 optimize=False):
+        self.search_engine = search_engine
+        self.interval = interval
+        self.max_segments = max_segments
+        self.max_deleted_ratio = max_deleted_ratio
+        self.idle_seconds = idle_seconds
+        self.optimize = optimize
+        self.last_check = None
+        self.last_reason = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="merge-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def merge_reason(self, layout=None):
+        """Why the index needs merging, or None if it does not"""
+        layout = layout if layout is not None else self.search_engine.segment_info()
+        for shard in layout:
+            if len(shard["segments"]) > self.max_segments:
+                return f"{shard['shard']} has {len(shard['segments'])} segments"
+            if shard["deleted_ratio"] > self.max_deleted_ratio:
+                return f"{shard['shard']} has {shard['deleted_ratio']:.0%} deleted documents"
+        return None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Merge scheduler error: {str(e)}")
+
+    def check(self):
+        """Queue a merge if one is due and the index is idle; returns whether it merged"""
+        self.last_check = time.time()
+        if self.search_engine.needs_reindex():
+            return False  # Nothing to merge until the index is rebuilt
+        self.last_reason = self.merge_reason()
+        if not self.last_reason:
+            return False
+        if time.time() - self.search_engine.last_activity < self.idle_seconds:
+            return False
+        print(f"Merging index segments: {self.last_reason}")
+        self.search_engine.merge(optimize=self.optimize).wait()
+        return True
+
+    def status(self):
+        """Thresholds and the outcome of the latest check"""
+        return {
+            "running": self._thread is not None,
+            "interval": self.interval,
+            "max_segments": self.max_segments,
+            "max_deleted_ratio": self.max_deleted_ratio,
+            "idle_seconds": self.idle_seconds,
+            "optimize": self.optimize,
+            "last_check": self.last_check,
+            "pending_reason": self.last_reason
+        }
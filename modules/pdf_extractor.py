@@ -7,19 +7,45 @@ class PDFExtractor:
     def __init__(self, pdf_dir):
         self.pdf_dir = pdf_dir
         
+    def iter_pages(self, pdf_path, skip_empty=False, words=False):
+        """Yield (page_num, text, metadata) for each page, loading one page at a time.
+
+        Only the current page is held in memory, so callers can index and store
+        long documents incrementally. With skip_empty, pages without text are
+        left out. With words, metadata["words"] holds the page's
+        (x0, y0, x1, y1, word) tuples in reading order.
+        """
+        document = fitz.open(pdf_path)
+        try:
+            total_pages = len(document)
+            for page_num in range(total_pages):
+                page = document.load_page(page_num)
+                text = page.get_text()
+                if skip_empty and not (text and text.strip()):
+                    continue
+                metadata = {
+                    "total_pages": total_pages,
+                    "width": page.rect.width,
+                    "height": page.rect.height,
+                    "rotation": page.rotation
+                }
+                if words:
+                    metadata["words"] = [word[:5] for word in page.get_text("words")]
+                yield page_num, text, metadata
+        finally:
+            document.close()
+
     def extract_text_from_pdf(self, pdf_path):
         """Extract text from a PDF file page by page."""
         try:
-            document = fitz.open(pdf_path)
             text_data = {
                 "filename": os.path.basename(pdf_path),
-                "total_pages": len(document),
+                "total_pages": 0,
                 "pages": {}
             }
             
-            for page_num in range(len(document)):
-                page = document.load_page(page_num)
-                text = page.get_text()
+            for page_num, text, metadata in self.iter_pages(pdf_path):
+                text_data["total_pages"] = metadata["total_pages"]
                 text_data["pages"][page_num] = text
                 
             return text_data
@@ -51,19 +77,9 @@ class PDFExtractor:
                 return None
             
             print(f"Processing PDF: {filename}")
-            pdf_document = fitz.open(file_path)
-            
-            # Extract pages
-            pages = {}
-            for page_num in range(len(pdf_document)):
-                page = pdf_document.load_page(page_num)
-                text = page.get_text()
-                
-                # Only add pages with actual content
-                if text and text.strip():
-                    pages[page_num] = text
             
-            pdf_document.close()
+            # Extract only pages with actual content
+            pages = {page_num: text for page_num, text, _ in self.iter_pages(file_path, skip_empty=True)}
             
             # Skip if no text extracted
             if not pages:
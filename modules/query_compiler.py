@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+from whoosh.qparser import MultifieldParser
+
+
+class QueryCompiler:
+    """Parses user queries with a parser built once, caching the parsed trees"""
+
+    def __init__(self, schema, fieldnames=("content", "filename"), field_boosts=None, cache_size=256):
+        self.parser = MultifieldParser(list(fieldnames), schema=schema, fieldboosts=field_boosts)
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(query_text):
+        """Collapse whitespace so trivially different spellings share a cache entry"""
+        return " ".join(query_text.split())
+
+    def compile(self, query_text):
+        """Return the parsed query tree for a query string"""
+        key = self.normalize(query_text)
+        with self._lock:
+            query = self._cache.get(key)
+            if query is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return query
+
+        query = self.parser.parse(key)
+
+        with self._lock:
+            self.misses += 1
+            if self.cache_size:
+                self._cache[key] = query
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return query
+
+    def explain(self, query_text):
+        """Describe how a query string is parsed, for debugging"""
+        key = self.normalize(query_text)
+        with self._lock:
+            cached = key in self._cache
+        query = self.compile(query_text)
+        return {
+            "query": query_text,
+            "normalized": key,
+            "parsed": str(query),
+            "tree": repr(query),
+            "cached": cached
+        }
+
+    def stats(self):
+        """Cache size and hit counts"""
+        with self._lock:
+            return {
+                "size": len(self._cache),
+                "capacity": self.cache_size,
+                "hits": self.hits,
+                "misses": self.misses
+            }
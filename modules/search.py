@@ -1,103 +1,933 @@
 import os
+import heapq
+import time
+import zlib
+import threading
+from math import log
+from itertools import chain, islice
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 import whoosh.index as index
-from whoosh.fields import Schema, TEXT, ID, STORED
-from whoosh.qparser import QueryParser, MultifieldParser
-from whoosh.analysis import StemmingAnalyzer
-from whoosh.highlight import ContextFragmenter, HtmlFormatter, Highlighter
+from whoosh import scoring
+from whoosh.collectors import TimeLimitCollector
+from whoosh.searching import Searcher, TimeLimit
+from whoosh.query import MultiTerm, Term, And, Or, Not, AndNot, NullQuery, ConstantScoreQuery
+from whoosh.fields import Schema, TEXT, ID, STORED, NUMERIC, KEYWORD
 import re
 
+from modules.query_compiler import QueryCompiler
+from modules.analysis import CachedStemmingAnalyzer
+from modules.highlight import load_match_spans, best_fragments, format_fragments, extract_context
+from modules.dedup import DuplicateDetector, signature, band_keys
+from modules.writer import IndexWriterThread
+from modules.maintenance import TieredMergePolicy
+
+# Index objects opened inside this process, keyed by shard directory. Worker
+# processes keep their shards open between tasks; whoosh re-reads the table of
+# contents on every searcher() call, so cached handles always see new commits.
+_open_indexes = {}
+
+# Query compilers for this process, keyed by field boosts and cache size. The
+# schema is identical across shards, so one compiler serves all of them.
+_compilers = {}
+
+# Per-shard map of filename -> set of doc numbers, tagged with the table of
+# contents version (see _toc_version) it was built from, so a commit or a
+# recreated index invalidates it.
+_file_docnum_maps = {}
+
+# Readers kept open between calls, per thread and shard. Opening one reads the
+# table of contents and every segment, so it is only reopened once a commit
+# (from this or any other process) has replaced the table of contents.
+_readers = threading.local()
+
+
+def _open_shard(shard_dir):
+    """Return the whoosh index for a shard directory, opening it once per process"""
+    ix = _open_indexes.get(shard_dir)
+    if ix is None:
+        ix = index.open_dir(shard_dir)
+        _open_indexes[shard_dir] = ix
+    return ix
+
+
+def _toc_version(ix):
+    """Identify an index's latest commit from its table of contents file, without reading it"""
+    generation = ix.latest_generation()
+    try:
+        stat = os.stat(os.path.join(ix.storage.folder, f"_{ix.indexname}_{generation}.toc"))
+    except FileNotFoundError:
+        return None  # Replaced by a newer commit while we looked
+    # Recreating an index restarts its generations, so the file itself is compared too
+    return generation, stat.st_ino, stat.st_mtime_ns
+
+
+def _shard_reader(shard_dir):
+    """Return this thread's reader for a shard, reopened if the shard has changed since it was opened.
+
+    The reader stays open for later calls, so callers must not close it.
+    """
+    cache = _readers.__dict__.setdefault("shards", {})
+    ix = _open_shard(shard_dir)
+    version = _toc_version(ix)
+    cached = cache.get(shard_dir)
+    if cached is not None and version is not None and cached[0] == version and cached[1] is ix:
+        return cached[2]
+    reader = ix.reader()
+    cache[shard_dir] = (version, ix, reader)
+    if cached is not None:
+        cached[2].close()
+    return reader
+
+
+def _shard_searcher(shard_dir, weighting=scoring.BM25F):
+    """A searcher over this thread's reader for a shard; closing it leaves the reader open"""
+    return Searcher(_shard_reader(shard_dir), weighting=weighting, closereader=False, fromindex=_open_shard(shard_dir))
+
+
+def _file_docnums(shard_dir, reader):
+    """Return the filename -> doc number set map for this thread's reader of a shard"""
+    # The generation alone is not enough: a recreated index starts its generations over
+    opened = _readers.__dict__.get("shards", {}).get(shard_dir)
+    version = opened[0] if opened is not None and opened[2] is reader else None
+    cached = _file_docnum_maps.get(shard_dir)
+    if version is not None and cached is not None and cached[0] == version:
+        return cached[1]
+    mapping = {}
+    # A shard with no segments has no columns to read
+    if reader.doc_count_all():
+        files = reader.column_reader("file")
+        for docnum in reader.all_doc_ids():
+            mapping.setdefault(files[docnum], set()).add(docnum)
+    if version is not None:
+        _file_docnum_maps[shard_dir] = (version, mapping)
+    return mapping
+
+
+class GlobalStatsBM25F(scoring.BM25F):
+    """BM25F that scores one shard with statistics gathered from every shard.
+
+    IDF and average field length are corpus-wide statistics, so scoring each
+    shard with its own numbers would rank hits differently from a single index.
+    """
+
+    def __init__(self, stats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    def idf(self, searcher, fieldname, text):
+        n = self.stats["doc_frequency"].get((fieldname, text), 0)
+        return log(self.stats["doc_count"] / (n + 1)) + 1
+
+    def scorer(self, searcher, fieldname, text, qf=1):
+        scorer = super().scorer(searcher, fieldname, text, qf=qf)
+        if isinstance(scorer, scoring.BM25FScorer):
+            total_length = self.stats["field_length"].get(fieldname, 0)
+            scorer.avgfl = total_length / (self.stats["doc_count"] or 1) or 1
+        return scorer
+
+
+def _limit_expansions(query, reader, max_terms):
+    """Cap how many index terms wildcard, prefix and fuzzy queries may expand to"""
+    if not max_terms:
+        return query
+
+    def cap(q):
+        if isinstance(q, MultiTerm) and q.field() in reader.schema:
+            # expanded_terms() yields lazily, so only max_terms + 1 terms are read
+            terms = list(islice(q.expanded_terms(reader), max_terms + 1))
+            if len(terms) > max_terms:
+                field = reader.schema[q.field()]
+                capped = Or([Term(fieldname, field.from_bytes(text)) for fieldname, text in terms[:max_terms]],
+                            boost=q.boost)
+                return ConstantScoreQuery(capped, score=q.boost) if q.constantscore else capped
+        return q
+
+    return query.accept(cap)
+
+
+def _compiler_for(schema, options):
+    """Return this process's query compiler for the given query options"""
+    boosts = options.get("field_boosts") or {}
+    key = (tuple(sorted(boosts.items())), options.get("cache_size", 256))
+    compiler = _compilers.get(key)
+    if compiler is None:
+        compiler = QueryCompiler(schema, field_boosts=boosts or None, cache_size=key[1])
+        _compilers[key] = compiler
+    return compiler
+
+
+def _parse_query(ix, reader, query_text, options):
+    """Parse a user query against the content and filename fields"""
+    query = _compiler_for(ix.schema, options).compile(query_text)
+    return _limit_expansions(query, reader, options.get("max_expansions"))
+
+
+def _shard_stats(shard_dir, query_text, options):
+    """Collect the term statistics a shard contributes to global scoring"""
+    ix = _open_shard(shard_dir)
+    reader = _shard_reader(shard_dir)
+    query = _parse_query(ix, reader, query_text, options)
+    terms = query.existing_terms(reader, expand=True)
+    return {
+        "doc_count": reader.doc_count_all(),
+        "field_length": {name: reader.field_length(name) for name in ("content", "filename")},
+        "doc_frequency": {term: reader.doc_frequency(*term) for term in terms}
+    }
+
+
+def _merge_stats(shard_stats):
+    """Sum per-shard statistics into corpus-wide totals"""
+    merged = {"doc_count": 0, "field_length": {}, "doc_frequency": {}}
+    for stats in shard_stats:
+        merged["doc_count"] += stats["doc_count"]
+        for key in ("field_length", "doc_frequency"):
+            for name, value in stats[key].items():
+                merged[key][name] = merged[key].get(name, 0) + value
+    return merged
+
+
+def _shard_facets(shard_dir, query_text, options, page_bucket=None):
+    """Count a shard's matching pages per file (and per page range) from columns.
+
+    Matching documents are read as plain doc numbers and their filename and
+    page number come from the sortable columns, so nothing is scored,
+    highlighted or loaded from stored fields.
+    """
+    ix = _open_shard(shard_dir)
+    files = Counter()
+    pages = Counter()
+    with _shard_searcher(shard_dir) as searcher:
+        reader = searcher.reader()
+        if not reader.doc_count_all():
+            return files, pages
+        query = _parse_query(ix, reader, query_text, options)
+        docnums = searcher.docs_for_query(query)
+
+        filenames = reader.column_reader("file")
+        if page_bucket:
+            page_nums = reader.column_reader("page_num")
+            for docnum in docnums:
+                files[filenames[docnum]] += 1
+                pages[page_nums[docnum] // page_bucket] += 1
+        else:
+            files.update(filenames[docnum] for docnum in docnums)
+    return files, pages
+
+
+def _search_shard(shard_dir, query_text, options, stats=None, limit=1000, timeout=None, filename=None):
+    """Search a single shard and return highlighted result dicts in score order.
+
+    Passing a filename restricts the search to that file's pages. Returns a
+    (results, partial) tuple; partial is True when the time budget ran out
+    and only the hits collected and highlighted so far were returned.
+    """
+    deadline = time.time() + timeout if timeout else None
+    ix = _open_shard(shard_dir)
+
+    weighting = GlobalStatsBM25F(stats) if stats else scoring.BM25F()
+
+    # Perform the search
+    with _shard_searcher(shard_dir, weighting=weighting) as searcher:
+        # Parse the query string
+        query = _parse_query(ix, searcher.reader(), query_text, options)
+
+        partial = False
+        # Restrict to one file's pages in the query itself: the time limit wrapper
+        # below would skip a filter given to the inner collector. A zero boost
+        # leaves the scores of the user's query unchanged
+        if filename is not None:
+            if not _file_docnums(shard_dir, searcher.reader()).get(filename):
+                return [], False
+            query = And([query, Term("file", filename, boost=0.0)])
+        # Get many results for processing; recording matched terms lets us
+        # load their character offsets for highlighting
+        collector = searcher.collector(limit=limit, terms=True)
+        if deadline:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return [], True
+            collector = TimeLimitCollector(collector, timelimit=remaining, use_alarm=False)
+        try:
+            searcher.search_with_collector(query, collector)
+        except TimeLimit:
+            partial = True
+        results = collector.results()
+
+        # Match offsets for every hit, read from the index
+        match_spans = load_match_spans(searcher, results, "content")
+
+        # Process results
+        search_results = []
+        for hit in results:
+            # Stop highlighting once the budget is spent
+            if deadline and time.time() > deadline:
+                partial = True
+                break
+
+            # Only add hits with content matches to highlight
+            spans = match_spans.get(hit.docnum)
+            if spans:
+                content = hit.get("content", "")
+                fragments = best_fragments(spans, len(content))
+
+                # Create result object; HTML is only produced here, from the
+                # fragments, and the context is sliced around their offsets
+                result = {
+                    "doc_id": hit.get("doc_id"),
+                    "duplicate_of": hit.get("duplicate_of"),
+                    "filename": hit.get("filename", "Unknown"),
+                    "page": hit.get("page_num", 0),
+                    "highlight": format_fragments(content, fragments),
+                    "content": content,
+                    "score": hit.score,
+                    "match_count": len(spans),
+                    "match_spans": [[start, end] for start, end, _ in spans]
+                }
+                result["context_before"], result["context_after"] = extract_context(content, fragments)
+
+                search_results.append(result)
+
+        return search_results, partial
+
+
+def _matching_pages(shard_dir, query_text, filename, options):
+    """Return the sorted page numbers of a file that match a query"""
+    ix = _open_shard(shard_dir)
+    with _shard_searcher(shard_dir) as searcher:
+        reader = searcher.reader()
+        file_docs = _file_docnums(shard_dir, reader).get(filename)
+        if not file_docs:
+            return []
+        query = _parse_query(ix, reader, query_text, options)
+        page_nums = reader.column_reader("page_num")
+        return sorted(page_nums[docnum] for docnum in file_docs.intersection(searcher.docs_for_query(query)))
+
+
+def _shard_highlight_terms(shard_dir, query_text, options):
+    """Return the indexed content terms a query matches, leaving out negated ones"""
+    ix = _open_shard(shard_dir)
+    reader = _shard_reader(shard_dir)
+    query = _parse_query(ix, reader, query_text, options)
+
+    def positive(q):
+        if isinstance(q, Not):
+            return NullQuery
+        if isinstance(q, AndNot):
+            return q.a
+        return q
+
+    field = ix.schema["content"]
+    terms = query.accept(positive).existing_terms(reader, expand=True)
+    return {field.from_bytes(text) if isinstance(text, bytes) else text
+            for fieldname, text in terms if fieldname == "content"}
+
+
+def _stored_pages(searcher, query):
+    """Stored fields of the pages matching a query, without their indexed content"""
+    pages = []
+    for docnum in searcher.docs_for_query(query):
+        fields = searcher.stored_fields(docnum)
+        fields.pop("content", None)
+        pages.append(fields)
+    return pages
+
+
+def _shard_file_pages(shard_dir, filename):
+    """Stored fields of every page of a file"""
+    with _shard_searcher(shard_dir) as searcher:
+        return _stored_pages(searcher, Term("file", filename))
+
+
+def _shard_file_documents(shard_dir, filename):
+    """Every stored field of a file's pages, including their text"""
+    with _shard_searcher(shard_dir) as searcher:
+        return [searcher.stored_fields(docnum) for docnum in searcher.docs_for_query(Term("file", filename))]
+
+
+def _shard_references(shard_dir, canonical_ids):
+    """Every stored field of the near-duplicate pages that refer to the given canonical pages"""
+    with _shard_searcher(shard_dir) as searcher:
+        query = Or([Term("duplicate_of", doc_id) for doc_id in canonical_ids])
+        return [searcher.stored_fields(docnum) for docnum in searcher.docs_for_query(query)]
+
+
+def _shard_lsh_candidates(shard_dir, keys):
+    """Return (doc_id, signature) for canonical pages sharing any LSH bucket key"""
+    with _shard_searcher(shard_dir) as searcher:
+        query = Or([Term("lsh", key) for key in keys])
+        return [(fields["doc_id"], fields["signature"])
+                for fields in map(searcher.stored_fields, searcher.docs_for_query(query))]
+
+
+def _warm_shard(shard_dir):
+    """Read through a shard's term dictionary and columns so they are paged in; returns the term count"""
+    with _shard_searcher(shard_dir) as searcher:
+        reader = searcher.reader()
+        if not reader.doc_count_all():
+            return 0
+        terms = sum(1 for _ in reader.all_terms())
+        for name in ("file", "page_num"):
+            for _ in reader.column_reader(name):
+                pass
+        _file_docnums(shard_dir, reader)
+        return terms
+
+
+def _shard_segments(shard_dir):
+    """Stored and deleted document counts of each of a shard's segments"""
+    return [{"name": seg.segment_id(), "docs": seg.doc_count_all(), "deleted": seg.deleted_count()}
+            for seg in _open_shard(shard_dir)._segments()]
+
+
+def _merge_shard(shard_dir, mergetype=None, optimize=False):
+    """Commit an empty writer so the merge policy (or a full optimize) runs on a shard"""
+    writer = _open_shard(shard_dir).writer()
+    if optimize:
+        writer.commit(optimize=True)
+    else:
+        writer.commit(mergetype=mergetype)
+
+
+def _write_shard(shard_dir, pages, delete_terms=()):
+    """Delete pages by (field, term) and add new ones to a single shard in one commit"""
+    writer = _open_shard(shard_dir).writer()
+
+    for fieldname, text in delete_terms:
+        writer.delete_by_term(fieldname, text)
+    for fields in pages:
+        writer.add_document(**fields)
+
+    writer.commit()
+
+
 class SearchEngine:
-    def __init__(self, index_dir):
+    def __init__(self, index_dir, shards=1, timeout=None, max_expansions=None, field_boosts=None, query_cache_size=256,
+                 stem_cache_size=100000, dedup_threshold=0.9, commit_interval=1.0, merge_policy=None, read_only=False):
         self.index_dir = index_dir
+        self.read_only = read_only  # Another process owns the index; this one only searches it
+        self.timeout = timeout  # Per-query time budget in seconds
+        self.max_expansions = max_expansions  # Terms a wildcard/fuzzy query may expand to
+        self.field_boosts = field_boosts  # Score multipliers for content and filename matches
+        self.query_cache_size = query_cache_size  # Parsed queries kept per process
+        self.dedup_threshold = dedup_threshold  # Similarity above which pages are marked near-duplicates; 0 disables
         self.schema = Schema(
             doc_id=ID(stored=True),
             filename=TEXT(stored=True),
-            page_num=STORED,
-            content=TEXT(analyzer=StemmingAnalyzer(), stored=True)
+            file=ID(sortable=True),  # Exact filename for filtering and deletes
+            page_num=NUMERIC(stored=True, sortable=True),
+            # Postings record each term's character offsets (chars=True), so
+            # highlighting reads match positions straight from the index
+            content=TEXT(analyzer=CachedStemmingAnalyzer(cachesize=stem_cache_size), stored=True, chars=True),
+            # Near-duplicate pages name their canonical page, so search results
+            # can collapse them under it; their own text is indexed as usual
+            duplicate_of=ID(stored=True),
+            # MinHash signature and LSH bucket keys of canonical pages
+            signature=STORED,
+            lsh=KEYWORD
         )
-        
-        # Create or open index
-        if not os.path.exists(index_dir):
-            os.makedirs(index_dir)
-            self.index = index.create_in(index_dir, self.schema)
+
+        # A single shard lives directly in index_dir so existing indexes keep
+        # working; with more shards each partition gets its own subdirectory
+        self.shard_count = max(1, int(shards))
+        if self.shard_count == 1:
+            self.shard_dirs = [index_dir]
         else:
+            self.shard_dirs = [os.path.join(index_dir, f"shard_{i:02d}") for i in range(self.shard_count)]
+        self._pool = None
+
+        # All writes go through one thread that batches queued operations into
+        # commits, so overlapping requests never contend for whoosh's write lock
+        self._write_lock = threading.Lock()
+        self.writer = IndexWriterThread(self._apply_operations, commit_interval=commit_interval)
+
+        # Segment merging run by the maintenance scheduler or on demand
+        self.merge_policy = merge_policy or TieredMergePolicy()
+        self.last_merge = None
+        self.last_activity = time.time()  # Latest search or write, so merges can wait for a quiet spell
+
+        # An index written with an older schema is left as it is: searches and
+        # writes refuse to run until a reindex recreates it (see reset)
+        outdated = self.outdated_shards()
+        self.reindex_required = bool(outdated)
+        for shard_dir in outdated:
+            print(f"Index in {shard_dir} uses an older schema; reindex required "
+                  f"(python cli.py reindex, or process all documents)")
+
+        # Create or open every shard; a read-only engine leaves that to the
+        # writer and opens shards when it first searches them
+        self.indexes = []
+        for shard_dir in ([] if read_only else self.shard_dirs):
+            if shard_dir in outdated:
+                continue
+            os.makedirs(shard_dir, exist_ok=True)
+            if index.exists_in(shard_dir):
+                ix = index.open_dir(shard_dir)
+            else:
+                ix = index.create_in(shard_dir, self.schema)
+            _open_indexes[shard_dir] = ix
+            self.indexes.append(ix)
+
+    def _query_options(self):
+        """Settings every process needs to parse queries the same way"""
+        return {
+            "max_expansions": self.max_expansions,
+            "field_boosts": self.field_boosts,
+            "cache_size": self.query_cache_size
+        }
+
+    @property
+    def query_compiler(self):
+        """The query compiler used for searches in this process"""
+        return _compiler_for(self.schema, self._query_options())
+
+    def outdated_shards(self):
+        """Shard directories holding an index that cannot be opened or was written with an older schema"""
+        outdated = []
+        for shard_dir in self.shard_dirs:
+            if not os.path.isdir(shard_dir) or not index.exists_in(shard_dir):
+                continue
             try:
-                self.index = index.open_dir(index_dir)
-            except:
-                self.index = index.create_in(index_dir, self.schema)
-    
-    def index_documents(self, documents):
-        """Index the extracted documents."""
-        writer = self.index.writer()
-        
+                current = self._is_current(index.open_dir(shard_dir))
+            except Exception as e:
+                print(f"Could not open the index in {shard_dir}: {str(e)}")
+                current = False
+            if not current:
+                outdated.append(shard_dir)
+        return outdated
+
+    def needs_reindex(self):
+        """Whether the index on disk must be rebuilt before it can be used.
+
+        Checked again while it is, so read-only engines notice once the
+        indexer process has rebuilt it.
+        """
+        if self.reindex_required:
+            self.reindex_required = bool(self.outdated_shards())
+        return self.reindex_required
+
+    def _check_current(self):
+        if self.needs_reindex():
+            raise RuntimeError("The index uses an older schema; reindex required")
+
+    def _is_current(self, ix):
+        """Check that an existing index has exactly this schema's fields and columns"""
+        if set(ix.schema.names()) != set(self.schema.names()):
+            return False
+        for name, field in self.schema.items():
+            if name not in ix.schema:
+                return False
+            existing = ix.schema[name]
+            if type(existing) is not type(field) or (existing.column_type is None) != (field.column_type is None):
+                return False
+            # Term vectors written by older versions are unused but harmless
+            if type(existing.format) is not type(field.format) or (field.vector and not existing.vector):
+                return False
+        return True
+
+    def _shard_number(self, filename):
+        """Map a filename onto a shard with a hash that is stable across processes"""
+        return zlib.crc32(filename.encode("utf-8")) % self.shard_count
+
+    def index_for(self, filename):
+        """Return the whoosh index holding the pages of a file"""
+        return _open_shard(self.shard_dirs[self._shard_number(filename)])
+
+    def _executor(self):
+        """Worker pool used to scatter work across shards, created on first use"""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=min(self.shard_count, os.cpu_count() or 1))
+        return self._pool
+
+    def _map_shards(self, fn, *args):
+        """Run fn(shard_dir, *args) on every shard, in parallel when there are several"""
+        self._check_current()
+        if self.shard_count == 1:
+            return [fn(self.shard_dirs[0], *args)]
+        n = self.shard_count
+        return list(self._executor().map(fn, self.shard_dirs, *[[arg] * n for arg in args]))
+
+    def _map_shard_of(self, filename, fn, *args):
+        """Run fn(shard_dir, *args) on the shard that holds a file"""
+        self._check_current()
+        return fn(self.shard_dirs[self._shard_number(filename)], *args)
+
+    def _shutdown_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def close(self):
+        """Commit queued writes, then stop the writer thread and shard worker processes"""
+        self.writer.stop()
+        self._shutdown_pool()
+
+    def flush(self, timeout=None):
+        """Wait until every write queued so far is committed and visible to searches"""
+        return self.writer.flush(timeout)
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError("This search engine is read-only; index writes belong to the indexer process")
+
+    def reset(self):
+        """Drop every document by recreating all shards with an empty index"""
+        self._check_writable()
+        self.flush()
+        with self._write_lock:
+            for shard_dir in self.shard_dirs:
+                os.makedirs(shard_dir, exist_ok=True)
+                ix = index.create_in(shard_dir, self.schema)
+                _open_indexes[shard_dir] = ix
+            self.indexes = [_open_indexes[shard_dir] for shard_dir in self.shard_dirs]
+            self.reindex_required = False
+            self._shutdown_pool()  # Workers still hold handles to the old indexes
+
+    def _write(self, writes):
+        """Apply {shard: (pages, delete_terms)} writes, committing shards concurrently"""
+        if not writes:
+            return
+        self._check_writable()
+        self._check_current()
+        with self._write_lock:
+            if len(writes) == 1:
+                shard, (pages, delete_terms) = next(iter(writes.items()))
+                _write_shard(self.shard_dirs[shard], pages, delete_terms)
+            else:
+                futures = [self._executor().submit(_write_shard, self.shard_dirs[shard], pages, delete_terms)
+                           for shard, (pages, delete_terms) in writes.items()]
+                for future in futures:
+                    future.result()
+
+    @staticmethod
+    def _make_canonical(fields, text, sig):
+        """Give page fields the content, signature and LSH keys of a canonical page"""
+        fields["content"] = text
+        if sig:
+            fields["signature"] = sig
+            fields["lsh"] = " ".join(band_keys(sig))
+
+    def _prepare_pages(self, documents, pending=None):
+        """Build index fields for every page, marking near-duplicates of canonical pages.
+
+        pending holds (doc_id, signature) pairs of canonical pages written but
+        not yet committed; pages canonical in this call are appended to it.
+        """
+        pending = [] if pending is None else pending
+        pages = []
         for doc in documents:
             filename = doc["filename"]
             for page_num, text in doc["pages"].items():
-                doc_id = f"{filename}:{page_num}"
-                writer.add_document(
-                    doc_id=doc_id,
-                    filename=filename,
-                    page_num=int(page_num),
-                    content=text
-                )
-        
-        writer.commit()
-        print(f"Indexed {len(documents)} documents with {sum(len(doc['pages']) for doc in documents)} pages")
+                fields = {
+                    "doc_id": f"{filename}:{page_num}",
+                    "filename": filename,
+                    "file": filename,
+                    "page_num": int(page_num)
+                }
+                pages.append((fields, text, signature(text) if self.dedup_threshold else None))
+
+        # Seed the detector with already indexed canonical pages that share an
+        # LSH bucket with anything in this batch
+        detector = DuplicateDetector(self.dedup_threshold)
+        keys = sorted({key for _, _, sig in pages if sig for key in band_keys(sig)})
+        if keys:
+            for candidates in self._map_shards(_shard_lsh_candidates, keys):
+                for doc_id, sig in candidates:
+                    detector.add(doc_id, sig)
+        for doc_id, sig in pending:
+            detector.add(doc_id, sig)
+
+        for fields, text, sig in pages:
+            canonical = detector.find(sig) if sig else None
+            if canonical and canonical != fields["doc_id"]:
+                # Indexed with its own text, which may have words the canonical page lacks
+                fields["duplicate_of"] = canonical
+                fields["content"] = text
+            else:
+                self._make_canonical(fields, text, sig)
+                if sig:
+                    detector.add(fields["doc_id"], sig)
+                    pending.append((fields["doc_id"], sig))
+        return [fields for fields, _, _ in pages]
+
+    def index_documents(self, documents):
+        """Queue the extracted documents for indexing.
+
+        Returns the queued operation; call its wait() (or flush()) to block
+        until the pages are committed and searchable.
+        """
+        return self.writer.submit("add", list(documents))
+
+    def update_documents(self, documents):
+        """Queue replacing every page of the given documents with their new text"""
+        return self.writer.submit("update", list(documents))
+
+    def remove_documents(self, filenames):
+        """Queue removing the pages of several files, committed together"""
+        return self.writer.submit("remove", list(filenames))
+
+    def rename_document(self, old_filename, new_filename):
+        """Queue moving a file's pages to a new filename, reusing their stored text"""
+        return self.writer.submit("rename", (old_filename, new_filename))
+
+    def merge(self, optimize=False):
+        """Queue merging each shard's segments with the merge policy, or into one segment when optimizing"""
+        return self.writer.submit("merge", {"optimize": optimize})
+
+    def optimize(self):
+        """Queue merging every shard into a single segment"""
+        return self.merge(optimize=True)
+
+    def _merge_shards(self, optimize=False):
+        """Merge segments shard by shard on the writer thread, recording how long it took"""
+        self._check_writable()
+        self._check_current()
+        started = time.time()
+        before = sum(len(_shard_segments(shard_dir)) for shard_dir in self.shard_dirs)
+        with self._write_lock:
+            for shard_dir in self.shard_dirs:
+                _merge_shard(shard_dir, self.merge_policy, optimize)
+        after = sum(len(_shard_segments(shard_dir)) for shard_dir in self.shard_dirs)
+        self.last_merge = {
+            "started": started,
+            "duration": round(time.time() - started, 3),
+            "optimize": optimize,
+            "segments_before": before,
+            "segments_after": after
+        }
+        print(f"Merged index segments from {before} to {after} in {self.last_merge['duration']}s")
+
+    def warm_up(self):
+        """Open every shard in this process and its workers and page in terms and columns"""
+        return sum(self._map_shards(_warm_shard))
+
+    def segment_info(self):
+        """Segment layout of every shard with its deleted document ratio"""
+        layout = []
+        for shard_dir in self.shard_dirs:
+            segments = _shard_segments(shard_dir)
+            docs = sum(seg["docs"] for seg in segments)
+            deleted = sum(seg["deleted"] for seg in segments)
+            layout.append({
+                "shard": os.path.basename(shard_dir) if self.shard_count > 1 else "index",
+                "segments": segments,
+                "docs": docs - deleted,
+                "deleted": deleted,
+                "deleted_ratio": round(deleted / docs, 4) if docs else 0.0
+            })
+        return layout
+
+    def _must_commit_before(self, kind, writes):
+        """Whether uncommitted writes have to be committed before applying an operation"""
+        has_pages = any(pages for pages, _ in writes.values())
+        has_deletes = any(delete_terms for _, delete_terms in writes.values())
+        if kind in ("rename", "merge"):
+            # Renaming copies the file's pages out of the committed index, and
+            # merging works on committed segments
+            return True
+        if kind == "remove":
+            # Shards apply deletes before adds, and finding pages to promote reads the index
+            return has_pages or bool(self.dedup_threshold and has_deletes)
+        # Near-duplicate lookups must not find pages that are about to be deleted
+        return bool(self.dedup_threshold and has_deletes)
+
+    def _apply_operations(self, operations):
+        """Write a batch of queued operations with as few commits as their order allows"""
+        writes = {}
+        pending = []  # Canonical pages added but not yet committed
+        added = removed = renamed = references = 0
+        self.last_activity = time.time()
+
+        def commit():
+            self._write(writes)
+            writes.clear()
+            pending.clear()
+
+        for op in operations:
+            if op.kind == "flush":
+                continue
+            if op.kind == "merge":
+                commit()
+                self._merge_shards(**op.payload)
+                continue
+            if op.kind == "update":
+                steps = [("remove", [doc["filename"] for doc in op.payload]), ("add", op.payload)]
+            else:
+                steps = [(op.kind, op.payload)]
+
+            for kind, payload in steps:
+                if writes and self._must_commit_before(kind, writes):
+                    commit()
+                if kind == "add":
+                    shard_writes = {}
+                    for fields in self._prepare_pages(payload, pending):
+                        shard_writes.setdefault(self._shard_number(fields["file"]), ([], []))[0].append(fields)
+                        added += 1
+                        references += "duplicate_of" in fields
+                elif kind == "rename":
+                    shard_writes = self._rename_writes(*payload)
+                    renamed += 1
+                else:
+                    shard_writes = self._removal_writes(payload)
+                    removed += len(payload)
+                for shard, (pages, delete_terms) in shard_writes.items():
+                    batch_pages, batch_deletes = writes.setdefault(shard, ([], []))
+                    batch_pages.extend(pages)
+                    batch_deletes.extend(delete_terms)
+
+        commit()
+        if added:
+            print(f"Indexed {added} pages ({references} near-duplicates)")
+        if removed:
+            print(f"Removed documents for {removed} file(s) from search index")
+        if renamed:
+            print(f"Renamed {renamed} file(s) in search index")
+
+    def _references(self, canonical_ids):
+        """Map canonical doc_ids to the stored fields of the pages that duplicate them"""
+        references = {}
+        if not canonical_ids:
+            return references
+        for pages in self._map_shards(_shard_references, sorted(canonical_ids)):
+            for fields in pages:
+                references.setdefault(fields["duplicate_of"], []).append(fields)
+        for pages in references.values():
+            pages.sort(key=lambda fields: (fields["filename"], fields["page_num"]))
+        return references
+
+    @staticmethod
+    def _collapse_duplicates(results):
+        """List matching near-duplicate pages under their canonical page when it matched too"""
+        canonical = {r["doc_id"]: r for r in results if not r.get("duplicate_of")}
+        collapsed = []
+        for result in results:
+            head = canonical.get(result.get("duplicate_of"))
+            if head is None:
+                collapsed.append(result)
+            else:
+                head.setdefault("duplicates", []).append({"filename": result["filename"], "page": result["page"]})
+        return collapsed
+
+    def _run_search(self, query_text, options, limit, timeout, filename=None):
+        """Search one file's shard, or scatter the search over every shard and merge by score"""
+        self._check_current()
+        started = time.time()
+        if self.shard_count == 1 or filename is not None:
+            # A single file always lives in one shard
+            shard_dir = self.shard_dirs[self._shard_number(filename) if filename is not None else 0]
+            return _search_shard(shard_dir, query_text, options, limit=limit, timeout=timeout, filename=filename)
+
+        # Scatter: gather corpus-wide statistics, then search every
+        # shard in parallel with them so scores match a single index
+        pool = self._executor()
+        stats = _merge_stats(pool.map(_shard_stats, self.shard_dirs, [query_text] * self.shard_count,
+                                      [options] * self.shard_count))
+        remaining = timeout - (time.time() - started) if timeout else None
+        futures = [pool.submit(_search_shard, shard_dir, query_text, options, stats, limit, remaining)
+                   for shard_dir in self.shard_dirs]
+        shard_results = [f.result() for f in futures]
+
+        # Gather: merge the per-shard top hits by score
+        results = heapq.nlargest(limit, chain.from_iterable(r for r, _ in shard_results), key=lambda r: r["score"])
+        return results, any(p for _, p in shard_results)
     
-    def search(self, query_text, page=1, page_size=10, group_by_file=True):
-        """Perform a search against the index"""
+    def search(self, query_text, page=1, page_size=10, group_by_file=True, filename=None, collapse_duplicates=False):
+        """Perform a search against the index, optionally within a single file.
+
+        Near-duplicate pages that match are returned like any other page, or
+        listed under their canonical page as "duplicates" when
+        collapse_duplicates is set and that page matches too.
+        """
         if not query_text or not query_text.strip():
-            return {"results": [], "total": 0, "file_count": 0, "page": page, "pages": 0, "grouped": group_by_file}
+            return {"results": [], "total": 0, "file_count": 0, "page": page, "pages": 0, "grouped": group_by_file,
+                    "partial": False}
             
+        self.last_activity = time.time()
         try:
-            # Create a query parser for the content field
-            parser = MultifieldParser(["content", "filename"], schema=self.index.schema)
-            
-            # Parse the query string
-            query = parser.parse(query_text)
-            
-            # Set up highlighter with custom HTML formatting
-            formatter = HtmlFormatter(tagname="em", classname="", termclass="")
-            fragmenter = ContextFragmenter(maxchars=100, surround=50)
-            highlighter = Highlighter(formatter=formatter, fragmenter=fragmenter)
-            
-            # Perform the search
-            with self.index.searcher() as searcher:
-                results = searcher.search(query, limit=1000)  # Get many results for processing
-                
-                # Process results
-                search_results = []
-                for hit in results:
-                    # Get content and highlight matches
-                    content = hit.get("content", "")
-                    highlighted = highlighter.highlight_hit(hit, "content")
-                    
-                    # Only add if we have a highlighted result
-                    if highlighted:
-                        # Create result object
-                        result = {
-                            "filename": hit.get("filename", "Unknown"),
-                            "page": hit.get("page_num", 0),
-                            "highlight": highlighted,
-                            "content": content
-                        }
-                        
-                        # Extract context around the highlight
-                        result["context_before"], result["context_after"] = self._extract_context(content, highlighted)
-                        
-                        search_results.append(result)
-                
-                # Return formatted results
-                if not search_results:
-                    return {"results": [], "total": 0, "file_count": 0, "page": page, "pages": 0, "grouped": group_by_file}
+            limit = 1000  # Get many results for processing
+            options = self._query_options()
+            search_results, partial = self._run_search(query_text, options, limit, self.timeout, filename=filename)
+            if collapse_duplicates:
+                search_results = self._collapse_duplicates(search_results)
+
+            if partial:
+                print(f"Search for '{query_text}' exceeded its {self.timeout}s budget; returning partial results")
                 
-                return self.format_search_results(search_results, page, page_size, group_by_file)
+            # Return formatted results
+            if not search_results:
+                formatted = {"results": [], "total": 0, "file_count": 0, "page": page, "pages": 0, "grouped": group_by_file}
+            else:
+                formatted = self.format_search_results(search_results, page, page_size, group_by_file)
+            formatted["partial"] = partial
+            return formatted
         
         except Exception as e:
             print(f"Search error: {str(e)}")
             import traceback
             traceback.print_exc()
-            return {"results": [], "total": 0, "file_count": 0, "page": page, "pages": 0, "grouped": group_by_file}
+            return {"results": [], "total": 0, "file_count": 0, "page": page, "pages": 0, "grouped": group_by_file,
+                    "partial": False}
+
+    def _gather_facets(self, query_text, page_bucket=None):
+        """Sum per-file and per-page-range counts over every shard"""
+        files, pages = Counter(), Counter()
+        for shard_files, shard_pages in self._map_shards(_shard_facets, query_text, self._query_options(),
+                                                         page_bucket):
+            files.update(shard_files)
+            pages.update(shard_pages)
+        return files, pages
+
+    def count(self, query_text):
+        """Count matching pages and files without scoring or highlighting them"""
+        if not query_text or not query_text.strip():
+            return {"total": 0, "file_count": 0}
+
+        try:
+            files, _ = self._gather_facets(query_text)
+            return {"total": sum(files.values()), "file_count": len(files)}
+        except Exception as e:
+            print(f"Count error: {str(e)}")
+            return {"total": 0, "file_count": 0}
+
+    def facets(self, query_text, page_bucket=10):
+        """Return per-file hit counts and a histogram of matches by page range"""
+        empty = {"total": 0, "file_count": 0, "files": {}, "page_ranges": []}
+        if not query_text or not query_text.strip():
+            return empty
+
+        try:
+            files, pages = self._gather_facets(query_text, page_bucket)
+        except Exception as e:
+            print(f"Facet error: {str(e)}")
+            return empty
+
+        # Page ranges are reported 1-based, matching the page numbers users see
+        page_ranges = [{"start": bucket * page_bucket + 1, "end": (bucket + 1) * page_bucket, "count": count}
+                       for bucket, count in sorted(pages.items())]
+        return {
+            "total": sum(files.values()),
+            "file_count": len(files),
+            "files": dict(files.most_common()),
+            "page_ranges": page_ranges
+        }
+
+    def matching_pages(self, filename, query_text):
+        """Return the sorted page numbers of a file that match a query"""
+        if not query_text or not query_text.strip():
+            return []
+        return self._map_shard_of(filename, _matching_pages, query_text, filename, self._query_options())
+
+    def highlight_terms(self, query_text):
+        """Return the analyzed content terms a query matches anywhere in the index"""
+        if not query_text or not query_text.strip():
+            return set()
+        return set().union(*self._map_shards(_shard_highlight_terms, query_text, self._query_options()))
+
+    def explain(self, query_text):
+        """Show how a query is normalized and parsed, plus query cache statistics"""
+        explanation = self.query_compiler.explain(query_text)
+        explanation["cache"] = self.query_compiler.stats()
+        return explanation
 
     def format_search_results(self, results, page, page_size, grouped=True):
         """Format search results with proper highlighting and context"""
@@ -143,38 +973,75 @@ class SearchEngine:
             "grouped": grouped
         }
 
-    def _extract_context(self, content, highlight):
-        """Extract text before and after the highlighted section"""
-        # Remove HTML tags from highlight to find in content
-        clean_highlight = re.sub(r'<[^>]+>', '', highlight)
-        
-        try:
-            pos = content.find(clean_highlight)
-            if pos >= 0:
-                # Get context before (up to 150 chars)
-                context_before = content[max(0, pos-150):pos].strip()
-                if context_before and len(context_before) > 0 and pos > 150:
-                    context_before = "..." + context_before
-                
-                # Get context after (up to 150 chars)
-                highlight_end = pos + len(clean_highlight)
-                context_after = content[highlight_end:min(len(content), highlight_end+150)].strip()
-                if context_after and len(context_after) > 0 and highlight_end + 150 < len(content):
-                    context_after = context_after + "..."
-                
-                return context_before, context_after
-        except Exception as e:
-            print(f"Context extraction error: {e}")
-            pass
-        
-        return "", ""
-
     def remove_document(self, filename):
-        """Remove all documents related to a specific file from the index"""
-        writer = self.index.writer()
-        writer.delete_by_term('filename', filename)
-        writer.commit()
-        print(f"Removed documents for {filename} from search index")
+        """Queue removing all documents related to a specific file from the index"""
+        return self.remove_documents([filename])
+
+    def _rename_writes(self, old_filename, new_filename):
+        """Re-key a file's pages under a new filename and re-point near-duplicates at them.
+
+        whoosh updates documents by deleting and re-adding them, so the pages
+        are re-added from their stored fields; nothing is extracted again.
+        """
+        pages = self._map_shard_of(old_filename, _shard_file_documents, old_filename)
+        if not pages:
+            return {}
+
+        new_ids = {fields["doc_id"]: f"{new_filename}:{fields['page_num']}" for fields in pages}
+        writes = {self._shard_number(old_filename): ([], [("file", old_filename)])}
+        new_pages = writes.setdefault(self._shard_number(new_filename), ([], []))[0]
+        for fields in pages:
+            fields.update(doc_id=new_ids[fields["doc_id"]], filename=new_filename, file=new_filename)
+            if fields.get("duplicate_of") in new_ids:
+                fields["duplicate_of"] = new_ids[fields["duplicate_of"]]
+            if fields.get("signature"):
+                fields["lsh"] = " ".join(band_keys(fields["signature"]))
+            new_pages.append(fields)
+
+        # Pages in other files that duplicate this one refer to it by doc_id
+        if self.dedup_threshold:
+            for members in self._references(new_ids).values():
+                for member in members:
+                    if member["filename"] == old_filename:
+                        continue
+                    pages, delete_terms = writes.setdefault(self._shard_number(member["filename"]), ([], []))
+                    delete_terms.append(("doc_id", member["doc_id"]))
+                    pages.append(dict(member, file=member["filename"], duplicate_of=new_ids[member["duplicate_of"]]))
+        return writes
+
+    def _removal_writes(self, filenames):
+        """Deletes for every page of the files, plus promotions for their near-duplicates elsewhere"""
+        writes = {}
+        canonical_ids = []
+        for filename in filenames:
+            writes.setdefault(self._shard_number(filename), ([], []))[1].append(("file", filename))
+            if self.dedup_threshold:
+                canonical_ids.extend(fields["doc_id"]
+                                     for fields in self._map_shard_of(filename, _shard_file_pages, filename)
+                                     if not fields.get("duplicate_of"))
+        if not canonical_ids:
+            return writes
+
+        def rewrite(fields):
+            pages, delete_terms = writes.setdefault(self._shard_number(fields["file"]), ([], []))
+            delete_terms.append(("doc_id", fields["doc_id"]))
+            pages.append(fields)
+
+        removed = set(filenames)
+        for members in self._references(canonical_ids).values():
+            members = [member for member in members if member["filename"] not in removed]
+            if not members:
+                continue
+            # The first remaining duplicate becomes canonical for the others
+            head = members[0]
+            fields = {"doc_id": head["doc_id"], "filename": head["filename"], "file": head["filename"],
+                      "page_num": head["page_num"]}
+            self._make_canonical(fields, head["content"], signature(head["content"]))
+            rewrite(fields)
+
+            for member in members[1:]:
+                rewrite(dict(member, file=member["filename"], duplicate_of=head["doc_id"]))
+        return writes
 
     def _matches_pattern(self, filename, pattern):
         """Check if a filename matches a pattern with wildcards"""
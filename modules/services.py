@@ -0,0 +1,63 @@
+import os
+import shutil
+
+from config import (PDF_DIR, DATA_DIR, INDEX_DIR, INDEX_SHARDS, SEARCH_TIMEOUT, MAX_TERM_EXPANSIONS, FIELD_BOOSTS,
+                    QUERY_CACHE_SIZE, STEM_CACHE_SIZE, DEDUP_THRESHOLD, INDEX_COMMIT_INTERVAL, SIMILARITY_DIR,
+                    SIMILARITY_SVD_COMPONENTS, MERGE_MAX_SEGMENTS, MERGE_DELETED_RATIO, MERGE_FACTOR,
+                    INGEST_BATCH_PAGES, INGEST_MAX_QUEUED_BATCHES, EXTRACT_WORKERS, EXTRACT_TIMEOUT,
+                    EXTRACT_MEMORY_MB, EXTRACT_MAX_DOCUMENTS, QUARANTINE_FILE, LAYOUT_WORDS, LAYOUT_DIR, EXTRACT_CACHE_DIR, CATALOG_DB)
+from modules.extraction import ExtractionPool, Quarantine
+from modules.extraction_cache import ExtractionCache
+from modules.storage import DataStorage
+from modules.search import SearchEngine
+from modules.similarity import SimilarityIndex
+from modules.layout import LayoutStore
+from modules.catalog import DocumentCatalog
+from modules.maintenance import TieredMergePolicy
+from modules.ingest import Ingestor
+
+
+class Services:
+    """The extraction, storage and index objects shared by the web app and the CLI, set up from config.py"""
+
+    def __init__(self, extract_workers=EXTRACT_WORKERS, read_only=False):
+        self.pdf_dir = PDF_DIR
+        self.read_only = read_only  # Web workers that leave writes to the indexer process
+        self.extraction_pool = ExtractionPool(workers=extract_workers, timeout=EXTRACT_TIMEOUT,
+                                              memory_limit_mb=EXTRACT_MEMORY_MB, max_documents=EXTRACT_MAX_DOCUMENTS,
+                                              batch_size=INGEST_BATCH_PAGES, words=LAYOUT_WORDS)
+        self.quarantine = Quarantine(QUARANTINE_FILE)
+        self.extraction_cache = ExtractionCache(EXTRACT_CACHE_DIR)
+        self.data_storage = DataStorage(DATA_DIR)
+        self.layout_store = LayoutStore(LAYOUT_DIR)
+        self.document_catalog = DocumentCatalog(CATALOG_DB)
+        self.search_engine = SearchEngine(INDEX_DIR, shards=INDEX_SHARDS, timeout=SEARCH_TIMEOUT,
+                                          max_expansions=MAX_TERM_EXPANSIONS, field_boosts=FIELD_BOOSTS,
+                                          query_cache_size=QUERY_CACHE_SIZE, stem_cache_size=STEM_CACHE_SIZE,
+                                          dedup_threshold=DEDUP_THRESHOLD, commit_interval=INDEX_COMMIT_INTERVAL,
+                                          merge_policy=TieredMergePolicy(MERGE_FACTOR, MERGE_MAX_SEGMENTS,
+                                                                         MERGE_DELETED_RATIO),
+                                          read_only=read_only)
+        self.similarity_index = SimilarityIndex(SIMILARITY_DIR, svd_components=SIMILARITY_SVD_COMPONENTS,
+                                                stem_cache_size=STEM_CACHE_SIZE)
+        self.ingestor = Ingestor(self.extraction_pool, self.extraction_cache, self.data_storage, self.layout_store,
+                                 self.search_engine, self.similarity_index, self.quarantine, self.document_catalog,
+                                 batch_pages=INGEST_BATCH_PAGES, words=LAYOUT_WORDS,
+                                 max_queued_batches=INGEST_MAX_QUEUED_BATCHES)
+
+    def reset_index(self):
+        """Empty the search, similarity and layout stores before re-ingesting everything"""
+        if self.read_only:
+            raise RuntimeError("Only the indexer process may reset the index")
+        # Clear the index once queued writes are done with it, then recreate every shard
+        self.search_engine.flush()
+        shutil.rmtree(INDEX_DIR, ignore_errors=True)
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        self.search_engine.reset()
+        self.similarity_index.reset()
+        self.layout_store.reset()
+
+    def close(self):
+        """Commit queued index writes and stop the worker processes"""
+        self.search_engine.close()
+        self.extraction_pool.close()
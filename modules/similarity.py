@@ -0,0 +1,404 @@
+import os
+import json
+import threading
+import numpy as np
+
+from modules.analysis import CachedStemmingAnalyzer
+from modules.maintenance import TieredMergePolicy
+
+# Segments of similar size merged together, and the most segments kept before the smallest are merged
+MERGE_FACTOR = 8
+MAX_SEGMENTS = 64
+
+# Attempts at loading the segments while another process replaces them
+LOAD_ATTEMPTS = 3
+
+
+class _SegmentSizes:
+    """A similarity segment seen through the size methods TieredMergePolicy reads from whoosh segments"""
+
+    def __init__(self, segment):
+        self.segment = segment
+
+    def doc_count_all(self):
+        return self.segment["rows"]
+
+    def deleted_count(self):
+        return self.segment["deleted"]
+
+
+def _save_array(path, array):
+    """Write an array as a .npy file that can later be memory-mapped"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+class SimilarityIndex:
+    """Sparse TF-IDF page vectors for "more like this" lookups.
+
+    Term counts are appended at ingest as CSR segments (indptr, indices and
+    counts arrays saved as .npy files) and opened with memory mapping; new
+    terms are appended to vocabulary.txt, one per line in column order. Each
+    segment's filename and page number per row, and its deleted rows, are .npy
+    files next to it, so manifest.json only lists segments and a delete or
+    rename rewrites just the affected segments' files. TF-IDF weights are
+    applied when the matrix is loaded, so adding pages never rewrites existing
+    segments; segments of similar size are merged like the search index's.
+    With svd_components set, pages are compared in a truncated-SVD space
+    instead of on raw terms.
+    """
+
+    def __init__(self, directory, svd_components=0, stem_cache_size=100000, merge_policy=None):
+        self.directory = directory
+        self.svd_components = svd_components
+        self.merge_policy = merge_policy or TieredMergePolicy(merge_factor=MERGE_FACTOR, max_segments=MAX_SEGMENTS)
+        # Same tokens as the search index, so terms line up with what users search for
+        self.analyzer = CachedStemmingAnalyzer(cachesize=stem_cache_size)
+        self._lock = threading.RLock()
+        self._cache = None  # (generation, matrix, rows) built from the current manifest
+        self._manifest_version = None  # Identifies the manifest file the manifest was read from
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = self._load_manifest()
+        self.vocabulary = self._load_vocabulary()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _manifest_stat(self):
+        """Identify the manifest file without reading it; every save replaces it with a new file"""
+        try:
+            stat = os.stat(self._path("manifest.json"))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load_manifest(self):
+        """Read the manifest, or start an empty one"""
+        self._manifest_version = self._manifest_stat()
+        try:
+            with open(self._path("manifest.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {"generation": 0, "next_segment": 0, "terms": 0, "segments": []}
+
+    def _load_vocabulary(self):
+        """Map terms to columns, ignoring lines written after the last manifest save"""
+        vocabulary = {}
+        try:
+            with open(self._path("vocabulary.txt"), "r", encoding="utf-8") as f:
+                for column, line in enumerate(f):
+                    if column >= self.manifest["terms"]:
+                        break
+                    vocabulary[line.rstrip("\n")] = column
+        except FileNotFoundError:
+            pass
+        return vocabulary
+
+    def _save_manifest(self):
+        """Atomically replace the manifest, bumping its generation"""
+        self.manifest["generation"] += 1
+        tmp_path = self._path("manifest.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            # dumps() encodes in C; dump() streams through the pure-Python encoder
+            f.write(json.dumps(self.manifest))
+        os.replace(tmp_path, self._path("manifest.json"))
+        self._manifest_version = self._manifest_stat()
+
+    def _refresh(self):
+        """Pick up changes another process made to the manifest, reading it only once it was replaced"""
+        if self._manifest_stat() == self._manifest_version:
+            return
+        manifest = self._load_manifest()
+        if manifest["generation"] != self.manifest["generation"]:
+            self.manifest = manifest
+            self.vocabulary = self._load_vocabulary()
+
+    def _sidecar(self, segment_name, kind):
+        """Name a new version of a segment's row file, unique to the manifest generation about to be saved"""
+        return f"{segment_name}.{kind}.{self.manifest['generation'] + 1}.npy"
+
+    def _segment_arrays(self, segment):
+        """Memory-map a segment's CSR arrays"""
+        name = segment["name"]
+        return [np.load(self._path(f"{name}.{part}.npy"), mmap_mode="r") for part in ("indptr", "indices", "counts")]
+
+    def _segment_rows(self, segment):
+        """Memory-map a segment's filename and page number per row, and read its deleted row numbers"""
+        files = np.load(self._path(segment["files"]), mmap_mode="r")
+        pages = np.load(self._path(f"{segment['name']}.pages.npy"), mmap_mode="r")
+        if segment["deletions"]:
+            deleted = np.load(self._path(segment["deletions"]))
+        else:
+            deleted = np.zeros(0, dtype=np.int64)
+        return files, pages, deleted
+
+    def _write_segment(self, files, pages, indptr, indices, counts):
+        """Save a segment's arrays and return its manifest entry"""
+        name = f"seg_{self.manifest['next_segment']:06d}"
+        self.manifest["next_segment"] += 1
+        _save_array(self._path(f"{name}.indptr.npy"), np.asarray(indptr, dtype=np.int64))
+        _save_array(self._path(f"{name}.indices.npy"), np.asarray(indices, dtype=np.int32))
+        _save_array(self._path(f"{name}.counts.npy"), np.asarray(counts, dtype=np.float32))
+        _save_array(self._path(f"{name}.pages.npy"), np.asarray(pages, dtype=np.int32))
+        files_name = self._sidecar(name, "files")
+        _save_array(self._path(files_name), np.asarray(files, dtype=str))
+        return {"name": name, "rows": len(pages), "files": files_name, "deleted": 0, "deletions": None}
+
+    def _remove_files(self, names):
+        for name in names:
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+    def _remove_segment_files(self, segment):
+        name = segment["name"]
+        self._remove_files([f"{name}.{part}.npy" for part in ("indptr", "indices", "counts", "pages")] +
+                           [segment["files"]] + ([segment["deletions"]] if segment["deletions"] else []))
+
+    def add_documents(self, documents):
+        """Append term counts for every page of the given documents"""
+        with self._lock:
+            self._refresh()
+            vocabulary = self.vocabulary
+            new_terms = []
+            files, pages, indptr, indices, counts = [], [], [0], [], []
+            for doc in documents:
+                for page_num, text in doc["pages"].items():
+                    terms = {}
+                    for token in self.analyzer(text):
+                        column = vocabulary.get(token.text)
+                        if column is None:
+                            column = vocabulary[token.text] = len(vocabulary)
+                            new_terms.append(token.text)
+                        terms[column] = terms.get(column, 0) + 1
+                    for column in sorted(terms):
+                        indices.append(column)
+                        counts.append(terms[column])
+                    indptr.append(len(indices))
+                    files.append(doc["filename"])
+                    pages.append(int(page_num))
+            if not pages:
+                return
+
+            with open(self._path("vocabulary.txt"), "r+" if self.manifest["terms"] else "w", encoding="utf-8") as f:
+                # Drop any terms left behind by an interrupted write before appending
+                for _ in range(self.manifest["terms"]):
+                    f.readline()
+                f.truncate(f.tell())
+                f.writelines(term + "\n" for term in new_terms)
+            self.manifest["terms"] = len(vocabulary)
+
+            self.manifest["segments"].append(self._write_segment(files, pages, indptr, indices, counts))
+            merged = self._merge_segments()
+            self._save_manifest()
+            # Only now that the manifest no longer lists them; readers that loaded the old one retry
+            for segment in merged:
+                self._remove_segment_files(segment)
+
+    def remove_document(self, filename):
+        """Mark every page of a file as deleted"""
+        with self._lock:
+            self._refresh()
+            replaced = []
+            for segment in self.manifest["segments"]:
+                files, _, deleted = self._segment_rows(segment)
+                rows = np.setdiff1d(np.flatnonzero(files == filename), deleted)
+                if len(rows):
+                    deleted = np.union1d(deleted, rows).astype(np.int64)
+                    deletions = self._sidecar(segment["name"], "deleted")
+                    _save_array(self._path(deletions), deleted)
+                    replaced.append(segment["deletions"])
+                    segment.update(deleted=len(deleted), deletions=deletions)
+            if replaced:
+                self._save_manifest()
+                self._remove_files([name for name in replaced if name])
+
+    def rename_document(self, old_filename, new_filename):
+        """Record a file's pages under a new filename"""
+        with self._lock:
+            self._refresh()
+            replaced = []
+            for segment in self.manifest["segments"]:
+                files = self._segment_rows(segment)[0]
+                matches = files == old_filename
+                if matches.any():
+                    renamed = self._sidecar(segment["name"], "files")
+                    _save_array(self._path(renamed), np.where(matches, new_filename, files))
+                    replaced.append(segment["files"])
+                    segment["files"] = renamed
+            if replaced:
+                self._save_manifest()
+                self._remove_files(replaced)
+
+    def reset(self):
+        """Drop every page vector"""
+        with self._lock:
+            old_segments = self.manifest["segments"]
+            generation = self.manifest["generation"]
+            # Segment names keep counting up, so a reader of the old manifest never opens a new segment's files
+            self.manifest = {"generation": generation, "next_segment": self.manifest["next_segment"], "terms": 0,
+                             "segments": []}
+            self.vocabulary = {}
+            self._save_manifest()
+            self._cache = None
+            for segment in old_segments:
+                self._remove_segment_files(segment)
+
+    def _merge_segments(self):
+        """Merge the segments the merge policy picks into one, dropping deleted pages.
+
+        The merged segment takes the place of the first one it replaces.
+        Returns the replaced segments, whose files the caller removes once the
+        manifest is saved.
+        """
+        segments = self.manifest["segments"]
+        selected = [sizes.segment for sizes in self.merge_policy.select([_SegmentSizes(s) for s in segments])]
+        if len(selected) < 2 and not any(segment["deleted"] for segment in selected):
+            return []
+
+        files, pages, lengths, indices, counts = [], [], [], [], []
+        for segment in selected:
+            seg_indptr, seg_indices, seg_counts = self._segment_arrays(segment)
+            seg_files, seg_pages, deleted = self._segment_rows(segment)
+            live = np.ones(segment["rows"], dtype=bool)
+            live[deleted] = False
+            row_lengths = np.diff(seg_indptr)
+            # Keep the entries of live rows, found by repeating each row's flag over its entries
+            keep = np.repeat(live, row_lengths)
+            indices.append(seg_indices[keep])
+            counts.append(seg_counts[keep])
+            lengths.append(row_lengths[live])
+            files.append(seg_files[live])
+            pages.append(seg_pages[live])
+
+        position = segments.index(selected[0])
+        remaining = [segment for segment in segments if segment not in selected]
+        pages = np.concatenate(pages)
+        if len(pages):
+            indptr = np.concatenate([[0], np.cumsum(np.concatenate(lengths))])
+            merged = self._write_segment(np.concatenate(files), pages, indptr, np.concatenate(indices),
+                                         np.concatenate(counts))
+            remaining.insert(position, merged)
+        self.manifest["segments"] = remaining
+        return selected
+
+    def _load_blocks(self):
+        """Read the live rows of every segment in the manifest as CSR blocks, with their filenames and pages"""
+        from scipy import sparse
+
+        n_terms = self.manifest["terms"]
+        blocks, files, pages = [], [], []
+        for segment in self.manifest["segments"]:
+            indptr, indices, counts = self._segment_arrays(segment)
+            seg_files, seg_pages, deleted = self._segment_rows(segment)
+            block = sparse.csr_matrix((counts, indices, indptr), shape=(segment["rows"], n_terms))
+            live = np.setdiff1d(np.arange(segment["rows"]), deleted)
+            blocks.append(block[live])
+            files.append(seg_files[live])
+            pages.append(seg_pages[live])
+        if not blocks:
+            return blocks, (np.zeros(0, dtype=str), np.zeros(0, dtype=np.int32))
+        return blocks, (np.concatenate(files), np.concatenate(pages))
+
+    def _matrix(self):
+        """Return (matrix, (filenames, pages)) of L2-normalized page vectors for live pages"""
+        self._refresh()
+        generation = self.manifest["generation"]
+        if self._cache is not None and self._cache[0] == generation:
+            return self._cache[1], self._cache[2]
+
+        # scipy is only needed once "more like this" is used, so it is not loaded with the rest of the app
+        from scipy import sparse
+
+        for attempt in range(LOAD_ATTEMPTS):
+            try:
+                blocks, rows = self._load_blocks()
+                break
+            except FileNotFoundError:
+                # Another process replaced segment files after we read the manifest; its new manifest is saved already
+                if attempt == LOAD_ATTEMPTS - 1:
+                    raise
+                self._refresh()
+                generation = self.manifest["generation"]
+        n_terms = self.manifest["terms"]
+
+        if not len(rows[1]):
+            self._cache = (generation, None, rows)
+            return None, rows
+
+        matrix = sparse.vstack(blocks, format="csr", dtype=np.float32)
+
+        # Sublinear term frequency times smoothed inverse document frequency
+        doc_frequency = np.bincount(matrix.indices, minlength=n_terms)
+        idf = np.log((1 + matrix.shape[0]) / (1 + doc_frequency)) + 1
+        matrix.data = (1 + np.log(matrix.data)) * idf[matrix.indices].astype(np.float32)
+        matrix = self._normalize(matrix)
+
+        if self.svd_components and min(matrix.shape) > self.svd_components:
+            matrix = self._reduce(matrix, generation)
+
+        self._cache = (generation, matrix, rows)
+        return matrix, rows
+
+    @staticmethod
+    def _normalize(matrix):
+        """Scale each row to unit length so dot products are cosine similarities"""
+        from scipy import sparse
+
+        if sparse.issparse(matrix):
+            norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+            norms[norms == 0] = 1
+            return sparse.diags(1 / norms).dot(matrix).tocsr()
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+    def _reduce(self, matrix, generation):
+        """Project pages onto the top singular vectors, reusing a saved projection if current"""
+        path = self._path("svd.npy")
+        meta_path = self._path("svd.json")
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta == {"generation": generation, "components": self.svd_components}:
+                return np.load(path, mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            pass
+
+        from scipy.sparse.linalg import svds
+
+        u, s, _ = svds(matrix, k=self.svd_components)
+        reduced = self._normalize((u * s).astype(np.float32))
+        _save_array(path, reduced)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump({"generation": generation, "components": self.svd_components}, f)
+        return np.load(path, mmap_mode="r")
+
+    def similar(self, filename, page, top=10):
+        """Return the pages most similar to a page, best first"""
+        with self._lock:
+            matrix, (files, pages) = self._matrix()
+        if matrix is None:
+            return None
+
+        matches = np.flatnonzero((files == filename) & (pages == page))
+        if not len(matches):
+            return None
+        # The most recently added copy of the page wins
+        row = matches[-1]
+
+        # Cosine similarity against every page in one matrix-vector product
+        vector = matrix[row].toarray().ravel() if hasattr(matrix, "toarray") else np.asarray(matrix[row])
+        scores = np.asarray(matrix.dot(vector)).ravel()
+        scores[row] = -np.inf
+
+        top = min(top, len(pages) - 1)
+        if top <= 0:
+            return []
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [{"filename": str(files[i]), "page": int(pages[i]), "score": round(float(scores[i]), 4)}
+                for i in best if scores[i] > 0]
@@ -1,6 +1,42 @@
 import os
 import json
-import pandas as pd
+
+
+class JsonPageWriter:
+    """Writes one document's extracted text to JSON a batch of pages at a time.
+
+    The output matches save_to_json([document]), so load_from_json reads it
+    back unchanged, but the pages never have to be in memory together.
+    """
+
+    def __init__(self, file_path, doc_filename):
+        self.file_path = file_path
+        self.pages = 0
+        self._tmp_path = file_path + ".tmp"
+        self._file = open(self._tmp_path, 'w', encoding='utf-8')
+        self._file.write('[\n    {\n        "filename": ' + json.dumps(doc_filename, ensure_ascii=False) +
+                         ',\n        "pages": {')
+
+    def write_pages(self, pages):
+        """Append a {page_num: text} batch"""
+        for page_num, text in pages.items():
+            self._file.write((',' if self.pages else '') + '\n            ' + json.dumps(str(page_num)) + ': ' +
+                             json.dumps(text, ensure_ascii=False))
+            self.pages += 1
+
+    def close(self, total_pages):
+        """Finish the document and move it into place"""
+        self._file.write(('\n        ' if self.pages else '') + '},\n        "total_pages": ' +
+                         json.dumps(total_pages) + '\n    }\n]')
+        self._file.close()
+        os.replace(self._tmp_path, self.file_path)
+        return self.file_path
+
+    def abort(self):
+        """Discard a partly written document"""
+        self._file.close()
+        os.remove(self._tmp_path)
+
 
 class DataStorage:
     def __init__(self, data_dir):
@@ -13,6 +49,10 @@ class DataStorage:
             json.dump(data, f, ensure_ascii=False, indent=4)
         return file_path
     
+    def page_writer(self, doc_filename, filename=None):
+        """Open a JsonPageWriter for a document, named like save_to_json's per-document files."""
+        return JsonPageWriter(os.path.join(self.data_dir, filename or f"{doc_filename}.json"), doc_filename)
+    
     def save_to_parquet(self, data, filename="extracted_text.parquet"):
         """Convert data to a DataFrame and save as Parquet."""
         # Flatten the data for DataFrame storage
@@ -25,11 +65,23 @@ class DataStorage:
                     "text": page_text
                 })
         
+        import pandas as pd  # Only needed for Parquet, so not loaded with the rest of the app
         df = pd.DataFrame(flattened_data)
         file_path = os.path.join(self.data_dir, filename)
         df.to_parquet(file_path, compression='zstd')
         return file_path
     
+    def rename_json(self, old_filename, new_filename):
+        """Move a document's extracted text to a new name, updating the filename it records."""
+        data = self.load_from_json(f"{old_filename}.json")
+        if data is None:
+            return None
+        for doc in data:
+            doc["filename"] = new_filename
+        file_path = self.save_to_json(data, f"{new_filename}.json")
+        os.remove(os.path.join(self.data_dir, f"{old_filename}.json"))
+        return file_path
+
     def load_from_json(self, filename="extracted_text.json"):
         """Load data from a JSON file."""
         file_path = os.path.join(self.data_dir, filename)
@@ -42,5 +94,6 @@ class DataStorage:
         """Load data from a Parquet file."""
         file_path = os.path.join(self.data_dir, filename)
         if os.path.exists(file_path):
+            import pandas as pd
             return pd.read_parquet(file_path)
         return None 
\ No newline at end of file
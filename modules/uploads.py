@@ -0,0 +1,175 @@
+import os
+import tempfile
+
+from werkzeug.sansio.multipart import MultipartDecoder, File, Data, Epilogue, NeedData
+
+from modules.extraction_cache import new_hasher
+
+# PDF readers accept the header anywhere in the first kilobyte
+PDF_HEADER = b"%PDF-"
+HEADER_WINDOW = 1024
+
+# Bytes after a multipart boundary within which its line break ends it ("--" and CRLF at most)
+BOUNDARY_SUFFIX = 4
+
+
+class UploadError(Exception):
+    """An uploaded file was rejected; the message is the reason"""
+
+
+class StreamingUpload:
+    """Writes one uploaded file to a temporary file next to its destination.
+
+    Chunks are hashed and written as they arrive and the PDF header is checked
+    as soon as the first kilobyte is in. finish() moves the file into place
+    without ever replacing an existing file.
+    """
+
+    def __init__(self, directory, filename):
+        self.path = os.path.join(directory, filename)
+        self.filename = filename
+        self.size = 0
+        self._hasher = new_hasher()
+        self._head = b""
+        fd, self._tmp_path = tempfile.mkstemp(prefix=".upload-", suffix=".part", dir=directory)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, chunk):
+        if len(self._head) < HEADER_WINDOW:
+            self._head += chunk[:HEADER_WINDOW - len(self._head)]
+            if len(self._head) >= HEADER_WINDOW:
+                self._check_header()
+        self._hasher.update(chunk)
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def _check_header(self):
+        if PDF_HEADER not in self._head:
+            raise UploadError("not a PDF file")
+
+    def finish(self):
+        """Move the file into place and return its content hash"""
+        self._check_header()
+        self._file.close()
+        try:
+            # A hard link fails instead of overwriting a file uploaded meanwhile
+            os.link(self._tmp_path, self.path)
+        except FileExistsError:
+            raise UploadError("a file with this name already exists")
+        finally:
+            os.remove(self._tmp_path)
+        return self._hasher.hexdigest()
+
+    def abort(self):
+        """Discard a partly received file"""
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+def receive_body(stream, filename, directory, accept, on_file, on_skip, chunk_size=1024 * 1024):
+    """Stream a request body holding a single file to disk; see receive_multipart"""
+    try:
+        upload = StreamingUpload(directory, accept(filename))
+    except UploadError as e:
+        on_skip(filename, str(e))
+        return
+    try:
+        for chunk in iter(lambda: stream.read(chunk_size), b""):
+            upload.write(chunk)
+        digest = upload.finish()
+    except UploadError as e:
+        upload.abort()
+        on_skip(upload.filename, str(e))
+        return
+    except BaseException:
+        upload.abort()
+        raise
+    on_file(upload.filename, upload.path, digest, upload.size)
+
+
+def _split_unfinished_boundary(fed, data, delimiter):
+    """Split data into what can go to the decoder now and what must wait for more of the body.
+
+    MultipartDecoder hands out the CR before a boundary as part of the file
+    when its buffer ends after a complete boundary but before the line break
+    that follows it, so a body is never cut there. fed is the tail of what the
+    decoder was already given.
+    """
+    window = fed + data
+    index = window.rfind(delimiter)
+    if index == -1:
+        return data, b""
+    after = window[index + len(delimiter):]
+    if b"\n" in after or len(after) >= BOUNDARY_SUFFIX:
+        return data, b""
+    cut = max(index - len(fed), 0)
+    return data[:cut], data[cut:]
+
+
+def receive_multipart(stream, boundary, directory, accept, on_file, on_skip, chunk_size=1024 * 1024):
+    """Stream every file part of a multipart/form-data body to disk.
+
+    accept(filename) returns the name to save a part under, or raises
+    UploadError to skip it. on_file(filename, path, digest, size) is called as
+    soon as each file is complete, and on_skip(filename, reason) for each
+    rejected one, while the rest of the body is still being received.
+    """
+    decoder = MultipartDecoder(boundary)
+    delimiter = b"--" + boundary
+    fed = held = b""
+    upload = None
+    skipped = None
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            if chunk:
+                data, held = _split_unfinished_boundary(fed, held + chunk, delimiter)
+                fed = (fed + data)[-(len(delimiter) + BOUNDARY_SUFFIX):]
+                decoder.receive_data(data)
+            else:
+                # The end of the body also ends any boundary held back
+                decoder.receive_data(held)
+                decoder.receive_data(None)
+            event = decoder.next_event()
+            while not isinstance(event, (Epilogue, NeedData)):
+                if isinstance(event, File):
+                    upload, skipped = None, None
+                    try:
+                        upload = StreamingUpload(directory, accept(event.filename))
+                    except UploadError as e:
+                        skipped = (event.filename, str(e))
+                elif isinstance(event, Data):
+                    if upload is not None:
+                        try:
+                            upload.write(event.data)
+                            if not event.more_data:
+                                digest = upload.finish()
+                                on_file(upload.filename, upload.path, digest, upload.size)
+                                upload = None
+                        except UploadError as e:
+                            upload.abort()
+                            skipped = (upload.filename, str(e))
+                            upload = None
+                    if skipped is not None and not event.more_data:
+                        on_skip(*skipped)
+                        skipped = None
+                event = decoder.next_event()
+            if isinstance(event, Epilogue) or not chunk:
+                break
+    except ValueError as e:
+        # The decoder rejects a body that ends before its closing boundary
+        if upload is None:
+            raise
+        upload.abort()
+        raise UploadError(f"upload of {upload.filename} was cut off") from e
+    except BaseException:
+        if upload is not None:
+            upload.abort()
+        raise
+
+    if upload is not None:
+        # The body ended in the middle of a file
+        upload.abort()
+        raise UploadError(f"upload of {upload.filename} was cut off")
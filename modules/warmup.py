@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+from collections import Counter
+
+
+class QueryLog:
+    """Append-only log of searched queries, one per line, used to pick warm-up queries"""
+
+    def __init__(self, path, max_entries=1000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def record(self, query):
+        """Append a query, trimming the log to its most recent entries once it doubles in size"""
+        query = " ".join(query.split())
+        if not query:
+            return
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(query + "\n")
+            if os.path.getsize(self.path) > self.max_entries * 200:
+                entries = self._read()
+                if len(entries) > self.max_entries * 2:
+                    with open(self.path, "w", encoding="utf-8") as f:
+                        f.writelines(entry + "\n" for entry in entries[-self.max_entries:])
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return [line.rstrip("\n") for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def top(self, count):
+        """The most frequent of the recent queries, most recent first among equals"""
+        entries = self._read()[-self.max_entries:]
+        last_seen = {query: i for i, query in enumerate(entries)}
+        counts = Counter(entries)
+        return sorted(counts, key=lambda query: (-counts[query], -last_seen[query]))[:count]
+
+
+class IndexWarmer:
+    """Warms the search index in a background thread and reports when it is ready.
+
+    Warming pages in every shard's term dictionary and columns, then runs the
+    given queries so their postings, stored fields and parsed forms are cached
+    before real traffic arrives.
+    """
+
+    def __init__(self, search_engine, queries=()):
+        self.search_engine = search_engine
+        self.queries = list(queries)
+        self.ready = False
+        self.started = None
+        self.finished = None
+        self.terms = 0
+        self.queries_run = 0
+        self.error = None
+        self._thread = None
+
+    def start(self):
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._run, name="index-warmup", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self.terms = self.search_engine.warm_up()
+            for query in self.queries:
+                self.search_engine.search(query)
+                self.queries_run += 1
+        except Exception as e:
+            # A failed warm-up only costs speed; serve traffic regardless
+            print(f"Index warm-up error: {str(e)}")
+            self.error = str(e)
+        self.finished = time.time()
+        self.ready = True
+        print(f"Index warm-up finished in {self.finished - self.started:.2f}s "
+              f"({self.terms} terms, {self.queries_run} queries)")
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "terms": self.terms,
+            "queries": len(self.queries),
+            "queries_run": self.queries_run,
+            "duration": round((self.finished or time.time()) - self.started, 3) if self.started else None,
+            "error": self.error
+        }
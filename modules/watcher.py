@@ -0,0 +1,277 @@
+import os
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+from collections import OrderedDict
+
+# inotify event flags (see inotify(7))
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+
+FILE_CHANGES = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    _libc.inotify_init1
+except (OSError, AttributeError):  # Not Linux; callers fall back to polling
+    _libc = None
+
+
+def inotify_available():
+    return _libc is not None
+
+
+class Inotify:
+    """Minimal inotify(7) binding over ctypes for watching one directory.
+
+    read() returns (mask, name) pairs for the changes seen within the timeout.
+    A (IN_Q_OVERFLOW, None) event means the kernel dropped events and the
+    directory should be rescanned.
+    """
+
+    def __init__(self, directory, mask=FILE_CHANGES):
+        if _libc is None:
+            raise OSError("inotify is not available on this platform")
+        self.fd = _libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if _libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"cannot watch {directory}")
+
+    def read(self, timeout=None):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            events.append((mask, os.fsdecode(name) if name else None))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def scan_directory(directory, suffix=".pdf"):
+    """Map each matching file in a directory to its (size, mtime)"""
+    files = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(suffix) and entry.is_file():
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files[entry.name] = (stat.st_size, stat.st_mtime)
+    return files
+
+
+class DirectoryWatcher:
+    """Background thread that reports files added to, changed in or removed from a directory.
+
+    known() gives the (size, mtime) of every file already handled, and the
+    directory is compared against it at start. After that changes come from
+    inotify where available, or from rescanning every interval seconds. A file
+    is only reported once its size and mtime have held still for settle
+    seconds, so files still being copied in are not picked up half-written.
+    on_change(name) and on_remove(name) are called from the watcher thread and
+    should only queue work.
+    """
+
+    def __init__(self, directory, on_change, on_remove, known, settle=2.0, interval=10, use_inotify=True,
+                 suffix=".pdf"):
+        self.directory = directory
+        self.on_change = on_change
+        self.on_remove = on_remove
+        self.known = known
+        self.settle = settle
+        self.interval = interval
+        self.use_inotify = use_inotify and inotify_available()
+        self.suffix = suffix
+        self.last_scan = None
+        self._state = {}  # name -> (size, mtime) as last reported
+        self._pending = {}  # name -> (time of its latest change, (size, mtime) or None)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="directory-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _stat(self, name):
+        try:
+            stat = os.stat(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            return None
+        return (stat.st_size, stat.st_mtime)
+
+    def _rescan(self):
+        """Mark every file that differs from what was last reported"""
+        on_disk = scan_directory(self.directory, self.suffix)
+        for name in set(on_disk) | set(self._state):
+            if on_disk.get(name) != self._state.get(name) and name not in self._pending:
+                self._pending[name] = (time.time(), on_disk.get(name))
+        self.last_scan = time.time()
+
+    def _flush_settled(self):
+        """Report the pending files that have not changed for settle seconds"""
+        now = time.time()
+        for name, (changed_at, seen) in list(self._pending.items()):
+            current = self._stat(name)
+            if current != seen:
+                self._pending[name] = (now, current)
+            elif now - changed_at >= self.settle:
+                del self._pending[name]
+                if current is None:
+                    if self._state.pop(name, None) is not None:
+                        self.on_remove(name)
+                elif self._state.get(name) != current:
+                    self._state[name] = current
+                    self.on_change(name)
+
+    def _run(self):
+        try:
+            self._state = dict(self.known())
+            self._rescan()
+        except Exception as e:
+            print(f"Directory watcher error: {str(e)}")
+
+        inotify = None
+        if self.use_inotify:
+            try:
+                inotify = Inotify(self.directory)
+            except OSError as e:
+                print(f"Directory watch error, polling instead: {str(e)}")
+                self.use_inotify = False
+
+        try:
+            while not self._stop.is_set():
+                try:
+                    if inotify is not None:
+                        for mask, name in inotify.read(timeout=min(1.0, self.settle)):
+                            if mask & IN_Q_OVERFLOW:
+                                self._rescan()
+                            elif name and name.lower().endswith(self.suffix) and name not in self._pending:
+                                self._pending[name] = (time.time(), self._stat(name))
+                    else:
+                        self._stop.wait(min(self.interval, self.settle) if self._pending else self.interval)
+                        if time.time() - (self.last_scan or 0) >= self.interval:
+                            self._rescan()
+                    self._flush_settled()
+                except Exception as e:
+                    print(f"Directory watcher error: {str(e)}")
+                    self._stop.wait(1)
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+    def status(self):
+        return {
+            "running": self._thread is not None,
+            "mode": "inotify" if self.use_inotify else "polling",
+            "settling": len(self._pending),
+            "last_scan": self.last_scan
+        }
+
+
+class IngestQueue:
+    """Applies queued file changes one at a time, at a bounded rate.
+
+    Changes to the same file collapse into the latest one. The worker starts
+    at most rate files per second and, before each file, waits until ready()
+    returns True, so a large drop of files is worked through steadily without
+    flooding the index writer or competing with searches for it.
+    """
+
+    def __init__(self, handler, rate=2.0, ready=None):
+        self.handler = handler
+        self.rate = rate
+        self.ready = ready
+        self.processed = 0
+        self.failed = 0
+        self.current = None
+        self._queue = OrderedDict()  # name -> kind
+        self._condition = threading.Condition()
+        self._stop = False
+        self._thread = None
+
+    def put(self, kind, name):
+        with self._condition:
+            self._queue.pop(name, None)
+            self._queue[name] = kind
+            if self._thread is None:
+                self._stop = False
+                self._thread = threading.Thread(target=self._run, name="ingest-queue", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            thread, self._thread = self._thread, None
+            self._stop = True
+            self._condition.notify()
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        last_start = 0
+        while True:
+            with self._condition:
+                while not self._queue and not self._stop:
+                    self._condition.wait()
+                if self._stop:
+                    return
+                name, kind = self._queue.popitem(last=False)
+
+            while self.ready is not None and not self.ready() and not self._stop:
+                time.sleep(0.2)
+            if self.rate:
+                delay = last_start + 1 / self.rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            last_start = time.time()
+
+            self.current = name
+            try:
+                self.handler(kind, name)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Error handling {kind} of {name}: {str(e)}")
+            self.current = None
+
+    def status(self):
+        with self._condition:
+            queued = len(self._queue)
+        return {
+            "queued": queued,
+            "current": self.current,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rate": self.rate
+        }
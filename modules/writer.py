@@ -0,0 +1,123 @@
+import queue
+import threading
+import time
+
+
+class WriteOp:
+    """A queued index change; wait() blocks until it has been committed"""
+
+    def __init__(self, kind, payload=None):
+        self.kind = kind
+        self.payload = payload
+        self.error = None
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def finish(self, error=None):
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """Wait for the commit; returns False on timeout and raises if the commit failed"""
+        if not self._done.wait(timeout):
+            return False
+        if self.error is not None:
+            raise self.error
+        return True
+
+
+class IndexWriterThread:
+    """A single thread that owns index writes and coalesces queued operations.
+
+    Operations queued within commit_interval seconds of the first one (up to
+    max_batch of them) are passed together to apply_batch, which writes and
+    commits them. Queueing a "flush" operation ends the window at once, which
+    is how callers get read-your-writes.
+    """
+
+    def __init__(self, apply_batch, commit_interval=1.0, max_batch=256, name="index-writer"):
+        self.apply_batch = apply_batch
+        self.commit_interval = commit_interval
+        self.max_batch = max_batch
+        self.name = name
+        self.batches = 0
+        self.operations = 0
+        self.last_commit = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, kind, payload=None):
+        """Queue an operation and return it without waiting"""
+        op = WriteOp(kind, payload)
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._queue.put(op)
+        return op
+
+    def flush(self, timeout=None):
+        """Commit everything queued so far and wait for it"""
+        with self._lock:
+            if self._thread is None:
+                return True
+        return self.submit("flush").wait(timeout)
+
+    def pending(self):
+        """Number of operations waiting to be written"""
+        return self._queue.qsize()
+
+    def stop(self):
+        """Write whatever is queued, then stop the thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            self._queue.put(None)
+        thread.join()
+
+    def _run(self):
+        while True:
+            op = self._queue.get()
+            if op is None:
+                return
+
+            # Collect more operations until the commit window closes
+            batch = [op]
+            deadline = time.time() + self.commit_interval
+            stopping = False
+            while op.kind != "flush" and len(batch) < self.max_batch:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    op = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if op is None:
+                    stopping = True
+                    break
+                batch.append(op)
+
+            self._apply(batch)
+            if stopping:
+                return
+
+    def _apply(self, batch):
+        error = None
+        try:
+            self.apply_batch(batch)
+            self.batches += 1
+            self.operations += len(batch)
+            self.last_commit = time.time()
+        except Exception as e:
+            print(f"Index write error: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            error = e
+        for op in batch:
+            op.finish(error)
@@ -0,0 +1,29 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.extraction_cache import ExtractionCache
+
+DIGEST = "ab" * 20
+
+
+def _cache_pages(cache, text, words):
+    writer = cache.writer(DIGEST, words=words)
+    writer.write_page(0, text, {})
+    writer.close(1)
+
+
+def test_entry_with_words_replaces_one_without(tmp_path):
+    cache = ExtractionCache(str(tmp_path))
+    _cache_pages(cache, "first", words=False)
+    assert not cache.contains(DIGEST, words=True)
+
+    _cache_pages(cache, "with words", words=True)
+    assert cache.contains(DIGEST, words=True)
+    assert [text for _, text, _ in cache.iter_pages(DIGEST)] == ["with words"]
+
+    # An entry without words never replaces one with them
+    _cache_pages(cache, "again", words=False)
+    assert [text for _, text, _ in cache.iter_pages(DIGEST)] == ["with words"]
+    assert sorted(os.listdir(str(tmp_path))) == [DIGEST[:2]]
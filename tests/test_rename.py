@@ -0,0 +1,75 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pymupdf = pytest.importorskip("pymupdf")
+
+import modules.indexer
+import modules.services
+from modules.indexer import Indexer
+from modules.services import Services
+
+
+@pytest.fixture
+def services(tmp_path, monkeypatch):
+    """Services with every store in a temporary directory"""
+    paths = {name: str(tmp_path / name.lower()) for name in
+             ("PDF_DIR", "DATA_DIR", "INDEX_DIR", "SIMILARITY_DIR", "LAYOUT_DIR", "EXTRACT_CACHE_DIR")}
+    for path in paths.values():
+        os.makedirs(path)
+    paths.update(CATALOG_DB=str(tmp_path / "catalog.db"), QUARANTINE_FILE=str(tmp_path / "quarantine.json"))
+    for name, path in paths.items():
+        monkeypatch.setattr(modules.services, name, path)
+        if hasattr(modules.indexer, name):
+            monkeypatch.setattr(modules.indexer, name, path)
+    monkeypatch.setattr(modules.services, "LAYOUT_WORDS", True)
+    services = Services(extract_workers=1)
+    yield services
+    services.close()
+
+
+def _write_pdf(path, text):
+    doc = pymupdf.open()
+    doc.new_page().insert_text((72, 72), text)
+    doc.save(path)
+    doc.close()
+
+
+def test_rename_moves_every_store(services, capsys):
+    pdf_dir = services.pdf_dir
+    _write_pdf(os.path.join(pdf_dir, "old.pdf"), "zebra giraffe antelope savanna")
+    _write_pdf(os.path.join(pdf_dir, "other.pdf"), "zebra giraffe lion savanna")
+    for name in ("old.pdf", "other.pdf"):
+        assert services.ingestor.ingest(os.path.join(pdf_dir, name)) is not None
+    services.search_engine.flush()
+
+    os.rename(os.path.join(pdf_dir, "old.pdf"), os.path.join(pdf_dir, "new.pdf"))
+    Indexer(services).rename("old.pdf", "new.pdf")
+    services.search_engine.flush()
+
+    engine = services.search_engine
+    assert sorted(r["filename"] for r in engine.search("antelope", group_by_file=False)["results"]) == ["new.pdf"]
+    assert engine.search("zebra", filename="old.pdf")["total"] == 0
+    assert engine.matching_pages("new.pdf", "zebra") == [0]
+
+    similarity = services.similarity_index
+    assert [r["filename"] for r in similarity.similar("other.pdf", 0)] == ["new.pdf"]
+    assert similarity.similar("old.pdf", 0) is None
+
+    layout = services.layout_store
+    analyzer = engine.schema["content"].analyzer
+    highlights = layout.highlights("new.pdf", 0, engine.highlight_terms("antelope"), analyzer)
+    assert [m["word"] for m in highlights["matches"]] == ["antelope"]
+    assert layout.highlights("old.pdf", 0, {"antelop"}, analyzer) is None
+
+    catalog = services.document_catalog
+    assert catalog.get("new.pdf")["status"] == "indexed"
+    assert catalog.get("old.pdf") is None
+
+    # The cached extraction follows the file, so ingesting it again does not extract it again
+    capsys.readouterr()
+    services.ingestor.reingest(os.path.join(pdf_dir, "new.pdf"))
+    assert "Reusing cached extraction for new.pdf" in capsys.readouterr().out
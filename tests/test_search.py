@@ -0,0 +1,138 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.search import SearchEngine
+
+
+def _document(filename, *pages):
+    return {"filename": filename, "pages": dict(enumerate(pages))}
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = SearchEngine(str(tmp_path / "index"), timeout=5)
+    yield engine
+    engine.close()
+
+
+def test_search_within_file_with_timeout(engine):
+    engine.index_documents([_document(f"doc{i}.pdf", "the quick brown fox " * (i + 1), "nothing here")
+                            for i in range(3)]).wait()
+
+    results = engine.search("fox", filename="doc1.pdf", group_by_file=False)["results"]
+    assert [(r["filename"], r["page"]) for r in results] == [("doc1.pdf", 0)]
+
+    # Restricting to a file does not change how its pages score
+    unfiltered = {r["filename"]: r["score"] for r in engine.search("fox", group_by_file=False)["results"]}
+    assert results[0]["score"] == pytest.approx(unfiltered["doc1.pdf"])
+
+
+def test_search_within_unindexed_file(engine):
+    engine.index_documents([_document("doc0.pdf", "the quick brown fox")]).wait()
+    assert engine.search("fox", filename="missing.pdf")["total"] == 0
+
+
+def _with_duplicate(engine):
+    """Index three documents, then c.pdf whose first page duplicates doc0.pdf's first page"""
+    pages = [f"the quick fox number {i} jumps over " + " ".join(f"word{i}x{k}" for k in range(60)) for i in range(3)]
+    engine.index_documents([_document(f"doc{i}.pdf", page, f"unrelated page {i}") for i, page in enumerate(pages)])
+    engine.index_documents([_document("c.pdf", pages[0], "another fox with different words")]).wait()
+
+
+def test_search_within_file_with_duplicates(engine):
+    _with_duplicate(engine)
+    results = engine.search("fox", filename="c.pdf", group_by_file=False)["results"]
+    assert sorted((r["filename"], r["page"]) for r in results) == [("c.pdf", 0), ("c.pdf", 1)]
+    assert engine.matching_pages("c.pdf", "fox") == [0, 1]
+
+
+def test_count_matches_search_totals(engine):
+    _with_duplicate(engine)
+    results = engine.search("fox", group_by_file=False)
+    count = engine.count("fox")
+    assert count == {"total": results["total"], "file_count": results["file_count"]}
+    assert engine.facets("fox")["files"]["c.pdf"] == 2
+
+
+def test_search_within_file_after_reset(engine):
+    engine.index_documents([_document("old.pdf", "the quick brown fox")]).wait()
+    assert engine.search("fox", filename="old.pdf")["total"] == 1
+
+    # The recreated index reaches the same generation with different documents
+    engine.reset()
+    engine.index_documents([_document("new.pdf", "the quick brown fox")]).wait()
+    assert engine.search("fox", filename="new.pdf")["total"] == 1
+    assert engine.search("fox", filename="old.pdf")["total"] == 0
+
+
+def test_older_schema_requires_reindex(tmp_path):
+    from whoosh import index
+    from whoosh.fields import Schema, TEXT, ID
+
+    index_dir = str(tmp_path / "index")
+    os.makedirs(index_dir)
+    old = index.create_in(index_dir, Schema(doc_id=ID(stored=True, unique=True), content=TEXT(stored=True)))
+    with old.writer() as writer:
+        writer.add_document(doc_id="old.pdf:0", content="the quick brown fox")
+
+    engine = SearchEngine(index_dir, timeout=5)
+    try:
+        # The old index is kept and reported rather than silently emptied
+        assert engine.needs_reindex()
+        assert index.open_dir(index_dir).doc_count() == 1
+        assert engine.search("fox")["total"] == 0
+        with pytest.raises(RuntimeError):
+            engine.index_documents([_document("new.pdf", "the quick brown fox")]).wait()
+
+        engine.reset()
+        assert not engine.needs_reindex()
+        engine.index_documents([_document("new.pdf", "the quick brown fox")]).wait()
+        assert engine.search("fox")["total"] == 1
+    finally:
+        engine.close()
+
+
+@pytest.mark.parametrize("shards", [1, 3])
+def test_words_only_on_a_near_duplicate_are_found(tmp_path, shards):
+    engine = SearchEngine(str(tmp_path / "index"), shards=shards, timeout=5)
+    try:
+        base = "the quick fox jumps over " + " ".join(f"word{k}" for k in range(60))
+        engine.index_documents([_document("a.pdf", base)])
+        engine.index_documents([_document("b.pdf", base + " zebra")]).wait()
+
+        results = engine.search("zebra", group_by_file=False)["results"]
+        assert [(r["filename"], r["page"]) for r in results] == [("b.pdf", 0)]
+        assert "zebra" in results[0]["highlight"]
+        assert engine.matching_pages("b.pdf", "zebra") == [0]
+        assert engine.search("fox zebra")["total"] == 1
+
+        # Both pages match a shared word; collapsing lists b.pdf under a.pdf
+        assert engine.search("fox", group_by_file=False)["total"] == 2
+        collapsed = engine.search("fox", group_by_file=False, collapse_duplicates=True)["results"]
+        assert [r["filename"] for r in collapsed] == ["a.pdf"]
+        assert collapsed[0]["duplicates"] == [{"filename": "b.pdf", "page": 0}]
+    finally:
+        engine.close()
+
+
+def test_failed_and_empty_searches_report_partial(engine, monkeypatch):
+    assert engine.search("")["partial"] is False
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("shard unavailable")
+
+    monkeypatch.setattr(engine, "_run_search", fail)
+    assert engine.search("fox")["partial"] is False
+
+
+def test_wildcard_expansions_are_capped(tmp_path):
+    engine = SearchEngine(str(tmp_path / "index"), max_expansions=2, timeout=5)
+    try:
+        engine.index_documents([_document(f"doc{i}.pdf", f"prefix{i}") for i in range(5)]).wait()
+        assert engine.search("prefix*")["total"] == 2
+    finally:
+        engine.close()
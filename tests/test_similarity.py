@@ -0,0 +1,27 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.similarity import SimilarityIndex
+
+
+def _document(filename, *pages):
+    return {"filename": filename, "pages": dict(enumerate(pages))}
+
+
+def test_changes_reach_other_readers(tmp_path):
+    writer = SimilarityIndex(str(tmp_path))
+    reader = SimilarityIndex(str(tmp_path))
+    writer.add_documents([_document("a.pdf", "red green blue"), _document("b.pdf", "red green yellow")])
+    writer.add_documents([_document("c.pdf", "red green purple")])
+    assert {r["filename"] for r in reader.similar("a.pdf", 0)} == {"b.pdf", "c.pdf"}
+
+    writer.remove_document("b.pdf")
+    writer.rename_document("c.pdf", "renamed.pdf")
+    assert [r["filename"] for r in reader.similar("a.pdf", 0)] == ["renamed.pdf"]
+    assert reader.similar("b.pdf", 0) is None
+    assert reader.similar("c.pdf", 0) is None
+
+    # The manifest lists segments only; row names and deletions live beside them
+    assert "a.pdf" not in open(os.path.join(str(tmp_path), "manifest.json"), encoding="utf-8").read()
@@ -0,0 +1,108 @@
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.extraction_cache import file_digest
+from modules.uploads import UploadError, receive_body, receive_multipart
+
+BOUNDARY = b"----upload-test-boundary"
+
+
+def _pdf(seed):
+    return b"%PDF-1.4\n" + bytes((seed * 31 + i) % 256 for i in range(3000))
+
+
+def _multipart(*parts):
+    body = b""
+    for filename, content in parts:
+        body += (b"--" + BOUNDARY + b"\r\n" +
+                 f'Content-Disposition: form-data; name="files"; filename="{filename}"\r\n'.encode() +
+                 b"Content-Type: application/octet-stream\r\n\r\n" + content + b"\r\n")
+    return body + b"--" + BOUNDARY + b"--\r\n"
+
+
+class Receiver:
+    """Collects the callbacks the upload functions make, with the /api/upload filename rule"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}
+        self.skipped = {}
+
+    def accept(self, name):
+        if not name.lower().endswith(".pdf"):
+            raise UploadError("not a .pdf file")
+        return name
+
+    def on_file(self, filename, path, digest, size):
+        self.files[filename] = (path, digest, size)
+
+    def on_skip(self, filename, reason):
+        self.skipped[filename] = reason
+
+    def receive(self, body, chunk_size):
+        receive_multipart(io.BytesIO(body), BOUNDARY, self.directory, self.accept, self.on_file, self.on_skip,
+                          chunk_size)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 4096])
+def test_parts_split_across_chunks(tmp_path, chunk_size):
+    receiver = Receiver(str(tmp_path))
+    receiver.receive(_multipart(("a.pdf", _pdf(1)), ("b.pdf", _pdf(2))), chunk_size)
+
+    assert sorted(receiver.files) == ["a.pdf", "b.pdf"]
+    for seed, name in enumerate(["a.pdf", "b.pdf"], 1):
+        path, digest, size = receiver.files[name]
+        with open(path, "rb") as f:
+            assert f.read() == _pdf(seed)
+        assert digest == file_digest(path)
+        assert size == len(_pdf(seed))
+    assert sorted(os.listdir(str(tmp_path))) == ["a.pdf", "b.pdf"]
+
+
+def test_non_pdf_parts_are_skipped(tmp_path):
+    receiver = Receiver(str(tmp_path))
+    receiver.receive(_multipart(("notes.txt", b"plain text"), ("fake.pdf", b"not a pdf " * 200),
+                                ("real.pdf", _pdf(3))), 64)
+
+    assert receiver.skipped == {"notes.txt": "not a .pdf file", "fake.pdf": "not a PDF file"}
+    assert sorted(receiver.files) == ["real.pdf"]
+    assert sorted(os.listdir(str(tmp_path))) == ["real.pdf"]
+
+
+def test_truncated_body_leaves_no_partial_file(tmp_path):
+    receiver = Receiver(str(tmp_path))
+    body = _multipart(("a.pdf", _pdf(1)), ("b.pdf", _pdf(2)))
+    cut = body.index(b'filename="b.pdf"') + 1500
+
+    with pytest.raises(UploadError):
+        receiver.receive(body[:cut], 256)
+    assert sorted(receiver.files) == ["a.pdf"]
+    assert sorted(os.listdir(str(tmp_path))) == ["a.pdf"]
+
+
+def test_raw_body_upload(tmp_path):
+    receiver = Receiver(str(tmp_path))
+    receive_body(io.BytesIO(_pdf(4)), "raw.pdf", str(tmp_path), receiver.accept, receiver.on_file,
+                 receiver.on_skip, chunk_size=100)
+    receive_body(io.BytesIO(b"not a pdf " * 200), "bad.pdf", str(tmp_path), receiver.accept, receiver.on_file,
+                 receiver.on_skip, chunk_size=100)
+
+    path, digest, size = receiver.files["raw.pdf"]
+    assert digest == file_digest(path) and size == len(_pdf(4))
+    assert receiver.skipped == {"bad.pdf": "not a PDF file"}
+    assert sorted(os.listdir(str(tmp_path))) == ["raw.pdf"]
+
+
+def test_existing_file_is_never_replaced(tmp_path):
+    (tmp_path / "a.pdf").write_bytes(b"original")
+    receiver = Receiver(str(tmp_path))
+    receiver.receive(_multipart(("a.pdf", _pdf(1))), 512)
+
+    assert receiver.skipped == {"a.pdf": "a file with this name already exists"}
+    assert (tmp_path / "a.pdf").read_bytes() == b"original"
+    assert sorted(os.listdir(str(tmp_path))) == ["a.pdf"]
@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.search import SearchEngine
+from modules.writer import IndexWriterThread
+
+
+def _document(filename, *pages):
+    return {"filename": filename, "pages": dict(enumerate(pages))}
+
+
+@pytest.fixture(params=[0.9, 0], ids=["dedup", "no-dedup"])
+def engine(tmp_path, request):
+    # A long commit window, so everything queued below lands in one batch unless it must commit earlier
+    engine = SearchEngine(str(tmp_path / "index"), dedup_threshold=request.param, commit_interval=30)
+    yield engine
+    engine.close()
+
+
+def _files(engine, query):
+    return sorted({r["filename"] for r in engine.search(query, group_by_file=False)["results"]})
+
+
+def test_operations_apply_in_queue_order(engine):
+    engine.index_documents([_document("a.pdf", "the quick brown fox"), _document("b.pdf", "the quick brown fox")])
+    engine.remove_document("a.pdf")
+    engine.rename_document("b.pdf", "c.pdf")
+    engine.index_documents([_document("b.pdf", "a slow red fox")])
+    engine.remove_document("c.pdf")
+    started = time.time()
+    engine.flush()
+
+    # The flush ends the commit window instead of waiting it out
+    assert time.time() - started < 10
+    assert engine.writer.batches == 1
+    assert _files(engine, "fox") == ["b.pdf"]
+    assert _files(engine, "quick") == []
+
+
+def test_add_then_remove_in_one_window_leaves_file_gone(engine):
+    engine.index_documents([_document("a.pdf", "the quick brown fox")])
+    engine.remove_document("a.pdf")
+    engine.flush()
+    assert engine.search("fox")["total"] == 0
+
+
+def test_failed_commit_reaches_every_waiter():
+    calls = []
+
+    def apply_batch(batch):
+        calls.append([op.kind for op in batch])
+        if any(op.kind == "bad" for op in batch):
+            raise RuntimeError("commit failed")
+
+    writer = IndexWriterThread(apply_batch, commit_interval=30)
+    try:
+        first = writer.submit("add")
+        second = writer.submit("bad")
+        flush = writer.submit("flush")
+        for op in (first, second, flush):
+            with pytest.raises(RuntimeError, match="commit failed"):
+                op.wait(10)
+        assert calls == [["add", "bad", "flush"]]
+
+        # The thread keeps going after a failed commit
+        later = writer.submit("add")
+        assert writer.flush(10) is True
+        assert later.wait(0) is True
+        assert calls[-1] == ["add", "flush"]
+    finally:
+        writer.stop()